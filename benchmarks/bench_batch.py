@@ -0,0 +1,89 @@
+"""
+Throughput and job latency of the batch mode (`hoho_talk.batch`) by workers and executor.
+
+The scripted conversations of the example personas are replayed against a seeded stub
+ollama server (see `hoho_talk.stub_ollama`), so no GPU or model is needed.
+
+    $ python benchmarks/bench_batch.py --jobs 200 --workers 1 4 16 --latency 0.02
+"""
+
+import argparse
+import json
+import logging
+import tempfile
+from pathlib import Path
+
+from hoho_talk.batch import run_batch
+from hoho_talk.stub_ollama import StubOllamaConfig, StubOllamaServer
+
+_PERSONAS = Path(__file__).resolve().parents[1] / "examples" / "persona"
+
+
+def _write_jobs(path: Path, num_jobs: int, num_turns: int):
+    personas = sorted(_PERSONAS.glob("*.txt"))
+    with path.open("w") as fid:
+        for idx in range(num_jobs):
+            persona = personas[idx % len(personas)]
+            job = {
+                "job_id": f"job-{idx}",
+                "persona_file": str(persona),
+                "name": persona.stem.split("_")[0].capitalize(),
+                "turns": [f"Hi, this is message {turn}!" for turn in range(num_turns)],
+            }
+            fid.write(json.dumps(job) + "\n")
+
+
+def main(
+    jobs: int,
+    turns: int,
+    workers: list[int],
+    executors: list[str],
+    latency: float,
+    tokens_per_second: float,
+    revision_trials: int,
+):
+    logging.getLogger("hoho_talk").setLevel(logging.WARNING)
+    print(
+        f"{'executor':>8} {'workers':>7} {'jobs/s':>8} {'turns/s':>8} "
+        f"{'job p50 ms':>10} {'job p99 ms':>10} {'turn p50 ms':>11}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        jobs_file = Path(tmp_dir) / "jobs.jsonl"
+        _write_jobs(jobs_file, jobs, turns)
+        for executor in executors:
+            for num_workers in workers:
+                config = StubOllamaConfig(
+                    latency=latency, tokens_per_second=tokens_per_second, seed=0
+                )
+                with StubOllamaServer(config=config) as stub:
+                    report = run_batch(
+                        jobs_file,
+                        Path(tmp_dir) / f"results-{executor}-{num_workers}.jsonl",
+                        workers=num_workers,
+                        executor=executor,
+                        ollama_host=stub.url,
+                        revision_trials=revision_trials,
+                    )
+                print(
+                    f"{executor:>8} {num_workers:>7} {report['jobs_per_second']:>8.2f} "
+                    f"{report['turns_per_second']:>8.2f} "
+                    f"{report['job_latency']['p50'] * 1e3:>10.1f} "
+                    f"{report['job_latency']['p99'] * 1e3:>10.1f} "
+                    f"{report['turn_latency']['p50'] * 1e3:>11.1f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument(
+        "--executors", nargs="+", choices=["thread", "process"], default=["thread"]
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="the stub latency of a call"
+    )
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--revision-trials", type=int, default=1)
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""
+Memory, append throughput and transcript cost of `ConversationContext` vs `CompactConversationContext`.
+
+    $ python benchmarks/bench_compact_conversation.py
+"""
+
+import argparse
+import gc
+import time
+import timeit
+import tracemalloc
+
+from hoho_talk.compact import CompactConversationContext
+from hoho_talk.data import ConversationContext
+
+_MOODS = ("calm", "happy", "curious", "tired")
+
+
+def _fill(ctx: ConversationContext, size: int) -> float:
+    start = time.perf_counter()
+    for idx in range(size):
+        if idx % 2:
+            ctx.add_message(
+                by="Hoho",
+                content=f"That sounds lovely, tell me more about day {idx}!",
+                mood=_MOODS[idx % len(_MOODS)],
+                tone="warm",
+                sentiment="positive",
+            )
+        else:
+            ctx.add_message(by="user", content=f"On day {idx} I went hiking. " * 3)
+        # the agent renders the transcript every turn
+        if idx % 2:
+            ctx.transcript
+    return time.perf_counter() - start
+
+
+def _measure(ctx_cls, size: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    ctx = ctx_cls()
+    elapsed = _fill(ctx, size)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # without tracemalloc, which slows down the allocations
+    elapsed = min(elapsed, _fill(ctx_cls(), size))
+    dump = min(timeit.repeat(ctx.model_dump_json, number=1, repeat=3))
+    # the recent messages, as read by the context window and the retrieval
+    tail = min(timeit.repeat(lambda: ctx.conversation[-20:], number=10, repeat=5)) / 10
+    return {"memory": memory, "append": size / elapsed, "dump": dump, "tail": tail}
+
+
+def main(sizes: list[int]):
+    print(
+        f"{'messages':>9} {'context':>8} {'MiB':>8} {'appends/s':>10} "
+        f"{'dump ms':>8} {'tail-20 us':>10}"
+    )
+    for size in sizes:
+        for name, ctx_cls in (
+            ("list", ConversationContext),
+            ("compact", CompactConversationContext),
+        ):
+            result = _measure(ctx_cls, size)
+            print(
+                f"{size:>9} {name:>8} {result['memory'] / 2**20:>8.2f} "
+                f"{result['append']:>10.0f} {result['dump'] * 1e3:>8.1f} "
+                f"{result['tail'] * 1e6:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,79 @@
+"""
+Per-turn cost of rendering the conversation transcript for the agents.
+
+A turn adds two messages (the user's and the agent's) and renders the
+conversation 1 + 2 x `revision_trials` times (generation, critics and revisions).
+
+The messages rendered per turn must not grow with the conversation with a
+`ConversationContext` (only the new messages are rendered), which is asserted.
+
+    $ python benchmarks/bench_conversation_render.py
+"""
+
+import argparse
+import time
+
+from hoho_talk.data import ConversationContext, ConversationMessage
+from hoho_talk.utils import format_conversation
+
+_rendered_lines = 0
+_to_transcript_line = ConversationMessage.to_transcript_line
+
+
+def _counted_to_transcript_line(self: ConversationMessage) -> str:
+    global _rendered_lines
+    _rendered_lines += 1
+    return _to_transcript_line(self)
+
+
+ConversationMessage.to_transcript_line = _counted_to_transcript_line
+
+
+def _turn_cost(ctx: ConversationContext, renders: int, use_context: bool) -> float:
+    conversation = ctx if use_context else ctx.conversation
+    start = time.perf_counter()
+    ctx.add_message(by="user", content="How is the weather today? " * 4)
+    ctx.add_message(by="agent", content="It is sunny and warm, let's go out! " * 4)
+    for _ in range(renders):
+        format_conversation(conversation)
+    return time.perf_counter() - start
+
+
+def main(sizes: list[int], revision_trials: int, turns: int):
+    global _rendered_lines
+    renders = 1 + 2 * revision_trials
+    print(
+        f"{'messages':>10} {'list (us/turn)':>16} {'context (us/turn)':>18} "
+        f"{'list lines/turn':>15} {'context lines/turn':>18}"
+    )
+    context_lines = []
+    for size in sizes:
+        costs, lines = {}, {}
+        for use_context in (False, True):
+            ctx = ConversationContext()
+            for idx in range(size // 2):
+                ctx.add_message(by="user", content=f"message {idx} " * 8)
+                ctx.add_message(by="agent", content=f"reply {idx} " * 8)
+            format_conversation(ctx if use_context else ctx.conversation)
+            _rendered_lines = 0
+            costs[use_context] = (
+                sum(_turn_cost(ctx, renders, use_context) for _ in range(turns)) / turns
+            )
+            lines[use_context] = _rendered_lines / turns
+        context_lines.append(lines[True])
+        print(
+            f"{size:>10} {costs[False] * 1e6:>16.1f} {costs[True] * 1e6:>18.1f} "
+            f"{lines[False]:>15.1f} {lines[True]:>18.1f}"
+        )
+    # the time still grows with the copy of the transcript string, but not its rendering
+    assert max(context_lines) == min(context_lines), "the rendering is not incremental"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000, 10000]
+    )
+    parser.add_argument("--revision-trials", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=50)
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,129 @@
+"""
+Throughput of the group conversations (`hoho_talk.group`) by room size, speaker policy and
+lookahead, i.e. the next turns precomputed while the current turn is criticized.
+
+The personas talk to a seeded stub ollama server (see `hoho_talk.stub_ollama`), whose revisions
+differ from the drafts, so the turns precomputed on a revised draft are stale.
+No GPU or model is needed.
+
+    $ python benchmarks/bench_group.py --rooms 5 20 --lookahead 0 1 2 --rejection-rate 0.3
+"""
+
+import argparse
+import logging
+import time
+
+from hoho_talk import OllamaTalkAgent
+from hoho_talk.group import SPEAKER_POLICIES, GroupConversation
+from hoho_talk.pool import ClientPool
+from hoho_talk.stub_ollama import StubOllamaConfig, StubOllamaServer
+
+_REVISED_RESPONSE = {
+    "mood": "calm",
+    "tone": "casual",
+    "sentiment": "positive",
+    "rationale": "It is more casual.",
+    "text_response": "Hey, nice to see you all!",
+}
+
+
+def _run(
+    config: StubOllamaConfig,
+    room_size: int,
+    policy: str,
+    lookahead: int,
+    turns: int,
+    revision_trials: int,
+    seed: int,
+) -> dict:
+    with StubOllamaServer(config=config) as stub:
+        client_pool = ClientPool()
+        agents = [
+            OllamaTalkAgent(
+                name=f"Persona{idx}",
+                persona=f"Persona number {idx}, who likes to chat.",
+                client=client_pool.get(stub.url),
+                revision_trials=revision_trials,
+            )
+            for idx in range(room_size)
+        ]
+        policy_cls = SPEAKER_POLICIES[policy]
+        room = GroupConversation(
+            agents,
+            policy=policy_cls(seed=seed) if policy == "random" else policy_cls(),
+            lookahead=lookahead,
+        )
+        room.add_message(by="Host", content="Hi Persona1, what is new?")
+        start = time.perf_counter()
+        for _ in room.run(turns):
+            pass
+        elapsed = time.perf_counter() - start
+        room.close(wait=True)
+        calls = sum(
+            count for role, count in stub.calls.items() if role != "connections"
+        )
+        client_pool.close()
+    stats = room.stats()
+    return {
+        "throughput": turns / elapsed,
+        "hit_rate": stats["hits"] / turns,
+        "stale": stats["stale"] / turns,
+        "calls": calls / turns,
+    }
+
+
+def main(
+    rooms: list[int],
+    policies: list[str],
+    lookahead: list[int],
+    turns: int,
+    latency: float,
+    rejection_rate: float,
+    revision_trials: int,
+    seed: int,
+):
+    logging.getLogger("hoho_talk").setLevel(logging.WARNING)
+    print(
+        f"{'room':>5} {'policy':>12} {'lookahead':>9} {'turns/s':>8} "
+        f"{'hits/turn':>9} {'stale/turn':>10} {'calls/turn':>10}"
+    )
+    for room_size in rooms:
+        for policy in policies:
+            for num_ahead in lookahead:
+                # a fresh stub per setting, so each setting sees the same random draws
+                config = StubOllamaConfig(
+                    latency=latency,
+                    aligned_rate=1.0 - rejection_rate,
+                    seed=seed,
+                    revised_response=_REVISED_RESPONSE,
+                )
+                result = _run(
+                    config, room_size, policy, num_ahead, turns, revision_trials, seed
+                )
+                print(
+                    f"{room_size:>5} {policy:>12} {num_ahead:>9} "
+                    f"{result['throughput']:>8.2f} {result['hit_rate']:>9.2f} "
+                    f"{result['stale']:>10.2f} {result['calls']:>10.2f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=" ".join(__doc__.strip().split("\n\n")[0].split())
+    )
+    parser.add_argument("--rooms", type=int, nargs="+", default=[5, 20])
+    parser.add_argument(
+        "--policies",
+        nargs="+",
+        choices=list(SPEAKER_POLICIES),
+        default=list(SPEAKER_POLICIES),
+    )
+    parser.add_argument("--lookahead", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="the stub latency of a call"
+    )
+    parser.add_argument("--rejection-rate", type=float, default=0.3)
+    parser.add_argument("--revision-trials", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,286 @@
+"""
+Throughput, turn latency and model calls per turn of the generate -> critic -> revise pipeline.
+
+`OllamaTalkAgent` talks to a seeded stub ollama server (see `hoho_talk.stub_ollama`),
+whose latency, token speed, malformed output rate and critic rejection rate are configurable,
+across conversation lengths and `revision_trials`. No GPU or model is needed.
+
+The critic and revise models can be split from the generator (with their own latency,
+see `--model-latency`) and the critic verdicts escalated, to compare the per-role latency
+and the calls of the mixes.
+
+    $ python benchmarks/bench_pipeline.py --latency 0.005 --rejection-rate 0.5
+    $ python benchmarks/bench_pipeline.py --latency 0.02 --critic-model small \
+        --model-latency small=0.002 --escalate
+
+The outputs can carry a long reasoning and remarks after their JSON (`--think-tokens` and
+`--trailer-tokens`), to compare the tokens per turn with the generation controller
+(`--early-stop` and `--reasoning-budget`, see `hoho_talk.generation`). The continuations
+of the outputs whose reasoning is cut are counted as calls. With `--think-open`, the outputs
+leave out the opening `<think>` tag, like the models whose template opens it in the prompt.
+
+    $ python benchmarks/bench_pipeline.py --tokens-per-second 2000 --think-tokens 300 \
+        --trailer-tokens 100 --early-stop --reasoning-budget 100
+"""
+
+import argparse
+import time
+
+from hoho_talk import ConversationContext, OllamaTalkAgent
+from hoho_talk.generation import GenerationBudget
+from hoho_talk.metrics import HistogramExporter
+from hoho_talk.pool import ClientPool
+from hoho_talk.retry import RetryError, RetryPolicy
+from hoho_talk.routing import EscalationPolicy
+from hoho_talk.stub_ollama import StubOllamaConfig, StubOllamaServer
+
+_CHAT_ROLES = ("generate", "critic", "revise")
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _conversation(length: int) -> list:
+    ctx = ConversationContext()
+    for idx in range(length):
+        if idx % 2:
+            ctx.add_message(by="Hoho", content=f"I see, tell me more about {idx}.")
+        else:
+            ctx.add_message(by="user", content=f"Let me tell you about {idx}. " * 4)
+    return ctx.conversation
+
+
+def _run(
+    config: StubOllamaConfig,
+    length: int,
+    revision_trials: int,
+    turns: int,
+    max_attempts: int,
+    structured_output: bool,
+    critic_model: str,
+    revise_model: str,
+    escalation_policy: EscalationPolicy,
+    generation_budget: GenerationBudget,
+) -> dict:
+    metrics = HistogramExporter()
+    retry_policy = RetryPolicy(max_attempts=max_attempts, base_delay=0.0, jitter=0.0)
+    conversation = _conversation(length)
+    latencies = []
+    failures = 0
+    with StubOllamaServer(config=config) as stub:
+        client_pool = ClientPool()
+        agent = OllamaTalkAgent(
+            name="Hoho",
+            persona="A cheerful person.",
+            client=client_pool.get(stub.url),
+            revision_trials=revision_trials,
+            structured_output=structured_output,
+            retry_policy=retry_policy,
+            metrics_hooks=(metrics,),
+            critic_model=critic_model,
+            revise_model=revise_model,
+            escalation_policy=escalation_policy,
+            generation_budgets=(
+                None
+                if generation_budget is None
+                else {role: generation_budget for role in _CHAT_ROLES}
+            ),
+        )
+        start = time.perf_counter()
+        for _ in range(turns):
+            turn_start = time.perf_counter()
+            try:
+                # the same conversation every turn, so its length is fixed
+                agent.get_response(conversation)
+            except RetryError:
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - turn_start)
+        elapsed = time.perf_counter() - start
+        calls = {role: stub.calls.get(role, 0) for role in _CHAT_ROLES}
+        client_pool.close()
+    escalation_stats = {} if escalation_policy is None else escalation_policy.stats()
+    escalations = escalation_stats.get("rejected", 0) + escalation_stats.get(
+        "uncertain", 0
+    )
+    role_seconds = {}
+    for summary in metrics.latency_by_role():
+        count, total = role_seconds.get(summary["role"], (0, 0.0))
+        role_seconds[summary["role"]] = (
+            count + summary["count"],
+            total + summary["sum"],
+        )
+    eval_tokens = sum(
+        histogram["sum"]
+        for histogram in metrics.snapshot()["histograms"].get(
+            "hoho_talk_eval_tokens", []
+        )
+    )
+    return {
+        "throughput": turns / elapsed,
+        "p50": _percentile(latencies, 0.5),
+        "p99": _percentile(latencies, 0.99),
+        "calls": sum(calls.values()) / turns,
+        "revisions": calls["revise"] / turns,
+        "retries": sum(retry_policy.stats()["failures"].values()) / turns,
+        "accept_rate": metrics.accept_rate,
+        "tokens_per_second": eval_tokens / elapsed,
+        "tokens": eval_tokens / turns,
+        "failures": failures,
+        # the mean seconds of the calls by role
+        "role_latency": {
+            role: role_seconds[role][1] / role_seconds[role][0]
+            for role in _CHAT_ROLES
+            if role in role_seconds
+        },
+        "escalations": escalations / turns,
+    }
+
+
+def main(
+    lengths: list[int],
+    revision_trials: list[int],
+    turns: int,
+    latency: float,
+    tokens_per_second: float,
+    malformed_rate: float,
+    rejection_rate: float,
+    seed: int,
+    max_attempts: int,
+    structured_output: bool,
+    critic_model: str,
+    revise_model: str,
+    model_latency: list[str],
+    escalate: bool,
+    escalation_min_confidence: float,
+    think_tokens: int,
+    think_open: bool,
+    trailer_tokens: int,
+    early_stop: bool,
+    reasoning_budget: int,
+):
+    print(
+        f"{'messages':>8} {'trials':>6} {'turns/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'calls/turn':>10} {'revise/turn':>11} {'retries/turn':>12} "
+        f"{'accepted':>8} {'tok/s':>8} {'tok/turn':>8} {'failed':>6} "
+        f"{'escalated/turn':>14} "
+        + " ".join(f"{f'{role} ms':>10}" for role in _CHAT_ROLES)
+    )
+    for length in lengths:
+        for trials in revision_trials:
+            # a fresh stub per setting, so each setting sees the same random draws
+            config = StubOllamaConfig(
+                latency=latency,
+                tokens_per_second=tokens_per_second,
+                aligned_rate=1.0 - rejection_rate,
+                malformed_rate=malformed_rate,
+                seed=seed,
+                reasoning_tokens=think_tokens,
+                think_open=think_open,
+                trailer_tokens=trailer_tokens,
+                model_latency={
+                    model: float(seconds)
+                    for model, seconds in (item.split("=", 1) for item in model_latency)
+                },
+            )
+            escalation_policy = (
+                EscalationPolicy(min_confidence=escalation_min_confidence)
+                if escalate
+                else None
+            )
+            generation_budget = (
+                GenerationBudget(
+                    reasoning_tokens=reasoning_budget, early_stop=early_stop
+                )
+                if early_stop or reasoning_budget is not None
+                else None
+            )
+            result = _run(
+                config,
+                length,
+                trials,
+                turns,
+                max_attempts,
+                structured_output,
+                critic_model,
+                revise_model,
+                escalation_policy,
+                generation_budget,
+            )
+            accept_rate = result["accept_rate"]
+            print(
+                f"{length:>8} {trials:>6} {result['throughput']:>8.2f} "
+                f"{result['p50'] * 1e3:>8.1f} {result['p99'] * 1e3:>8.1f} "
+                f"{result['calls']:>10.2f} {result['revisions']:>11.2f} "
+                f"{result['retries']:>12.2f} "
+                f"{'-' if accept_rate is None else f'{accept_rate:.2f}':>8} "
+                f"{result['tokens_per_second']:>8.0f} {result['tokens']:>8.0f} "
+                f"{result['failures']:>6} "
+                f"{result['escalations']:>14.2f} "
+                + " ".join(
+                    f"{result['role_latency'].get(role, float('nan')) * 1e3:>10.1f}"
+                    for role in _CHAT_ROLES
+                )
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[2, 16, 64])
+    parser.add_argument("--revision-trials", type=int, nargs="+", default=[0, 1, 3])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="the seconds to the first token"
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        help="the speed of the generated tokens (unlimited by default)",
+    )
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--rejection-rate", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--structured-output", action="store_true")
+    parser.add_argument("--critic-model", help="the model of the generator by default")
+    parser.add_argument("--revise-model", help="the model of the generator by default")
+    parser.add_argument(
+        "--model-latency",
+        nargs="*",
+        default=[],
+        metavar="MODEL=SECONDS",
+        help="the latency of the models, instead of --latency",
+    )
+    parser.add_argument(
+        "--escalate",
+        action="store_true",
+        help="escalate the rejections and the uncertain verdicts to the generator model",
+    )
+    parser.add_argument("--escalation-min-confidence", type=float, default=0.7)
+    parser.add_argument(
+        "--think-tokens", type=int, default=0, help="the reasoning of the outputs"
+    )
+    parser.add_argument(
+        "--think-open",
+        action="store_true",
+        help="leave out the opening <think> tag of the outputs",
+    )
+    parser.add_argument(
+        "--trailer-tokens",
+        type=int,
+        default=0,
+        help="the remarks after the JSON of the outputs",
+    )
+    parser.add_argument(
+        "--early-stop",
+        action="store_true",
+        help="stop the calls once their JSON is received",
+    )
+    parser.add_argument(
+        "--reasoning-budget", type=int, help="the maximum reasoning tokens of the calls"
+    )
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""
+Connection setups, agent constructions and peak memory, with and without the client and agent pools.
+
+Each session is a new `OllamaTalkAgent`, as in the server mode, talking to a stub ollama server.
+Without pooling, each session gets its own `Client` and each turn constructs its
+critic and revise agents; with pooling, they come from `ClientPool` and `AgentPool`.
+
+    $ python benchmarks/bench_pooling.py
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from ollama import Client
+
+from hoho_talk import ConversationContext, OllamaTalkAgent
+from hoho_talk.pool import AgentPool, ClientPool
+from hoho_talk.stub_ollama import StubOllamaConfig, StubOllamaServer
+
+
+def _run(url: str, sessions: int, turns: int, pooled: bool) -> dict:
+    client_pool = ClientPool()
+    # an agent pool keeping no idle agents constructs the agents on every turn
+    agent_pool = AgentPool(max_idle=32 if pooled else 0)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for session in range(sessions):
+        agent = OllamaTalkAgent(
+            name=f"agent-{session}",
+            persona="A cheerful person.",
+            client=client_pool.get(url) if pooled else Client(host=url),
+            revision_trials=2,
+            agent_pool=agent_pool,
+        )
+        ctx = ConversationContext()
+        for turn in range(turns):
+            ctx.add_message(by="user", content=f"message {turn}")
+            response = agent.get_response(ctx)
+            ctx.add_message(by=agent.name, content=response.text_response)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "agents": agent_pool.stats()["created"],
+        "clients": client_pool.stats()["created"] if pooled else sessions,
+        "elapsed": elapsed,
+        "peak": peak,
+    }
+
+
+def main(sessions: int, turns: int, latency: float):
+    config = StubOllamaConfig(latency=latency, aligned_rate=0.3, seed=0)
+    total_turns = sessions * turns
+    print(
+        f"{'mode':>10} {'connections/turn':>17} {'clients':>8} "
+        f"{'agents/turn':>12} {'peak KiB':>9} {'ms/turn':>8}"
+    )
+    for pooled in (False, True):
+        with StubOllamaServer(config=config) as stub:
+            result = _run(stub.url, sessions, turns, pooled)
+            connections = stub.calls.get("connections", 0)
+        print(
+            f"{'pooled' if pooled else 'unpooled':>10} "
+            f"{connections / total_turns:>17.2f} {result['clients']:>8} "
+            f"{result['agents'] / total_turns:>12.2f} "
+            f"{result['peak'] / 1024:>9.0f} "
+            f"{result['elapsed'] / total_turns * 1e3:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.001)
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,97 @@
+"""
+Retrieval latency and prompt size of the top-k context blocks versus all the blocks.
+
+By default, the embeddings are computed by a deterministic hashed bag-of-words
+embedder, so no ollama server is needed. Pass `--host` to use ollama embeddings.
+
+    $ python benchmarks/bench_retrieval.py
+"""
+
+import argparse
+import hashlib
+import random
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from ollama import Client
+
+from hoho_talk.context_window import estimate_tokens
+from hoho_talk.data import BlockType, ContextBlock
+from hoho_talk.retrieval import ContextBlockIndex
+
+_TOPICS = ["weather", "travel", "music", "cooking", "work", "family", "sports", "books"]
+_WORDS = [f"word{idx}" for idx in range(500)]
+
+
+class _HashedEmbedder:
+    """
+    Mimic `ollama.Client.embed` with a hashed bag-of-words embedding.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, model: str, input: list[str]):
+        vectors = np.zeros((len(input), self.dim), dtype=np.float32)
+        for row, text in enumerate(input):
+            for word in text.split():
+                digest = hashlib.md5(word.encode("utf-8")).digest()
+                vectors[row, int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        return SimpleNamespace(embeddings=vectors.tolist())
+
+
+def _make_blocks(num_blocks: int, rng: random.Random) -> list[ContextBlock]:
+    return [
+        ContextBlock(
+            block_type=BlockType.memory,
+            block_content=" ".join(
+                [_TOPICS[idx % len(_TOPICS)]] * 5 + rng.choices(_WORDS, k=60)
+            ),
+        )
+        for idx in range(num_blocks)
+    ]
+
+
+def main(
+    sizes: list[int], top_k: int, queries: int, host: str, embed_model: str, seed: int
+):
+    rng = random.Random(seed)
+    client = _HashedEmbedder() if host is None else Client(host=host)
+    print(
+        f"{'blocks':>8} {'index (ms)':>12} {'search (ms)':>12} "
+        f"{'all tokens':>12} {'top-k tokens':>14} {'saved':>8}"
+    )
+    for size in sizes:
+        blocks = _make_blocks(size, rng)
+        index = ContextBlockIndex(client=client, embed_model=embed_model)
+        start = time.perf_counter()
+        index.add(blocks)
+        index_time = time.perf_counter() - start
+        all_tokens = sum(estimate_tokens(str(block)) for block in blocks)
+        search_time = 0.0
+        top_k_tokens = 0
+        for _ in range(queries):
+            query = " ".join([rng.choice(_TOPICS)] * 2 + rng.choices(_WORDS, k=20))
+            start = time.perf_counter()
+            retrieved = index.search(query, top_k)
+            search_time += time.perf_counter() - start
+            top_k_tokens += sum(estimate_tokens(str(block)) for block in retrieved)
+        top_k_tokens /= queries
+        print(
+            f"{size:>8} {index_time * 1e3:>12.2f} {search_time / queries * 1e3:>12.3f} "
+            f"{all_tokens:>12} {top_k_tokens:>14.0f} {1 - top_k_tokens / all_tokens:>8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument(
+        "--host", help="the ollama host, use the hashed embedder if not set"
+    )
+    parser.add_argument("--embed-model", default="nomic-embed-text")
+    parser.add_argument("--seed", type=int, default=0)
+    main(**vars(parser.parse_args()))
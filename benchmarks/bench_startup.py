@@ -0,0 +1,131 @@
+"""
+Startup time of the package and of the CLI, each in fresh interpreters.
+
+- `import hoho_talk`, net of the interpreter startup (`python -c pass`),
+- `python -m hoho_talk --help`,
+- and the time until the CLI prompts for the first message, with and without `--log-file`
+  (no ollama server is needed).
+
+It fails (exit code 1) if `import hoho_talk` loads the heavy dependencies,
+or takes longer than `--max-import-ms`.
+
+    $ python benchmarks/bench_startup.py --max-import-ms 50
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# not to be loaded by `import hoho_talk`
+_HEAVY_MODULES = ("ollama", "httpx", "pydantic", "hoho_talk.talk_agent")
+
+
+def _env() -> dict:
+    src = str(Path(__file__).resolve().parents[1] / "src")
+    python_path = os.environ.get("PYTHONPATH")
+    return {
+        **os.environ,
+        "PYTHONPATH": src if not python_path else f"{src}{os.pathsep}{python_path}",
+    }
+
+
+def _run_seconds(args: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args],
+            env=_env(),
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _prompt_ready_seconds(repeat: int, log_file: bool = False) -> float:
+    best = float("inf")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        persona_file = Path(tmp_dir) / "persona.txt"
+        persona_file.write_text("A cheerful person.")
+        for run in range(repeat):
+            log_args = ("--log-file", str(Path(tmp_dir) / f"log-{run}.jsonl"))
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                [
+                    *(sys.executable, "-m", "hoho_talk"),
+                    *("--name", "Hoho", "--whoami", "me"),
+                    *("--persona-file", str(persona_file)),
+                    *("--save-directory", tmp_dir),
+                    *(log_args if log_file else ()),
+                ],
+                env=_env(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            output = b""
+            while not output.endswith(b"me: "):
+                chunk = proc.stdout.read1(1024)
+                if not chunk:
+                    raise RuntimeError(f"the CLI exited before the prompt: {output!r}")
+                output += chunk
+            best = min(best, time.perf_counter() - start)
+            proc.communicate(b"q\nn\n")
+    return best
+
+
+def _loaded_heavy_modules() -> list[str]:
+    code = (
+        "import sys, hoho_talk; "
+        f"print(' '.join(m for m in {_HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        env=_env(),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return output.split()
+
+
+def main(repeat: int, max_import_ms: float = None) -> int:
+    interpreter = _run_seconds(["-c", "pass"], repeat)
+    package = _run_seconds(["-c", "import hoho_talk"], repeat) - interpreter
+    agent = _run_seconds(["-c", "from hoho_talk import OllamaTalkAgent"], repeat)
+    cli_help = _run_seconds(["-m", "hoho_talk", "--help"], repeat)
+    prompt_ready = _prompt_ready_seconds(repeat)
+    prompt_ready_logged = _prompt_ready_seconds(repeat, log_file=True)
+    print(f"{'interpreter (python -c pass)':<36} {interpreter * 1e3:>8.1f} ms")
+    print(f"{'import hoho_talk (net)':<36} {package * 1e3:>8.1f} ms")
+    print(
+        f"{'import OllamaTalkAgent (net)':<36} {(agent - interpreter) * 1e3:>8.1f} ms"
+    )
+    print(f"{'python -m hoho_talk --help':<36} {cli_help * 1e3:>8.1f} ms")
+    print(f"{'python -m hoho_talk, first prompt':<36} {prompt_ready * 1e3:>8.1f} ms")
+    print(f"{'  with --log-file':<36} {prompt_ready_logged * 1e3:>8.1f} ms")
+    failed = False
+    heavy = _loaded_heavy_modules()
+    if heavy:
+        print(f"FAIL: `import hoho_talk` loads {', '.join(heavy)}")
+        failed = True
+    if max_import_ms is not None and package * 1e3 > max_import_ms:
+        print(f"FAIL: `import hoho_talk` takes more than {max_import_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="the best of the runs")
+    parser.add_argument(
+        "--max-import-ms",
+        type=float,
+        help="the regression threshold of `import hoho_talk` (net)",
+    )
+    sys.exit(main(**vars(parser.parse_args())))
@@ -1,14 +1,55 @@
+import importlib
 import logging
 import os
+from typing import TYPE_CHECKING
 
-from .data import ConversationContext, ConversationMessage
-from .talk_agent import OllamaTalkAgent
+if TYPE_CHECKING:
+    from .async_talk_agent import AsyncOllamaTalkAgent
+    from .data import ConversationContext, ConversationMessage
+    from .talk_agent import OllamaTalkAgent
 
 logger = logging.getLogger(__name__)
-__all__ = ["OllamaTalkAgent", "ConversationContext", "ConversationMessage"]
+__all__ = [
+    "OllamaTalkAgent",
+    "AsyncOllamaTalkAgent",
+    "ConversationContext",
+    "ConversationMessage",
+]
 
+# the public names are imported on first use (PEP 562), so importing the package
+# (e.g. by `python -m hoho_talk` or a forked worker) does not load ollama and httpx
+_LAZY_NAMES = {
+    "OllamaTalkAgent": ".talk_agent",
+    "AsyncOllamaTalkAgent": ".async_talk_agent",
+    "ConversationContext": ".data",
+    "ConversationMessage": ".data",
+}
 
-def __setup_logger():
+
+def __getattr__(name: str):
+    module = _LAZY_NAMES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+_log_handler = None
+
+
+def _setup_logger():
+    """
+    Install the stream handler of the package logger, once.
+    It is called when the agents are loaded (see `talk_agent`), not on import.
+    """
+    global _log_handler
+    if _log_handler is not None:
+        return
     log_level = os.environ.get("HOHO_TALK_LOG_LEVEL", "INFO")
     try:
         log_level = int(log_level)
@@ -22,7 +63,4 @@ def __setup_logger():
     )
     logger.addHandler(strm_handle)
     logger.setLevel(log_level)
-
-
-__setup_logger()
-del __setup_logger
+    _log_handler = strm_handle
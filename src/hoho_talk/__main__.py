@@ -2,13 +2,32 @@ import argparse
 import datetime as dt
 import json
 import os
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional, Sequence
 
 import click
 
-from .data import ContextBlock, ConversationContext
-from .talk_agent import OllamaTalkAgent
+from .cache import DiskCache, LRUCache, TieredCache
+from .data import (
+    AgentResponse,
+    ContextBlock,
+    ConversationContext,
+    ConversationMessage,
+    PromptLayout,
+)
+from .metrics import HistogramExporter
+from .persistence import ConversationLog
+from .routing import EscalationPolicy
+from .store import ConversationStore
+
+if TYPE_CHECKING:
+    from .generation import GenerationBudget
+    from .talk_agent import OllamaTalkAgent
+
+_ROLES = ("generate", "critic", "revise")
 
 
 def main(
@@ -19,6 +38,34 @@ def main(
     context_blocks_file: Optional[Path] = None,
     model: str = "qwq:latest",
     save_directory: Optional[str] = None,
+    stream: bool = False,
+    prompt_layout: PromptLayout = PromptLayout.legacy,
+    critic_cache_dir: Optional[Path] = None,
+    num_candidates: int = 1,
+    structured_output: bool = False,
+    max_attempts: int = 5,
+    deadline: Optional[float] = 300.0,
+    token_budget: Optional[int] = None,
+    retrieval_top_k: Optional[int] = None,
+    embed_model: str = "nomic-embed-text",
+    embedding_cache_dir: Optional[Path] = None,
+    update_memory: bool = False,
+    log_file: Optional[Path] = None,
+    resume_last: Optional[int] = None,
+    store_db: Optional[Path] = None,
+    resume_conversation_id: Optional[str] = None,
+    metrics_file: Optional[Path] = None,
+    response_cache_size: int = 0,
+    response_cache_dir: Optional[Path] = None,
+    critic_model: Optional[str] = None,
+    revise_model: Optional[str] = None,
+    escalate: bool = False,
+    escalation_model: Optional[str] = None,
+    escalation_min_confidence: Optional[float] = 0.7,
+    num_predict: Sequence[tuple[str, int]] = (),
+    reasoning_tokens: Sequence[tuple[str, int]] = (),
+    early_stop: bool = False,
+    log_think: bool = False,
 ):
     conversation = []
     if load_conversation is not None and load_conversation.exists():
@@ -30,14 +77,109 @@ def main(
             context_blocks = [
                 ContextBlock.model_validate_json(cb) for cb in json.load(fid)
             ]
+    conversation_log = None
+    logged_messages: list[ConversationMessage] = []
+    # the rolling summaries replace each other, so only the latest is resumed,
+    # which also covers the messages left out by `resume_last`
+    summary = None
+    if log_file is not None:
+        conversation_log = ConversationLog(log_file)
+        logged_messages, _ = conversation_log.tail(resume_last)
+        # the blocks of the log are the rolling summaries
+        summary = conversation_log.last_block()
+    store = None if store_db is None else ConversationStore(store_db)
+    stored_ctx = None
+    if resume_conversation_id is not None:
+        if store is None:
+            raise ValueError("--resume-conversation-id requires --store-db")
+        stored_ctx = store.load(resume_conversation_id, last=resume_last)
+        context_blocks.extend(
+            store.context_blocks(resume_conversation_id, summaries=False)
+        )
+        if summary is None:
+            summary = store.latest_summary(resume_conversation_id)
+    if summary is not None:
+        context_blocks.append(summary)
     with persona_file.open("r") as f:
         persona = f.read()
-    agent = OllamaTalkAgent(
-        persona=persona,
-        name=name,
-        model=model,
-        historical_context_blocks=context_blocks,
-    )
+    # the per-role latency is reported at the end of the session
+    metrics = HistogramExporter()
+    response_cache_tiers = []
+    if response_cache_size > 0:
+        response_cache_tiers.append(LRUCache(maxsize=response_cache_size))
+    if response_cache_dir is not None:
+        response_cache_tiers.append(DiskCache(response_cache_dir))
+
+    def build_agent() -> "OllamaTalkAgent":
+        # ollama (and httpx) take most of the startup time, see benchmarks/bench_startup.py
+        from .context_window import ContextWindowManager
+        from .memory import MemoryExtractor
+        from .retrieval import ContextBlockIndex
+        from .retry import RetryPolicy
+        from .talk_agent import OllamaTalkAgent
+
+        return OllamaTalkAgent(
+            persona=persona,
+            name=name,
+            model=model,
+            historical_context_blocks=context_blocks,
+            prompt_layout=prompt_layout,
+            critic_cache=(
+                LRUCache() if critic_cache_dir is None else DiskCache(critic_cache_dir)
+            ),
+            structured_output=structured_output,
+            retry_policy=RetryPolicy(max_attempts=max_attempts, deadline=deadline),
+            context_window=(
+                None
+                if token_budget is None
+                else ContextWindowManager(model=model, token_budget=token_budget)
+            ),
+            context_retriever=(
+                None
+                if retrieval_top_k is None
+                else ContextBlockIndex(
+                    embed_model=embed_model, cache_dir=embedding_cache_dir
+                )
+            ),
+            retrieval_top_k=8 if retrieval_top_k is None else retrieval_top_k,
+            memory_extractor=MemoryExtractor(model=model) if update_memory else None,
+            metrics_hooks=(metrics,),
+            response_cache=(
+                TieredCache(*response_cache_tiers) if response_cache_tiers else None
+            ),
+            critic_model=critic_model,
+            revise_model=revise_model,
+            escalation_policy=(
+                EscalationPolicy(
+                    model=escalation_model, min_confidence=escalation_min_confidence
+                )
+                if escalate
+                else None
+            ),
+            generation_budgets=_generation_budgets(
+                num_predict, reasoning_tokens, early_stop, log_think
+            ),
+        )
+
+    # the agent is built while the user types the first message
+    loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agent-loader")
+    agent_future = loader.submit(build_agent)
+    loader.shutdown(wait=False)
+    build_errors: list[BaseException] = []
+
+    def get_agent() -> Optional["OllamaTalkAgent"]:
+        """
+        The agent, or None if it failed to build (reported once),
+        so the conversation can still be logged and saved.
+        """
+        error = agent_future.exception()
+        if error is None:
+            return agent_future.result()
+        if not build_errors:
+            build_errors.append(error)
+            click.secho(f"Failed to build the agent {name}: {error!r}", fg="red")
+        return None
+
     time_str = dt.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
     conv_dir = "conv" if save_directory is None else save_directory
     names_prefix = f"{whoami}-{name}".replace(" ", "_")
@@ -49,10 +191,18 @@ def main(
         bold=True,
     )
     with ConversationContext() as ctx:
+        if stored_ctx is not None:
+            ctx.conversation_id = stored_ctx.conversation_id
+            ctx.extend(stored_ctx.conversation)
+        ctx.extend(logged_messages)
         for msg in conversation:
             ctx.add_message(**msg)
+        num_logged = (len(ctx.conversation) - len(conversation), 0)
+        num_logged = _log_new_records(conversation_log, ctx, agent_future, *num_logged)
         for msg in ctx.conversation:
             click.echo(f"{msg}\n")
+        if agent_future.done():
+            get_agent()
         while True:
             user_input = input(f"{whoami}: ").strip()
             match user_input.lower():
@@ -62,7 +212,17 @@ def main(
                     ).strip().lower() in ["y", "yes"]
                     break
                 case "submit" | "":
-                    agent_response = _safe_get_agent_response(agent, ctx)
+                    agent = get_agent()
+                    if agent is None:
+                        continue
+                    if stream:
+                        draft, agent_response = _safe_stream_agent_response(agent, ctx)
+                    else:
+                        draft, agent_response = None, _safe_get_agent_response(
+                            agent, ctx, num_candidates=num_candidates
+                        )
+                    if agent_response is None:
+                        continue
                     ctx.add_message(
                         by=agent.name,
                         content=agent_response.text_response,
@@ -70,28 +230,579 @@ def main(
                         tone=agent_response.tone,
                         sentiment=agent_response.sentiment,
                     )
-                    click.echo(f"{ctx.conversation[-1]}")
+                    if draft != agent_response.text_response:
+                        click.echo(f"{ctx.conversation[-1]}")
                 case "s":
                     save_conversation = True
                 case _:
                     ctx.add_message(by=whoami, content=user_input)
+            num_logged = _log_new_records(
+                conversation_log, ctx, agent_future, *num_logged
+            )
+        agent = get_agent()
+        if conversation_log is not None:
+            conversation_log.close()
+        if agent is not None:
+            _echo_agent_stats(agent, structured_output)
+        _echo_latency_by_role(metrics)
+        if metrics_file is not None:
+            metrics_file.write_text(metrics.to_prometheus())
+            click.echo(f"metrics written to {metrics_file}")
         if save_conversation and ctx.conversation:
             with open(conv_logs, "w") as fid:
                 for msg in ctx.conversation:
                     fid.write(f"{msg}\n")
             with open(conv_logs.replace(".txt", ".json"), "w") as fid:
                 fid.write(ctx.model_dump_json(indent=4))
+            if store is not None:
+                store.save(
+                    ctx,
+                    agent_name=name,
+                    user_name=whoami,
+                    context_blocks=(
+                        []
+                        if agent is None
+                        else (
+                            []
+                            if agent.context_window is None
+                            else agent.context_window.memory_blocks
+                        )
+                        # the blocks inserted by the memory extractor in this session
+                        + agent.context_blocks[len(context_blocks) :]
+                    ),
+                )
+                click.echo(f"saved to {store.path} as {ctx.conversation_id}")
+            if agent is not None and agent.memory_extractor is not None:
+                # loadable with --context-blocks-file
+                with open(
+                    conv_logs.replace(".txt", "-context_blocks.json"), "w"
+                ) as fid:
+                    json.dump(
+                        [block.model_dump_json() for block in agent.context_blocks],
+                        fid,
+                        indent=4,
+                    )
+        if store is not None:
+            store.close()
+
+
+def _echo_agent_stats(agent: "OllamaTalkAgent", structured_output: bool):
+    if structured_output:
+        click.echo(f"structured output: {agent.parse_stats}")
+    if agent.memory_extractor is not None:
+        click.echo("Updating the memory...")
+        agent.memory_extractor.close()
+        click.echo(f"memory: {agent.memory_extractor.stats()}")
+    if agent.response_cache is not None:
+        click.echo(f"response cache: {agent.response_cache_stats()}")
+    if agent.escalation_policy is not None:
+        click.echo(f"critic escalation: {agent.escalation_policy.stats()}")
+
+
+def _log_new_records(
+    conversation_log: Optional[ConversationLog],
+    ctx: ConversationContext,
+    agent_future: "Future[OllamaTalkAgent]",
+    num_messages: int,
+    num_blocks: int,
+) -> tuple[int, int]:
+    """
+    Append the messages and the memory blocks formed since the last call to the log.
+    Return the numbers of the messages and the blocks logged so far.
+    """
+    if conversation_log is None:
+        return num_messages, num_blocks
+    for msg in ctx.conversation[num_messages:]:
+        conversation_log.append_message(msg)
+    if not agent_future.done() or agent_future.exception() is not None:
+        # no response yet, so no memory block, and the agent is not waited for
+        return len(ctx.conversation), num_blocks
+    agent = agent_future.result()
+    memory_blocks = (
+        [] if agent.context_window is None else agent.context_window.memory_blocks
+    )
+    for block in memory_blocks[num_blocks:]:
+        conversation_log.append_block(block)
+    return len(ctx.conversation), len(memory_blocks)
+
+
+def _safe_get_agent_response(
+    agent: "OllamaTalkAgent", ctx: ConversationContext, num_candidates: int = 1
+) -> Optional[AgentResponse]:
+    try:
+        return agent.get_response(ctx, temperature=0.6, num_candidates=num_candidates)
+    except Exception as error:
+        _echo_failure(agent, error)
+        return None
+
 
+def _safe_stream_agent_response(
+    agent: "OllamaTalkAgent", ctx: ConversationContext
+) -> tuple[str, Optional[AgentResponse]]:
+    """
+    Echo the draft `text_response` as it is generated.
+    Return the streamed draft and the final response.
 
-def _safe_get_agent_response(agent: OllamaTalkAgent, ctx: ConversationContext):
-    while True:
+    A failed generation is retried (and its draft echoed again), but not the failures
+    after it, of the critic and revision calls, which the agent retries already.
+    """
+
+    def stream_once() -> tuple[str, Optional[AgentResponse], Optional[Exception]]:
+        drafts = []
+        click.echo(f"{agent.name}: ", nl=False)
+        draft = ""
         try:
-            return agent.get_response(ctx.conversation, temperature=0.6)
-        except Exception:
-            ...
+            for item in agent.get_response(
+                ctx, temperature=0.6, stream=True, on_draft=drafts.append
+            ):
+                if isinstance(item, AgentResponse):
+                    return draft, item, None
+                if item.field == "text_response":
+                    draft += item.delta
+                    click.echo(item.delta, nl=False)
+        except Exception as error:
+            if not drafts:
+                raise
+            return draft, None, error
+        finally:
+            click.echo()
+
+    try:
+        draft, agent_response, error = agent.retry_policy.call(stream_once)
+    except Exception as error:
+        _echo_failure(agent, error)
+        return "", None
+    if error is not None:
+        _echo_failure(agent, error)
+    return draft, agent_response
+
+
+def _echo_failure(agent: "OllamaTalkAgent", error: Exception):
+    from .retry import RetryError
+
+    if not isinstance(error, RetryError):
+        error = f"{error!r}"
+    click.secho(
+        f"Failed to get the response of {agent.name}: {error}\n"
+        f"(retry stats: {agent.retry_policy.stats()})",
+        fg="red",
+    )
+
+
+def _echo_latency_by_role(metrics: HistogramExporter):
+    summaries = metrics.latency_by_role()
+    if not summaries:
+        return
+    click.echo("latency by role:")
+    for summary in summaries:
+        click.echo(
+            f"  {summary['role']:<8} {summary['model']:<24} {summary['count']:>5} calls, "
+            f"mean {summary['mean']:.2f}s, p90 {summary['p90']:.2f}s"
+        )
+
+
+def _role_tokens(value: str) -> tuple[str, int]:
+    role, _, tokens = value.partition("=")
+    if role not in _ROLES or not tokens.isdigit():
+        raise argparse.ArgumentTypeError(
+            f"expected ROLE=TOKENS with ROLE one of {', '.join(_ROLES)}, got {value!r}"
+        )
+    return role, int(tokens)
+
+
+def _add_generation_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--num-predict",
+        type=_role_tokens,
+        nargs="+",
+        default=[],
+        metavar="ROLE=TOKENS",
+        help="the maximum output tokens by role (generate, critic or revise)",
+    )
+    parser.add_argument(
+        "--reasoning-tokens",
+        type=_role_tokens,
+        nargs="+",
+        default=[],
+        metavar="ROLE=TOKENS",
+        help="the maximum <think> tokens by role, beyond which the model is made to answer",
+    )
+    parser.add_argument(
+        "--early-stop",
+        action="store_true",
+        help="stream the model calls and stop them once their JSON is received",
+    )
+    parser.add_argument(
+        "--log-think",
+        action="store_true",
+        help="log the <think> sections of the model outputs (with --early-stop or --reasoning-tokens)",
+    )
+
+
+def _generation_budgets(
+    num_predict: Sequence[tuple[str, int]],
+    reasoning_tokens: Sequence[tuple[str, int]],
+    early_stop: bool,
+    log_think: bool,
+) -> dict[str, "GenerationBudget"]:
+    from .generation import GenerationBudget
+
+    num_predict, reasoning_tokens = dict(num_predict), dict(reasoning_tokens)
+    roles = (
+        _ROLES
+        if early_stop or log_think
+        else [
+            role for role in _ROLES if role in num_predict or role in reasoning_tokens
+        ]
+    )
+    return {
+        role: GenerationBudget(
+            num_predict=num_predict.get(role),
+            reasoning_tokens=reasoning_tokens.get(role),
+            early_stop=early_stop,
+            log_think=log_think,
+        )
+        for role in roles
+    }
+
+
+def _serve_main(argv: list[str]):
+    from .server import serve
+
+    parser = argparse.ArgumentParser(
+        prog="python -m hoho_talk serve", description="Hoho Talk server"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="the host to bind")
+    parser.add_argument("--port", type=int, default=8000, help="the port to bind")
+    parser.add_argument("-m", "--model", help="the model to use", default="qwq:latest")
+    parser.add_argument(
+        "--ollama-host", help="the ollama server (OLLAMA_HOST by default)"
+    )
+    parser.add_argument(
+        "--prompt-layout",
+        choices=[layout.value for layout in PromptLayout],
+        default=PromptLayout.legacy.value,
+        help="the layout of the prompts",
+    )
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help="constrain the model outputs with the JSON schemas of the responses",
+    )
+    parser.add_argument(
+        "--max-sessions", type=int, default=1024, help="the maximum live sessions"
+    )
+    parser.add_argument(
+        "--session-ttl",
+        type=float,
+        default=3600.0,
+        help="the seconds of inactivity before a session expires",
+    )
+    parser.add_argument(
+        "--max-memory-mb",
+        type=float,
+        default=512.0,
+        help="the estimated memory of the live sessions before the LRU ones are evicted",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=4,
+        help="the maximum turns in flight",
+    )
+    parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        default=30.0,
+        help="the seconds a turn waits for a slot before a 503",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="the maximum attempts of each model call",
+    )
+    parser.add_argument(
+        "--max-model-concurrency",
+        type=int,
+        default=2,
+        help="the maximum model calls in flight; the first drafts go before the critics and the revisions",
+    )
+    parser.add_argument(
+        "--response-cache-size",
+        type=int,
+        default=0,
+        help="the responses cached in memory and shared by the sessions (0 to disable)",
+    )
+    parser.add_argument(
+        "--critic-model",
+        help="the model of the critic (the model of the agent by default), e.g. a small one",
+    )
+    parser.add_argument(
+        "--revise-model",
+        help="the model of the revisions (the model of the agent by default)",
+    )
+    parser.add_argument(
+        "--escalate",
+        action="store_true",
+        help="check the rejections and the uncertain verdicts of the critic again with --escalation-model",
+    )
+    parser.add_argument(
+        "--escalation-model",
+        help="the stronger model of the escalated verdicts (the model of the agent by default)",
+    )
+    parser.add_argument(
+        "--escalation-min-confidence",
+        type=float,
+        default=0.7,
+        help="escalate the verdicts of a lower confidence (with --escalate)",
+    )
+    _add_generation_arguments(parser)
+    kwargs = vars(parser.parse_args(argv))
+    serve(
+        generation_budgets=_generation_budgets(
+            kwargs.pop("num_predict"),
+            kwargs.pop("reasoning_tokens"),
+            kwargs.pop("early_stop"),
+            kwargs.pop("log_think"),
+        ),
+        **kwargs,
+    )
+
+
+def _batch_main(argv: list[str]):
+    from .batch import run_batch
+
+    parser = argparse.ArgumentParser(
+        prog="python -m hoho_talk batch",
+        description="Hoho Talk batch mode: replay the scripted conversations of a JSONL jobs file",
+    )
+    parser.add_argument(
+        "jobs_file",
+        type=Path,
+        help="the JSONL jobs file, of {job_id, persona_file, name, turns, whoami, temperature} lines",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        required=True,
+        help="the JSONL results file; the jobs it has a successful result of are skipped",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="the maximum jobs in flight"
+    )
+    parser.add_argument(
+        "--executor",
+        choices=["thread", "process"],
+        default="thread",
+        help="run the jobs on threads, or on processes (each with its own clients and caches)",
+    )
+    parser.add_argument("-m", "--model", help="the model to use", default="qwq:latest")
+    parser.add_argument(
+        "--ollama-host", help="the ollama server (OLLAMA_HOST by default)"
+    )
+    parser.add_argument(
+        "--max-model-concurrency",
+        type=int,
+        help="the maximum model calls in flight (per process), unbounded by default",
+    )
+    parser.add_argument(
+        "--prompt-layout",
+        choices=[layout.value for layout in PromptLayout],
+        default=PromptLayout.legacy.value,
+        help="the layout of the prompts",
+    )
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help="constrain the model outputs with the JSON schemas of the responses",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="the maximum attempts of each model call",
+    )
+    parser.add_argument(
+        "--revision-trials",
+        type=int,
+        default=3,
+        help="the maximum revisions of a response rejected by the critic",
+    )
+    parser.add_argument(
+        "--critic-model",
+        help="the model of the critic (the model of the agent by default), e.g. a small one",
+    )
+    parser.add_argument(
+        "--revise-model",
+        help="the model of the revisions (the model of the agent by default)",
+    )
+    _add_generation_arguments(parser)
+    kwargs = vars(parser.parse_args(argv))
+    kwargs["generation_budgets"] = _generation_budgets(
+        kwargs.pop("num_predict"),
+        kwargs.pop("reasoning_tokens"),
+        kwargs.pop("early_stop"),
+        kwargs.pop("log_think"),
+    )
+    num_results = 0
+
+    def echo_result(result):
+        nonlocal num_results
+        num_results += 1
+        status = (
+            click.style("ok", fg="green")
+            if result.error is None
+            else click.style(f"failed: {result.error}", fg="red")
+        )
+        click.echo(
+            f"[{num_results}] {result.job_id}: {len(result.turn_latencies)} turns "
+            f"in {result.latency:.2f}s, {status}"
+        )
+
+    report = run_batch(on_result=echo_result, **kwargs)
+    click.echo(
+        f"{report['done']} jobs done, {report['failed']} failed, "
+        f"{report['skipped']} skipped (done before) in {report['seconds']:.1f}s: "
+        f"{report['jobs_per_second']:.2f} jobs/s, {report['turns_per_second']:.2f} turns/s, "
+        f"{report['tokens_per_second']:.0f} tokens/s"
+    )
+    for name in ("job_latency", "turn_latency"):
+        if report[name]:
+            click.echo(
+                f"{name.replace('_', ' ')}: "
+                + ", ".join(
+                    f"{key} {seconds:.2f}s" for key, seconds in report[name].items()
+                )
+            )
+    if report["failed"]:
+        sys.exit(1)
+
+
+def _name_file(value: str) -> tuple[str, Path]:
+    name, _, path = value.partition("=")
+    if not name or not path:
+        raise argparse.ArgumentTypeError(f"expected NAME=PERSONA_FILE, got {value!r}")
+    return name, Path(path)
+
+
+def _group_main(argv: list[str]):
+    from .group import SPEAKER_POLICIES, GroupConversation
+    from .pool import default_client_pool
+    from .retry import RetryPolicy
+    from .talk_agent import OllamaTalkAgent
+
+    parser = argparse.ArgumentParser(
+        prog="python -m hoho_talk group",
+        description="Hoho Talk group conversation: a room of personas talking to each other",
+    )
+    parser.add_argument(
+        "-a",
+        "--agent",
+        dest="agents",
+        type=_name_file,
+        nargs="+",
+        required=True,
+        metavar="NAME=PERSONA_FILE",
+        help="the agents of the room and their persona files",
+    )
+    parser.add_argument(
+        "--topic", help="the opening message of the host, e.g. the topic to talk about"
+    )
+    parser.add_argument("--host-name", default="Host", help="the name of the host")
+    parser.add_argument(
+        "-t", "--turns", type=int, default=10, help="the turns of the agents"
+    )
+    parser.add_argument(
+        "--policy",
+        choices=list(SPEAKER_POLICIES),
+        default="mention",
+        help="who speaks next: in turn, the ones mentioned first, or at random",
+    )
+    parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=1,
+        help="the likely next speakers whose turns are precomputed while the current turn is criticized",
+    )
+    parser.add_argument("-m", "--model", help="the model to use", default="qwq:latest")
+    parser.add_argument(
+        "--ollama-host", help="the ollama server (OLLAMA_HOST by default)"
+    )
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help="constrain the model outputs with the JSON schemas of the responses",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="the maximum attempts of each model call",
+    )
+    parser.add_argument(
+        "--revision-trials",
+        type=int,
+        default=3,
+        help="the maximum revisions of a response rejected by the critic",
+    )
+    parser.add_argument(
+        "--critic-model",
+        help="the model of the critic (the model of the agent by default), e.g. a small one",
+    )
+    parser.add_argument(
+        "--save-file",
+        type=Path,
+        help="save the conversation to this JSON file",
+    )
+    args = parser.parse_args(argv)
+    client = default_client_pool().get(args.ollama_host)
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+    agents = []
+    for name, persona_file in args.agents:
+        with persona_file.open("r") as fid:
+            persona = fid.read()
+        agents.append(
+            OllamaTalkAgent(
+                name=name,
+                persona=persona,
+                client=client,
+                model=args.model,
+                revision_trials=args.revision_trials,
+                structured_output=args.structured_output,
+                retry_policy=retry_policy,
+                critic_model=args.critic_model,
+            )
+        )
+    with GroupConversation(
+        agents, policy=SPEAKER_POLICIES[args.policy](), lookahead=args.lookahead
+    ) as room:
+        if args.topic:
+            click.echo(f"{room.add_message(by=args.host_name, content=args.topic)}\n")
+        start = time.perf_counter()
+        for msg in room.run(args.turns):
+            click.echo(f"{msg}\n")
+        elapsed = time.perf_counter() - start
+        click.echo(
+            f"{args.turns} turns in {elapsed:.1f}s ({args.turns / elapsed:.2f} turns/s), "
+            f"precomputed turns: {room.stats()}"
+        )
+        if args.save_file is not None:
+            args.save_file.write_text(room.ctx.model_dump_json(indent=4))
+            click.echo(f"saved to {args.save_file}")
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["group"]:
+        _group_main(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ["serve"]:
+        _serve_main(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ["batch"]:
+        _batch_main(sys.argv[2:])
+        sys.exit(0)
     parser = argparse.ArgumentParser(description="Hoho Talk CLI")
     parser.add_argument("--name", help="the name of the agent", required=True)
     parser.add_argument("-m", "--model", help="the model to use", default="qwq:latest")
@@ -120,5 +831,133 @@ if __name__ == "__main__":
         "--save-directory",
         help="the directory to save the conversation logs/records",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream the response text as it is generated",
+    )
+    parser.add_argument(
+        "--prompt-layout",
+        choices=[layout.value for layout in PromptLayout],
+        default=PromptLayout.legacy.value,
+        help="the layout of the prompts ('prefix_cache' lets ollama reuse the cached prompt prefix across turns)",
+    )
+    parser.add_argument(
+        "--critic-cache-dir",
+        type=Path,
+        help="the directory to cache the critic verdicts on disk (in memory if not given)",
+    )
+    parser.add_argument(
+        "-n",
+        "--num-candidates",
+        type=int,
+        default=1,
+        help="the number of candidate responses generated and criticized concurrently",
+    )
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help="constrain the model outputs with the JSON schemas of the responses",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="the maximum number of attempts of each model call",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=300.0,
+        help="the time budget (in seconds) of the retries of each model call: no retry "
+        "starts past it, but an attempt in flight is bounded by the client timeout only",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        help="the token budget of the conversation in the prompts; the older messages are summarized into memory",
+    )
+    parser.add_argument(
+        "-k",
+        "--retrieval-top-k",
+        type=int,
+        help="put only the top-k context blocks relevant to the conversation in the prompt",
+    )
+    parser.add_argument(
+        "--embed-model",
+        default="nomic-embed-text",
+        help="the embedding model for the context block retrieval",
+    )
+    parser.add_argument(
+        "--embedding-cache-dir",
+        type=Path,
+        help="the directory to cache the embeddings of the context blocks",
+    )
+    parser.add_argument(
+        "--update-memory",
+        action="store_true",
+        help="insert the significant information of the conversation into the context blocks in the background",
+    )
+    parser.add_argument(
+        "--log-file",
+        type=Path,
+        help="append the conversation to this JSONL log as it goes, and resume from it if it exists",
+    )
+    parser.add_argument(
+        "--resume-last",
+        type=int,
+        help="resume only the last N messages of the log or the store (all by default)",
+    )
+    parser.add_argument(
+        "--store-db",
+        type=Path,
+        help="the SQLite conversation store to save the conversation to",
+    )
+    parser.add_argument(
+        "--resume-conversation-id",
+        help="resume the conversation of this id from the store (see --resume-last)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        help="write the latency and token metrics of the session in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--response-cache-size",
+        type=int,
+        default=0,
+        help="cache up to this many responses in memory, to replay the conversations without the model",
+    )
+    parser.add_argument(
+        "--response-cache-dir",
+        type=Path,
+        help="the directory of the on-disk tier of the response cache",
+    )
+    parser.add_argument(
+        "--critic-model",
+        help="the model of the critic (the model of the agent by default), e.g. a small one",
+    )
+    parser.add_argument(
+        "--revise-model",
+        help="the model of the revisions (the model of the agent by default)",
+    )
+    parser.add_argument(
+        "--escalate",
+        action="store_true",
+        help="check the rejections and the uncertain verdicts of the critic again with --escalation-model",
+    )
+    parser.add_argument(
+        "--escalation-model",
+        help="the stronger model of the escalated verdicts (the model of the agent by default)",
+    )
+    parser.add_argument(
+        "--escalation-min-confidence",
+        type=float,
+        default=0.7,
+        help="escalate the verdicts of a lower confidence (with --escalate)",
+    )
+    _add_generation_arguments(parser)
     kwargs = vars(parser.parse_args())
+    if kwargs["stream"] and kwargs["num_candidates"] > 1:
+        parser.error("--num-candidates is not supported with --stream")
     main(**kwargs)
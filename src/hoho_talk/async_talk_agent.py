@@ -0,0 +1,367 @@
+import asyncio
+import logging
+import time
+from contextlib import nullcontext
+from typing import AsyncIterator, Callable, Optional, Type
+
+from ollama import AsyncClient, ChatResponse, Message
+from pydantic import BaseModel
+
+from .data import AgentResponse, Conversation, CriticResponse, LLMCallStats
+from .generation import GenerationController
+from .talk_agent import (
+    OllamaAgent,
+    OllamaCriticAgent,
+    OllamaReviseAgent,
+    OllamaTalkAgent,
+)
+
+__all__ = [
+    "AsyncOllamaTalkAgent",
+    "AsyncOllamaCriticAgent",
+    "AsyncOllamaReviseAgent",
+]
+
+_logger = logging.getLogger(__name__)
+
+
+class AsyncOllamaAgent(OllamaAgent):
+    _client_factory = AsyncClient
+
+    def _aslot(self):
+        if self._scheduler is None:
+            return nullcontext()
+        return self._scheduler.aslot(self.model, self._role, self._scheduling_key)
+
+    async def _chat(
+        self,
+        messages: list[dict],
+        response_cls: Optional[Type[BaseModel]] = None,
+        **kwargs,
+    ) -> ChatResponse:
+        response, self.last_call_stats = await self._chat_call(
+            messages, response_cls=response_cls, **kwargs
+        )
+        return response
+
+    async def _chat_call(
+        self,
+        messages: list[dict],
+        response_cls: Optional[Type[BaseModel]] = None,
+        **kwargs,
+    ) -> tuple[ChatResponse, LLMCallStats]:
+        kwargs = self._budget_kwargs(kwargs)
+        controller = self._generation_controller(response_cls)
+        async with self._aslot():
+            start = time.perf_counter()
+            if controller is None:
+                response = await self._client.chat(
+                    model=self.model, messages=messages, **kwargs
+                )
+            else:
+                last_chunk = None
+                async for last_chunk in self._acontrolled_stream(
+                    messages, controller, **kwargs
+                ):
+                    pass
+                response = controller.response(self.model, last_chunk)
+            wall_time = time.perf_counter() - start
+        return response, self._call_stats(response, wall_time, controller)
+
+    async def _acontrolled_stream(
+        self, messages: list[dict], controller: GenerationController, **kwargs
+    ) -> AsyncIterator[ChatResponse]:
+        """
+        See `OllamaAgent._controlled_stream`.
+        """
+        while True:
+            stream = await self._client.chat(
+                model=self.model, messages=messages, stream=True, **kwargs
+            )
+            try:
+                async for chunk in stream:
+                    action = controller.feed(chunk.message.content)
+                    yield chunk
+                    if action == controller.STOP:
+                        return
+                    if action == controller.FORCE and not chunk.done:
+                        break
+                else:
+                    return
+            finally:
+                await stream.aclose()
+            closing, messages = controller.force_answer(messages)
+            yield ChatResponse(
+                model=self.model,
+                done=False,
+                message=Message(role="assistant", content=closing),
+            )
+
+
+class AsyncOllamaTalkAgent(AsyncOllamaAgent, OllamaTalkAgent):
+    """
+    The asyncio counterpart of `OllamaTalkAgent`.
+
+    It shares the prompts and the response contracts with `OllamaTalkAgent`,
+    but talks to ollama with `ollama.AsyncClient`, so a single event loop can
+    drive many conversations concurrently.
+    """
+
+    async def get_response(
+        self,
+        conversation: Conversation,
+        temperature=0.2,
+        num_candidates: int = 1,
+        use_cache: bool = True,
+        on_draft: Optional[Callable[[AgentResponse], None]] = None,
+    ) -> AgentResponse:
+        """
+        See `OllamaTalkAgent.get_response`.
+        The speculative candidates in flight are cancelled once a candidate is accepted.
+        """
+        start = time.perf_counter()
+        self._reset_turn_stats()
+        cache_keys = self._response_cache_keys(conversation, temperature)
+        if (cached := self._lookup_response(cache_keys, use_cache)) is not None:
+            self._remember(conversation, cached)
+            self._emit("on_stage", "turn", time.perf_counter() - start)
+            return cached
+        if self.context_window is not None:
+            # the summarization is blocking, keep it off the event loop
+            with self._stage("context_window"):
+                conversation = await asyncio.to_thread(
+                    self._retry, self.context_window.window, conversation, self.name
+                )
+        if self.context_retriever is not None:
+            await asyncio.to_thread(
+                self._retry, self._retrieve_context_blocks, conversation
+            )
+        if num_candidates > 1:
+            final_response = await self.__speculative_response(
+                conversation, temperature, num_candidates
+            )
+        else:
+            agent_response = await self._aretry(
+                self.__get_agent_response, conversation, temperature
+            )
+            if on_draft is not None:
+                on_draft(agent_response)
+            final_response = await self.__revise_by_critic(
+                conversation=conversation, agent_response=agent_response
+            )
+        self._store_response(cache_keys, final_response)
+        self._remember(conversation, final_response)
+        self._emit("on_stage", "turn", time.perf_counter() - start)
+        return final_response
+
+    async def _aretry(self, func, *args, **kwargs):
+        if self.retry_policy is None:
+            return await func(*args, **kwargs)
+        return await self.retry_policy.acall(func, *args, **kwargs)
+
+    async def __get_agent_response(
+        self, conversation: Conversation, temperature: float
+    ):
+        with self._stage("generate"):
+            chat_response, call_stats = await self._chat_call(
+                self._compose_messages(conversation),
+                options={"temperature": temperature},
+                response_cls=AgentResponse,
+                format=self._format(AgentResponse),
+            )
+            self._collect_call_stats(call_stats)
+            return self._parse_agent_response(chat_response.message.content)
+
+    async def __speculative_response(
+        self, conversation: Conversation, temperature: float, num_candidates: int
+    ) -> AgentResponse:
+        report = self._start_speculation(temperature, num_candidates)
+        accepted = None
+        rejected = []
+        errors = []
+        start = time.perf_counter()
+        tasks = {
+            asyncio.ensure_future(
+                self._aretry(
+                    self.__generate_candidate, conversation, candidate_temperature
+                )
+            ): idx
+            for idx, candidate_temperature in enumerate(report.temperatures)
+        }
+        try:
+            pending = set(tasks)
+            while pending and accepted is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=tasks.get):
+                    idx = tasks[task]
+                    if task.exception() is not None:
+                        _logger.debug("candidate %d failed: %r", idx, task.exception())
+                        errors.append(task.exception())
+                        continue
+                    candidate, critic_response, elapsed, call_stats = task.result()
+                    report.completed += 1
+                    report.candidates_time += elapsed
+                    for stats in call_stats:
+                        self._collect_call_stats(stats)
+                    if critic_response.is_aligned and accepted is None:
+                        accepted = (idx, candidate)
+                    elif not critic_response.is_aligned:
+                        rejected.append((idx, candidate, critic_response))
+        finally:
+            for task in tasks:
+                task.cancel()
+        report.wall_time = time.perf_counter() - start
+        if accepted is not None:
+            report.accepted_index, final_response = accepted
+        elif rejected:
+            _, candidate, critic_response = min(rejected, key=lambda item: item[0])
+            final_response = await self.__revise_by_critic(
+                conversation=conversation,
+                agent_response=candidate,
+                critic_response=critic_response,
+            )
+        else:
+            raise errors[0]
+        return final_response
+
+    async def __generate_candidate(
+        self, conversation: Conversation, temperature: float
+    ):
+        start = time.perf_counter()
+        with self._stage("generate"):
+            chat_response, generate_stats = await self._chat_call(
+                self._compose_messages(conversation),
+                options={"temperature": temperature},
+                response_cls=AgentResponse,
+                format=self._format(AgentResponse),
+            )
+            candidate = self._parse_agent_response(chat_response.message.content)
+        call_stats = [generate_stats]
+        with self._borrow_critic_agent() as critic_agent:
+            # the whole candidate is retried
+            critic_response, critic_stats = await self.__criticize(
+                critic_agent, candidate, conversation, retry=False
+            )
+        call_stats.extend(critic_stats)
+        return candidate, critic_response, time.perf_counter() - start, call_stats
+
+    def _critic_agent_spec(self) -> tuple[type, dict]:
+        _, config = super()._critic_agent_spec()
+        return AsyncOllamaCriticAgent, config
+
+    def _revise_agent_spec(self) -> tuple[type, dict]:
+        _, config = super()._revise_agent_spec()
+        return AsyncOllamaReviseAgent, config
+
+    async def __criticize(
+        self,
+        critic_agent: "AsyncOllamaCriticAgent",
+        agent_response: AgentResponse,
+        conversation: Conversation,
+        retry: bool = True,
+    ) -> tuple[CriticResponse, list[Optional[LLMCallStats]]]:
+        """
+        See `OllamaTalkAgent.__criticize`.
+        """
+
+        async def call(critic):
+            kwargs = dict(by=self.name, persona=self.persona, conversation=conversation)
+            if retry:
+                return await self._aretry(critic, agent_response, **kwargs)
+            return await critic(agent_response, **kwargs)
+
+        critic_response = await call(critic_agent.critic)
+        call_stats = [critic_agent.last_call_stats]
+        if (reason := self._escalation_reason(critic_response)) is None:
+            return critic_response, call_stats
+        with (
+            self._stage("escalation", reason=reason),
+            self._borrow_escalation_critic_agent() as escalation_agent,
+        ):
+            escalated = await call(escalation_agent.critic)
+            call_stats.append(escalation_agent.last_call_stats)
+        self._record_escalation(reason, critic_response, escalated)
+        return escalated, call_stats
+
+    async def __revise_by_critic(
+        self,
+        conversation: Conversation,
+        agent_response: AgentResponse,
+        critic_response: Optional[CriticResponse] = None,
+    ) -> AgentResponse:
+        revised_response = agent_response
+        with (
+            self._borrow_critic_agent() as critic_agent,
+            self._borrow_revise_agent() as revise_agent,
+        ):
+            for trial in range(self.revision_trials):
+                trial_start = time.perf_counter()
+                if critic_response is None:
+                    critic_response, call_stats = await self.__criticize(
+                        critic_agent, revised_response, conversation
+                    )
+                    for stats in call_stats:
+                        self._collect_call_stats(stats)
+                if critic_response.is_aligned:
+                    self._emit_trial(trial, trial_start)
+                    break
+                revised_response = await self._aretry(
+                    revise_agent.revise,
+                    revised_response,
+                    critic_response=critic_response,
+                )
+                self._collect_call_stats(revise_agent.last_call_stats)
+                critic_response = None
+                self._emit_trial(trial, trial_start)
+            else:
+                _logger.debug(
+                    "Does not reach the final revision after %d trials",
+                    self.revision_trials,
+                )
+        return revised_response
+
+
+class AsyncOllamaCriticAgent(AsyncOllamaAgent, OllamaCriticAgent):
+    async def critic(
+        self,
+        agent_response: AgentResponse,
+        by: str,
+        persona: str,
+        conversation: Conversation,
+        temperature=0.1,
+    ) -> CriticResponse:
+        with self._stage("critic"):
+            cache_key = self._verdict_cache_key(
+                agent_response, by, persona, conversation
+            )
+            if (critic_response := self._lookup_verdict(cache_key)) is not None:
+                return critic_response
+            response = await self._chat(
+                self._compose_messages(agent_response, by, persona, conversation),
+                options={"temperature": temperature},
+                response_cls=self.verdict_cls,
+                format=self._format(self.verdict_cls),
+            )
+            critic_response = self._parse_critic_response(response.message.content)
+            self._store_verdict(cache_key, critic_response)
+            return critic_response
+
+
+class AsyncOllamaReviseAgent(AsyncOllamaAgent, OllamaReviseAgent):
+    async def revise(
+        self,
+        agent_response: AgentResponse,
+        critic_response: CriticResponse,
+    ) -> AgentResponse:
+        with self._stage("revise"):
+            response = await self._chat(
+                self._compose_messages(agent_response, critic_response),
+                options={"temperature": 0.1},
+                response_cls=AgentResponse,
+                format=self._format(AgentResponse),
+            )
+            return self._record_revision(
+                agent_response, critic_response, response.message.content
+            )
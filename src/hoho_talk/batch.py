@@ -0,0 +1,340 @@
+"""
+The offline batch mode of hoho_talk, to replay scripted conversations, e.g. to evaluate personas.
+
+    $ python -m hoho_talk batch jobs.jsonl --output results.jsonl --workers 8
+
+Each line of the jobs file is a `data.BatchJob`, whose `persona_file` is relative to the
+jobs file, e.g.
+
+    {"job_id": "kol-1", "persona_file": "persona/kol_persona.txt", "name": "KOL", "turns": ["Hi!", "How are you?"]}
+
+(`job_id` is the line number if not given.) The jobs run on a pool of `workers` threads
+or processes, and each `data.BatchResult` is appended to the output as soon as its job is done.
+The output is the checkpoint: the jobs it has a successful result of are skipped on the
+next run, and the failed ones are run again.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from . import _setup_logger
+from .data import BatchJob, BatchResult, ConversationContext, LLMCallStats
+from .metrics import MetricsHook
+
+__all__ = ["BatchResultWriter", "read_jobs", "run_batch"]
+
+_logger = logging.getLogger(__name__)
+_setup_logger()
+
+
+def read_jobs(path: Union[str, Path]) -> list[BatchJob]:
+    """
+    The jobs of a JSONL jobs file, with their persona files resolved against its directory.
+    """
+    path = Path(path)
+    jobs: list[BatchJob] = []
+    job_ids = set()
+    with path.open("r") as fid:
+        for lineno, line in enumerate(fid, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.setdefault("job_id", f"line-{lineno}")
+            job = BatchJob.model_validate(record)
+            if job.job_id in job_ids:
+                raise ValueError(f"duplicate job id {job.job_id!r} at {path}:{lineno}")
+            job_ids.add(job.job_id)
+            job.persona_file = str(path.parent / job.persona_file)
+            jobs.append(job)
+    return jobs
+
+
+class BatchResultWriter:
+    """
+    The JSONL output of a batch, appended and fsynced result by result.
+
+    On open, a torn last line (of a crashed run) is dropped, and the ids of the jobs which
+    succeeded are loaded (see `done`), so the batch resumes from there.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.__path = Path(path)
+        self.__path.parent.mkdir(parents=True, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__done: set[str] = set()
+        self.__recover()
+        self.__output = self.__path.open("ab")
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+
+    @property
+    def done(self) -> frozenset[str]:
+        """
+        The ids of the jobs with a successful result.
+        """
+        with self.__lock:
+            return frozenset(self.__done)
+
+    def append(self, result: BatchResult):
+        line = result.model_dump_json() + "\n"
+        with self.__lock:
+            self.__output.write(line.encode("utf-8"))
+            self.__output.flush()
+            os.fsync(self.__output.fileno())
+            if result.error is None:
+                self.__done.add(result.job_id)
+
+    def close(self):
+        with self.__lock:
+            self.__output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __recover(self):
+        self.__path.touch(exist_ok=True)
+        size = self.__path.stat().st_size
+        end = 0
+        with self.__path.open("rb") as fid:
+            for line in fid:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("error") is None:
+                    self.__done.add(record["job_id"])
+                end += len(line)
+        if end < size:
+            _logger.warning(
+                "dropping %d bytes of a torn result at the end of %s",
+                size - end,
+                self.__path,
+            )
+            with self.__path.open("r+b") as fid:
+                fid.truncate(end)
+
+
+class _JobStats(MetricsHook):
+    """
+    The model calls of a job and their output tokens.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.calls = 0
+        self.eval_tokens = 0
+
+    def on_call(self, stats: LLMCallStats):
+        with self.__lock:
+            self.calls += 1
+            self.eval_tokens += stats.eval_count or 0
+
+
+@lru_cache(maxsize=256)
+def _read_persona(path: str) -> str:
+    # the jobs of a batch share a few personas
+    with open(path, "r") as fid:
+        return fid.read()
+
+
+class _Worker:
+    """
+    Run the jobs, with the client, the critic cache, the retry policy and the scheduler
+    shared by the jobs of a process.
+
+    `config` holds the settings of the agents (see `run_batch`), and is picklable,
+    so the process workers build their own.
+    """
+
+    def __init__(self, config: dict):
+        from .cache import LRUCache
+        from .pool import default_client_pool
+        from .retry import RetryPolicy
+        from .scheduler import RequestScheduler
+
+        config = dict(config)
+        self.__client = default_client_pool().get(config.pop("ollama_host"))
+        self.__retry_policy = RetryPolicy(max_attempts=config.pop("max_attempts"))
+        max_model_concurrency = config.pop("max_model_concurrency")
+        self.__scheduler = (
+            None
+            if max_model_concurrency is None
+            else RequestScheduler(max_concurrency=max_model_concurrency)
+        )
+        self.__critic_cache = LRUCache(maxsize=4096)
+        self.__agent_kwargs = config
+
+    def run(self, job: BatchJob) -> BatchResult:
+        from .talk_agent import OllamaTalkAgent
+
+        start = time.perf_counter()
+        stats = _JobStats()
+        turn_latencies: list[float] = []
+        ctx = ConversationContext()
+        error = None
+        try:
+            agent = OllamaTalkAgent(
+                name=job.name,
+                persona=_read_persona(job.persona_file),
+                client=self.__client,
+                critic_cache=self.__critic_cache,
+                retry_policy=self.__retry_policy,
+                scheduler=self.__scheduler,
+                # the jobs take turns for the model slots
+                scheduling_key=job.job_id,
+                metrics_hooks=(stats,),
+                **self.__agent_kwargs,
+            )
+            for turn in job.turns:
+                ctx.add_message(by=job.whoami, content=turn)
+                turn_start = time.perf_counter()
+                response = agent.get_response(ctx, temperature=job.temperature)
+                turn_latencies.append(time.perf_counter() - turn_start)
+                ctx.add_message(
+                    by=agent.name,
+                    content=response.text_response,
+                    mood=response.mood,
+                    tone=response.tone,
+                    sentiment=response.sentiment,
+                )
+        except Exception as exc:
+            _logger.warning("job %s failed: %r", job.job_id, exc)
+            error = repr(exc)
+        return BatchResult(
+            job_id=job.job_id,
+            name=job.name,
+            conversation=ctx.conversation,
+            error=error,
+            latency=time.perf_counter() - start,
+            turn_latencies=turn_latencies,
+            calls=stats.calls,
+            eval_tokens=stats.eval_tokens,
+        )
+
+
+_process_worker: Optional[_Worker] = None
+
+
+def _init_process(config: dict):
+    global _process_worker
+    _process_worker = _Worker(config)
+
+
+def _run_in_process(job: BatchJob) -> BatchResult:
+    return _process_worker.run(job)
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        f"p{int(q * 100)}": values[min(len(values) - 1, int(q * len(values)))]
+        for q in (0.5, 0.9, 0.99)
+    } | {"max": values[-1]}
+
+
+def run_batch(
+    jobs_file: Union[str, Path],
+    output: Union[str, Path],
+    workers: int = 4,
+    executor: str = "thread",
+    model: str = "qwq:latest",
+    ollama_host: Optional[str] = None,
+    max_attempts: int = 5,
+    max_model_concurrency: Optional[int] = None,
+    on_result: Optional[Callable[[BatchResult], None]] = None,
+    **agent_kwargs,
+) -> dict:
+    """
+    Run the jobs of `jobs_file` which have no successful result in `output` yet,
+    on `workers` threads (`executor="thread"`) or processes (`executor="process"`),
+    and append their results to `output` as they finish (calling `on_result` with each).
+
+    `max_model_concurrency` bounds the model calls in flight (per process), and the other
+    keyword arguments go to the `OllamaTalkAgent`s (e.g. `structured_output`).
+    Return the report of the run: the jobs done, failed and skipped, the throughput,
+    and the latency percentiles of the jobs and of the turns.
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError(f"unknown executor {executor!r}, expected thread or process")
+    config = {
+        "model": model,
+        "ollama_host": ollama_host,
+        "max_attempts": max_attempts,
+        "max_model_concurrency": max_model_concurrency,
+        **agent_kwargs,
+    }
+    jobs = read_jobs(jobs_file)
+    job_latencies: list[float] = []
+    turn_latencies: list[float] = []
+    failed = 0
+    eval_tokens = 0
+    with BatchResultWriter(output) as writer:
+        done = writer.done
+        pending = [job for job in jobs if job.job_id not in done]
+        _logger.info(
+            "%d jobs to run, %d done already, on %d %s workers",
+            len(pending),
+            len(jobs) - len(pending),
+            workers,
+            executor,
+        )
+        start = time.perf_counter()
+        pool: Executor
+        if executor == "thread":
+            pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+            run = _Worker(config).run
+        else:
+            pool = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_process, initargs=(config,)
+            )
+            run = _run_in_process
+        try:
+            futures = [pool.submit(run, job) for job in pending]
+            for future in as_completed(futures):
+                result = future.result()
+                writer.append(result)
+                if result.error is None:
+                    job_latencies.append(result.latency)
+                else:
+                    failed += 1
+                turn_latencies.extend(result.turn_latencies)
+                eval_tokens += result.eval_tokens
+                if on_result is not None:
+                    on_result(result)
+        finally:
+            # on an interruption, the jobs not started yet are left for the next run
+            pool.shutdown(wait=True, cancel_futures=True)
+        elapsed = time.perf_counter() - start
+    return {
+        "jobs": len(jobs),
+        "done": len(pending) - failed,
+        "failed": failed,
+        "skipped": len(jobs) - len(pending),
+        "seconds": elapsed,
+        "jobs_per_second": (len(pending) - failed) / elapsed if elapsed else 0.0,
+        "turns_per_second": len(turn_latencies) / elapsed if elapsed else 0.0,
+        "tokens_per_second": eval_tokens / elapsed if elapsed else 0.0,
+        "job_latency": _percentiles(job_latencies),
+        "turn_latency": _percentiles(turn_latencies),
+    }
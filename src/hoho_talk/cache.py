@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+__all__ = ["BaseCache", "LRUCache", "DiskCache", "TieredCache", "make_cache_key"]
+
+
+def make_cache_key(*parts: str) -> str:
+    """
+    The content hash of the given parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class BaseCache:
+    """
+    A string-to-string cache with hit/miss counters.
+
+    Subclasses implement `_get` and `_set`.
+    """
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def stats(self) -> dict:
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+        }
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        self._set(key, value)
+
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError()
+
+    def _set(self, key: str, value: str):
+        raise NotImplementedError()
+
+
+class LRUCache(BaseCache):
+    """
+    In-memory LRU cache, whose entries expire after `ttl` seconds (never if `ttl` is None).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__()
+        if maxsize <= 0:
+            raise ValueError(f"maxsize should be positive: {maxsize}")
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if self._ttl is not None and time.monotonic() - created_at > self._ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+
+class DiskCache(BaseCache):
+    """
+    On-disk cache with one JSON file per entry in `directory`,
+    which survives restarts and can be shared between processes.
+    """
+
+    def __init__(self, directory: Union[str, Path], ttl: Optional[float] = None):
+        super().__init__()
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._ttl = ttl
+
+    def _path(self, key: str) -> Path:
+        return self._directory / f"{key}.json"
+
+    def _get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with path.open("r") as fid:
+                entry = json.load(fid)
+        except (OSError, ValueError):
+            return None
+        if self._ttl is not None and time.time() - entry["created_at"] > self._ttl:
+            path.unlink(missing_ok=True)
+            return None
+        return entry["value"]
+
+    def _set(self, key: str, value: str):
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+        with tmp_path.open("w") as fid:
+            json.dump({"created_at": time.time(), "value": value}, fid)
+        os.replace(tmp_path, path)
+
+
+class TieredCache(BaseCache):
+    """
+    Caches looked up in order, e.g. an `LRUCache` in front of a `DiskCache`.
+    A hit in a tier is copied to the tiers before it, and the entries are set in all the tiers.
+    """
+
+    def __init__(self, *tiers: BaseCache):
+        super().__init__()
+        if not tiers:
+            raise ValueError("at least one tier is required")
+        self._tiers = tiers
+
+    @property
+    def tiers(self) -> tuple[BaseCache, ...]:
+        return self._tiers
+
+    def stats(self) -> dict:
+        return {**super().stats(), "tiers": [tier.stats() for tier in self._tiers]}
+
+    def _get(self, key: str) -> Optional[str]:
+        for idx, tier in enumerate(self._tiers):
+            value = tier.get(key)
+            if value is not None:
+                for upper in self._tiers[:idx]:
+                    upper.set(key, value)
+                return value
+        return None
+
+    def _set(self, key: str, value: str):
+        for tier in self._tiers:
+            tier.set(key, value)
@@ -0,0 +1,322 @@
+"""
+A compact, columnar representation of very long conversations.
+
+`CompactConversation` is an append-only sequence of `ConversationMessage`s which stores them
+in columns instead of as models: the speakers and the moods, tones and sentiments are interned,
+the contents are concatenated in a single UTF-8 buffer, and the `msg-<uuid>` message ids are
+kept as 128-bit integers. The messages are materialized only when they are read.
+
+`CompactConversationContext` is a `ConversationContext` backed by it, with the same API and
+the same JSON output.
+"""
+
+from array import array
+from typing import Any, Iterable, Iterator, Optional, Union, overload
+from uuid import UUID, uuid4
+
+from pydantic import Field, GetCoreSchemaHandler
+from pydantic_core import core_schema
+
+from .data import ConversationContext, ConversationMessage
+
+__all__ = ["CompactConversation", "CompactConversationContext"]
+
+_ID_PREFIX = "msg-"
+_MASK_64 = (1 << 64) - 1
+
+
+class _Interner:
+    """
+    The distinct strings, by id. The id 0 stands for `None`.
+    """
+
+    def __init__(self):
+        self.values: list[Optional[str]] = [None]
+        self.ids: dict[Optional[str], int] = {None: 0}
+
+    def intern(self, value: Optional[str]) -> int:
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return idx
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(value) for value in self.values if value is not None)
+
+
+def _format_message_id(high: int, low: int) -> str:
+    # the canonical form of the uuid, faster than `str(UUID(int=...))`
+    hex_id = f"{high:016x}{low:016x}"
+    return (
+        f"{_ID_PREFIX}{hex_id[:8]}-{hex_id[8:12]}-{hex_id[12:16]}"
+        f"-{hex_id[16:20]}-{hex_id[20:]}"
+    )
+
+
+def _parse_message_id(message_id: str) -> Optional[int]:
+    if not message_id.startswith(_ID_PREFIX):
+        return None
+    try:
+        uuid = UUID(message_id[len(_ID_PREFIX) :])
+    except ValueError:
+        return None
+    # only the canonical form round-trips
+    return uuid.int if f"{_ID_PREFIX}{uuid}" == message_id else None
+
+
+class CompactConversation:
+    """
+    An append-only sequence of messages, stored in columns.
+
+    It supports `len`, indexing (a slice gives a list), iteration, `append` and `extend`
+    like the list of `ConversationContext.conversation`, but not the other list mutations.
+    """
+
+    def __init__(self, messages: Iterable[ConversationMessage] = ()):
+        self.clear()
+        self.extend(messages)
+
+    def clear(self):
+        self.__speakers = _Interner()
+        self.__labels = _Interner()  # the moods, tones and sentiments
+        self.__by = array("I")
+        self.__moods = array("I")
+        self.__tones = array("I")
+        self.__sentiments = array("I")
+        self.__contents = bytearray()
+        self.__offsets = array("Q", [0])
+        self.__id_high = array("Q")
+        self.__id_low = array("Q")
+        # the message ids which are not of the form `msg-<uuid>`, by index
+        self.__other_ids: dict[int, str] = {}
+
+    def add(
+        self,
+        by: str,
+        content: str,
+        mood: Optional[str] = None,
+        tone: Optional[str] = None,
+        sentiment: Optional[str] = None,
+        message_id: Optional[str] = None,
+    ) -> int:
+        """
+        Append a message without building it, and return its index.
+        A new `msg-<uuid>` id is given if `message_id` is None.
+        """
+        idx = len(self.__by)
+        id_int = uuid4().int if message_id is None else _parse_message_id(message_id)
+        if id_int is None:
+            self.__other_ids[idx] = message_id
+            id_int = 0
+        self.__id_high.append(id_int >> 64)
+        self.__id_low.append(id_int & _MASK_64)
+        self.__by.append(self.__speakers.intern(by))
+        self.__moods.append(self.__labels.intern(mood))
+        self.__tones.append(self.__labels.intern(tone))
+        self.__sentiments.append(self.__labels.intern(sentiment))
+        self.__contents += content.encode("utf-8")
+        self.__offsets.append(len(self.__contents))
+        return idx
+
+    def append(self, message: ConversationMessage):
+        self.add(
+            message.by,
+            message.content,
+            mood=message.mood,
+            tone=message.tone,
+            sentiment=message.sentiment,
+            message_id=message.message_id,
+        )
+
+    def extend(self, messages: Iterable[ConversationMessage]):
+        if isinstance(messages, CompactConversation):
+            messages = list(messages)
+        for message in messages:
+            self.append(message)
+
+    def __len__(self) -> int:
+        return len(self.__by)
+
+    def by(self, idx: int) -> str:
+        return self.__speakers.values[self.__by[idx]]
+
+    def content(self, idx: int) -> str:
+        idx = range(len(self))[idx]
+        return self.__contents[self.__offsets[idx] : self.__offsets[idx + 1]].decode(
+            "utf-8"
+        )
+
+    def message_id(self, idx: int) -> str:
+        idx = range(len(self))[idx]
+        other_id = self.__other_ids.get(idx)
+        if other_id is not None:
+            return other_id
+        return _format_message_id(self.__id_high[idx], self.__id_low[idx])
+
+    def transcript_line(self, idx: int) -> str:
+        """
+        `ConversationMessage.to_transcript_line` of the message, without materializing it.
+        """
+        return (
+            f"{self.by(idx)} (message id {self.message_id(idx)!r}): {self.content(idx)}"
+        )
+
+    @overload
+    def __getitem__(self, idx: int) -> ConversationMessage: ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> list[ConversationMessage]: ...
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.__message(i) for i in range(len(self))[idx]]
+        return self.__message(range(len(self))[idx])
+
+    def __iter__(self) -> Iterator[ConversationMessage]:
+        for idx in range(len(self)):
+            yield self.__message(idx)
+
+    def __message(self, idx: int) -> ConversationMessage:
+        # the validation of pydantic-core is faster than `model_construct`
+        return ConversationMessage(**self.__fields(idx))
+
+    def __fields(self, idx: int) -> dict:
+        labels = self.__labels.values
+        return {
+            "by": self.by(idx),
+            "content": self.content(idx),
+            "message_id": self.message_id(idx),
+            "mood": labels[self.__moods[idx]],
+            "tone": labels[self.__tones[idx]],
+            "sentiment": labels[self.__sentiments[idx]],
+        }
+
+    def to_dicts(self) -> list[dict]:
+        """
+        The messages as the dicts of `ConversationMessage.model_dump`, without materializing them.
+        """
+        speakers, labels = self.__speakers.values, self.__labels.values
+        contents, offsets = memoryview(self.__contents), self.__offsets
+        other_ids = self.__other_ids
+        return [
+            {
+                "by": speakers[by],
+                "content": str(contents[offsets[idx] : offsets[idx + 1]], "utf-8"),
+                "message_id": (
+                    other_ids[idx]
+                    if idx in other_ids
+                    else _format_message_id(high, low)
+                ),
+                "mood": labels[mood],
+                "tone": labels[tone],
+                "sentiment": labels[sentiment],
+            }
+            for idx, (by, mood, tone, sentiment, high, low) in enumerate(
+                zip(
+                    self.__by,
+                    self.__moods,
+                    self.__tones,
+                    self.__sentiments,
+                    self.__id_high,
+                    self.__id_low,
+                )
+            )
+        ]
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (CompactConversation, list)):
+            return len(self) == len(other) and all(
+                mine == theirs for mine, theirs in zip(self, other)
+            )
+        return NotImplemented
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __repr__(self) -> str:
+        return f"CompactConversation({len(self)} messages, {self.nbytes} bytes)"
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The approximate size of the stored data: the columns, the content buffer
+        and the interned strings.
+        """
+        columns = (
+            self.__by,
+            self.__moods,
+            self.__tones,
+            self.__sentiments,
+            self.__offsets,
+            self.__id_high,
+            self.__id_low,
+        )
+        return (
+            sum(column.itemsize * len(column) for column in columns)
+            + len(self.__contents)
+            + self.__speakers.nbytes
+            + self.__labels.nbytes
+            + sum(len(message_id) for message_id in self.__other_ids.values())
+        )
+
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls, source: Any, handler: GetCoreSchemaHandler
+    ) -> core_schema.CoreSchema:
+        # validated and serialized as the list of messages, so the JSON is the same
+        list_schema = handler.generate_schema(list[ConversationMessage])
+        from_list = core_schema.no_info_after_validator_function(cls, list_schema)
+        return core_schema.json_or_python_schema(
+            json_schema=from_list,
+            python_schema=core_schema.union_schema(
+                [core_schema.is_instance_schema(cls), from_list]
+            ),
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                cls.to_dicts,
+                return_schema=core_schema.list_schema(
+                    core_schema.dict_schema(
+                        core_schema.str_schema(),
+                        core_schema.nullable_schema(core_schema.str_schema()),
+                    )
+                ),
+            ),
+        )
+
+
+class CompactConversationContext(ConversationContext):
+    """
+    A `ConversationContext` whose `conversation` is a `CompactConversation`,
+    for the conversations of thousands of messages.
+
+    `add_message` appends to the columns without building the message, and the transcript
+    is kept as a single string extended with the new messages.
+    """
+
+    conversation: CompactConversation = Field(default_factory=CompactConversation)
+
+    def add_message(self, by: str, content: str, mood=None, tone=None, sentiment=None):
+        self.conversation.add(by, content, mood=mood, tone=tone, sentiment=sentiment)
+        return self
+
+    def extend(
+        self, messages: Union[list[ConversationMessage], CompactConversation]
+    ) -> "CompactConversationContext":
+        self.conversation.extend(messages)
+        return self
+
+    def _transcript_line(self, idx: int) -> str:
+        return self.conversation.transcript_line(idx)
+
+    def __enter__(self):
+        self.conversation = CompactConversation()
+        self._transcript = None
+        self._rendered = 0
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.conversation = CompactConversation()
+        self._transcript = None
+        self._rendered = 0
+        return False
@@ -0,0 +1,230 @@
+import logging
+import threading
+import unicodedata
+from typing import Callable, Optional, Sequence
+
+from ollama import Client
+
+from .data import (
+    BlockType,
+    ContextBlock,
+    Conversation,
+    ConversationContext,
+    ConversationMessage,
+)
+from .metrics import MetricsHook
+from .scheduler import RequestScheduler
+from .talk_agent import OllamaAgent
+from .utils import format_conversation, strip_think_sections
+
+__all__ = ["ContextWindowManager", "estimate_tokens"]
+
+_logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    A rough token count without a tokenizer:
+    one token per CJK character and one token per 4 characters otherwise.
+    """
+    wide = sum(1 for char in text if unicodedata.east_asian_width(char) in "WF")
+    return wide + (len(text) - wide + 3) // 4
+
+
+class ContextWindowManager(OllamaAgent):
+    """
+    Keep the conversation sent to the model within a token budget.
+
+    The most recent messages are kept verbatim. Once the window exceeds `token_budget`,
+    the oldest messages are folded into a rolling summary until the window is back under
+    `low_watermark * token_budget`. The summary is a `BlockType.memory` context block bound
+    (`ContextBlock.bind`) to the last folded message.
+
+    Summarization is incremental: each fold only sends the previous summary and the newly
+    folded messages to the model, never the whole history.
+
+    The window is a `ConversationContext` kept across the calls and extended with the new
+    messages, so its transcript is rendered incrementally until the next fold.
+
+    A manager keeps the state of a single conversation.
+    """
+
+    _role = "summarize"
+
+    def __init__(
+        self,
+        client: Optional[Client] = None,
+        model: str = "qwq:latest",
+        token_budget: int = 4096,
+        min_recent_messages: int = 4,
+        low_watermark: float = 0.6,
+        summary_max_words: int = 300,
+        token_counter: Callable[[str], int] = estimate_tokens,
+        scheduler: Optional[RequestScheduler] = None,
+        metrics_hooks: Sequence[MetricsHook] = (),
+    ):
+        super().__init__(client, scheduler=scheduler, metrics_hooks=metrics_hooks)
+        if not 0 < low_watermark <= 1:
+            raise ValueError(f"low_watermark should be in (0, 1]: {low_watermark}")
+        self.__model = model[:]
+        self.__token_budget = token_budget
+        self.__min_recent_messages = min_recent_messages
+        self.__low_watermark = low_watermark
+        self.__summary_max_words = summary_max_words
+        self.__count_tokens = token_counter
+        self.__lock = threading.Lock()
+        self._reset()
+
+    @property
+    def model(self):
+        return self.__model
+
+    @property
+    def token_budget(self):
+        return self.__token_budget
+
+    @property
+    def memory_block(self) -> Optional[ContextBlock]:
+        """
+        The latest summary of the folded messages.
+        """
+        return self.__memory_blocks[-1] if self.__memory_blocks else None
+
+    @property
+    def memory_blocks(self) -> list[ContextBlock]:
+        """
+        All the summaries formed so far, each bound to the last message it covers.
+        """
+        return list(self.__memory_blocks)
+
+    @property
+    def folded_count(self) -> int:
+        return self.__folded_count
+
+    def _reset(self):
+        self.__folded_count = 0
+        self.__memory_blocks: list[ContextBlock] = []
+        self.__message_tokens: list[int] = []
+        self.__window: Optional[ConversationContext] = None
+        self.__window_start = 0
+
+    def window(self, conversation: Conversation, name: str) -> ConversationContext:
+        """
+        Return the recent messages of the conversation to send verbatim,
+        folding the older ones into `memory_block` if the budget is exceeded.
+        `name` is the respondent, whose memory the summary is.
+        """
+        messages = (
+            conversation
+            if isinstance(conversation, list)
+            else conversation.conversation
+        )
+        with self.__lock:
+            if self.__folded_count > len(messages) or (
+                self.memory_block is not None
+                and messages[self.__folded_count - 1].message_id
+                != self.memory_block.message_id
+            ):
+                _logger.debug("the conversation is changed, reset the context window")
+                self._reset()
+            for msg in messages[len(self.__message_tokens) :]:
+                self.__message_tokens.append(
+                    self.__count_tokens(msg.to_transcript_line())
+                )
+            if self.__window_tokens(len(messages)) > self.__token_budget:
+                self.__fold(messages, name)
+            return self.__extend_window(conversation, messages)
+
+    def __extend_window(
+        self, conversation: Conversation, messages: list[ConversationMessage]
+    ) -> ConversationContext:
+        start = self.__folded_count
+        window = self.__window
+        size = 0 if window is None else len(window.conversation)
+        if (
+            window is None
+            or self.__window_start != start
+            or start + size > len(messages)
+            or (
+                size
+                and window.conversation[-1].message_id
+                != messages[start + size - 1].message_id
+            )
+        ):
+            # folded or changed since the last call
+            window = self.__window = ConversationContext()
+            if isinstance(conversation, ConversationContext):
+                window.conversation_id = conversation.conversation_id
+            self.__window_start = start
+            size = 0
+        return window.extend(messages[start + size :])
+
+    def __window_tokens(self, end: int, start: Optional[int] = None) -> int:
+        start = self.__folded_count if start is None else start
+        summary_tokens = (
+            0
+            if self.memory_block is None
+            else self.__count_tokens(self.memory_block.block_content)
+        )
+        return summary_tokens + sum(self.__message_tokens[start:end])
+
+    def __fold(self, messages: list[ConversationMessage], name: str):
+        target = self.__token_budget * self.__low_watermark
+        last_foldable = len(messages) - self.__min_recent_messages
+        end = self.__folded_count
+        while end < last_foldable and self.__window_tokens(len(messages), end) > target:
+            end += 1
+        if end == self.__folded_count:
+            _logger.debug("nothing to fold, the recent messages exceed the budget")
+            return
+        folded = messages[self.__folded_count : end]
+        summary = self.__summarize(folded, name)
+        block = ContextBlock(block_type=BlockType.memory, block_content=summary)
+        block.bind(folded[-1])
+        self.__memory_blocks.append(block)
+        self.__folded_count = end
+        _logger.debug(
+            "folded %d messages into the memory of %s (%d messages folded)",
+            len(folded),
+            name,
+            end,
+        )
+
+    def __summarize(self, folded: list[ConversationMessage], name: str) -> str:
+        previous = self.memory_block
+        messages = [
+            {
+                "role": "system",
+                "content": f"""\
+You maintain the memory of {name}, a participant of a conversation.
+Your task is to update the memory with the new messages of the conversation.
+Keep the facts, the relationships, the commitments and the feelings which matter to {name} in the rest of the conversation.
+The memory MUST be written in the same language as the conversation, in at most {self.__summary_max_words} words.
+Write only the updated memory, without any other text.
+""",
+            },
+            {
+                "role": "user",
+                "content": (
+                    "There is no memory yet."
+                    if previous is None
+                    else f"""\
+The current memory is as following:
+```
+{previous.block_content}
+```
+"""
+                ),
+            },
+            {
+                "role": "user",
+                "content": f"""\
+The new messages are as following:
+```
+{format_conversation(folded)}
+```
+""",
+            },
+        ]
+        response = self._chat(messages, options={"temperature": 0.1})
+        return strip_think_sections(response.message.content)
@@ -1,8 +1,8 @@
 from enum import Enum
-from typing import Optional, Type, Union
+from typing import Any, Optional, Type, Union
 from uuid import uuid4
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 
 class _SimpleJsonSchemaMixin:
@@ -35,6 +35,12 @@ class ConversationMessage(BaseModel):
         )
         return f"{prefix}: {self.content}"
 
+    def to_transcript_line(self) -> str:
+        """
+        Render the message as a line of the conversation transcript fed to the agents.
+        """
+        return f"{self.by} (message id {self.message_id!r}): {self.content}"
+
 
 class BlockType(str, Enum):
     """
@@ -90,9 +96,79 @@ class ContextBlock(BaseModel):
         return self_str
 
 
+class PromptLayout(str, Enum):
+    """
+    The layout of the prompt messages sent to the model.
+
+    - `legacy`: the original layout of the prompts.
+    - `prefix_cache`: the stable parts (system prompt, persona and JSON schema) come first and
+      the dynamic parts (the retrieved and memory context blocks, conversation, responses
+      and critics) come last, so ollama can reuse the cached prefix across turns.
+    """
+
+    legacy = "legacy"
+    prefix_cache = "prefix_cache"
+
+
+class LLMCallStats(BaseModel):
+    """
+    The statistics of a single chat call reported by ollama.
+
+    The durations are in nanoseconds, as reported by ollama.
+    `wall_time` is the seconds the call took as seen by the agent, from the request
+    to the last chunk of the response.
+    `done_reason` is ollama's (`stop`, `length`), or `early_stop` if the output is stopped
+    at its JSON object (see `generation`), when the durations are unknown.
+    `reasoning_tokens` is the tokens of the `<think>` sections of the controlled outputs.
+    """
+
+    role: str
+    model: str
+    prompt_eval_count: Optional[int] = None
+    prompt_eval_duration: Optional[int] = None
+    eval_count: Optional[int] = None
+    eval_duration: Optional[int] = None
+    load_duration: Optional[int] = None
+    total_duration: Optional[int] = None
+    wall_time: Optional[float] = None
+    done_reason: Optional[str] = None
+    reasoning_tokens: Optional[int] = None
+
+
+class SpeculationReport(BaseModel):
+    """
+    The report of the speculative candidate generation of a turn.
+
+    `candidates_time` is the sum of the time spent on each completed candidate (generation
+    and critic), and `overlapped_time` is how much of it ran concurrently within `wall_time`.
+    It is not the time saved over a serial generate→critic→revise turn, which would have
+    generated only the first candidate.
+
+    The async agent cancels the candidates in flight once one is accepted, but the sync agent
+    can not: their generations run to completion in the background and keep the model busy
+    (they only skip the critic).
+    """
+
+    num_candidates: int
+    temperatures: list[float]
+    accepted_index: Optional[int] = None
+    completed: int = 0
+    wall_time: float = 0.0
+    candidates_time: float = 0.0
+
+    @property
+    def overlapped_time(self) -> float:
+        return self.candidates_time - self.wall_time
+
+
 class ConversationContext(BaseModel):
     conversation_id: str = Field(default_factory=lambda: f"conv-{uuid4()}")
     conversation: list[ConversationMessage] = Field(default_factory=list)
+    _transcript: Optional[str] = PrivateAttr(default=None)
+    _rendered: int = PrivateAttr(default=0)  # the messages in `_transcript`
+    # the conversation rendered in `_transcript` and its last line, to tell it is changed
+    _rendered_conversation: Any = PrivateAttr(default=None)
+    _rendered_last_line: Optional[str] = PrivateAttr(default=None)
 
     def add_message(self, by: str, content: str, mood=None, tone=None, sentiment=None):
         self.conversation.append(
@@ -102,15 +178,70 @@ class ConversationContext(BaseModel):
         )
         return self
 
+    def extend(self, messages: list[ConversationMessage]):
+        """
+        Append already validated messages, e.g. the messages loaded from a log.
+        """
+        self.conversation.extend(messages)
+        return self
+
+    def _transcript_line(self, idx: int) -> str:
+        return self.conversation[idx].to_transcript_line()
+
+    @property
+    def transcript(self) -> str:
+        """
+        The rendered conversation transcript (see `utils.format_conversation`).
+
+        The transcript is kept as a single string, extended with the messages added
+        since the last call, so the agents do not re-render the whole conversation
+        on every call. It is rendered again if `conversation` is reassigned, truncated,
+        or its last rendered message is replaced or edited.
+        """
+        conversation = self.conversation
+        if (
+            self._transcript is None
+            or conversation is not self._rendered_conversation
+            or self._rendered > len(conversation)
+            or (
+                self._rendered
+                and self._transcript_line(self._rendered - 1)
+                != self._rendered_last_line
+            )
+        ):
+            self._transcript, self._rendered = "", 0
+            self._rendered_conversation = conversation
+        if self._rendered < len(conversation):
+            new_lines = [
+                self._transcript_line(idx)
+                for idx in range(self._rendered, len(conversation))
+            ]
+            joined = "\n".join(new_lines)
+            self._transcript = (
+                f"{self._transcript}\n{joined}" if self._rendered else joined
+            )
+            self._rendered = len(conversation)
+            self._rendered_last_line = new_lines[-1]
+        return self._transcript
+
     def __enter__(self):
         self.conversation = []
+        self._transcript = None
+        self._rendered = 0
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.conversation = []
+        self._transcript = None
+        self._rendered = 0
         return False
 
 
+# the agents accept either a plain list of messages or a `ConversationContext`,
+# whose incrementally rendered transcript is reused
+Conversation = Union[list[ConversationMessage], ConversationContext]
+
+
 class AgentResponse(_SimpleJsonSchemaMixin, BaseModel):
 
     mood: str = Field(description="the mood of the respondent")
@@ -126,6 +257,19 @@ class AgentResponse(_SimpleJsonSchemaMixin, BaseModel):
     )
 
 
+class AgentResponseChunk(BaseModel):
+    """
+    A piece of a streamed `AgentResponse`.
+
+    Concatenating the `delta`s of a field gives its value.
+    `text_response` arrives character by character, while the other fields arrive as a whole once they are complete.
+    """
+
+    field: str
+    delta: str
+    is_complete: bool = False
+
+
 class CriticResponse(_SimpleJsonSchemaMixin, BaseModel):
     is_aligned: bool = Field(
         description="if the user response is aligned with his/her persona"
@@ -134,3 +278,48 @@ class CriticResponse(_SimpleJsonSchemaMixin, BaseModel):
     suggest_change: Union[str, None] = Field(
         description="The suggest change to the response if it is not aligned with the persona. The value should be null if it's aligned."
     )
+
+
+class ScoredCriticResponse(CriticResponse):
+    """
+    The verdict of a critic with its confidence, which is escalated to a stronger critic
+    when it is low (see `routing.EscalationPolicy`).
+    """
+
+    confidence: float = Field(
+        ge=0.0,
+        le=1.0,
+        description="your confidence in your judgement, from 0.0 (a guess) to 1.0 (certain)",
+    )
+
+
+class BatchJob(BaseModel):
+    """
+    A scripted conversation of the batch mode (see `batch`): the user turns of `whoami`,
+    each answered by the agent `name` of the persona in `persona_file`.
+    """
+
+    job_id: str
+    persona_file: str
+    name: str
+    turns: list[str]
+    whoami: str = "User"
+    temperature: float = 0.6
+
+
+class BatchResult(BaseModel):
+    """
+    The outcome of a `BatchJob`: the conversation so far and the `error` it failed with, if any.
+
+    `latency` is the seconds the job took, `turn_latencies` the seconds of each answered turn.
+    `calls` and `eval_tokens` are the model calls of the job and their output tokens.
+    """
+
+    job_id: str
+    name: str
+    conversation: list[ConversationMessage] = Field(default_factory=list)
+    error: Optional[str] = None
+    latency: float = 0.0
+    turn_latencies: list[float] = Field(default_factory=list)
+    calls: int = 0
+    eval_tokens: int = 0
@@ -0,0 +1,279 @@
+"""
+The control of the generation of the reasoning models, whose outputs carry long `<think>`
+sections before the JSON.
+
+With a `GenerationBudget`, the agents stream their chat calls through a `GenerationController`,
+which
+
+- strips the `<think>` sections (and keeps them to be logged),
+- stops the request once a balanced JSON object valid against the response schema is received,
+  instead of paying for the tokens after it (closing code fences, remarks, etc.),
+- and once the reasoning exceeds its token budget, closes the `<think>` section and asks the
+  model to continue from there with the answer.
+
+The tokens are counted by the streamed chunks, as ollama streams one token per chunk.
+The templates of some reasoning models (e.g. qwq) open the `<think>` section in the prompt,
+so the output before the first JSON object or `</think>` counts as reasoning too.
+"""
+
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from ollama import ChatResponse, Message
+
+__all__ = ["GenerationBudget", "GenerationController"]
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+
+@dataclass(frozen=True)
+class GenerationBudget:
+    """
+    The generation budget of the calls of an agent role.
+
+    - `num_predict`: the maximum tokens of an output (ollama's `num_predict`).
+    - `reasoning_tokens`: the maximum tokens of the `<think>` sections; beyond it,
+      the model is made to answer.
+    - `early_stop`: stop the request once a schema-valid JSON object is received.
+    - `log_think`: log the `<think>` sections (at the INFO level).
+    """
+
+    num_predict: Optional[int] = None
+    reasoning_tokens: Optional[int] = None
+    early_stop: bool = True
+    log_think: bool = False
+
+    @property
+    def streamed(self) -> bool:
+        """
+        If the calls are streamed through a `GenerationController`.
+        """
+        return self.early_stop or self.reasoning_tokens is not None
+
+    def options(self, options: Optional[dict] = None) -> Optional[dict]:
+        """
+        The ollama options of the calls, given the options of the agent.
+        """
+        if self.num_predict is None:
+            return options
+        return {**(options or {}), "num_predict": self.num_predict}
+
+
+class GenerationController:
+    """
+    Watch the chunks of a streamed output (see `feed`).
+
+    `validate` tells if the text of a balanced JSON object is a valid response;
+    without it, any balanced object is.
+    """
+
+    STOP = "stop"  # a valid JSON object is received
+    FORCE = "force"  # the reasoning budget is exhausted
+
+    def __init__(
+        self,
+        budget: GenerationBudget,
+        validate: Optional[Callable[[str], bool]] = None,
+    ):
+        self.__budget = budget
+        self.__validate = validate
+        self.__state = "seek"
+        self.__tail = ""  # the last characters, to spot the think tags
+        self.__raw: list[str] = []  # all of the output
+        self.__visible: list[str] = []  # the output outside of the think sections
+        self.__think: list[str] = []
+        self.__object: list[str] = []
+        self.__depth = 0
+        self.__in_string = False
+        self.__escape = False
+        self.__json: Optional[str] = None
+        self.__forced = False
+        # the tokens before the first object or closing tag, which are reasoning if the
+        # template opens the think section
+        self.__pending_reasoning = 0
+        self.__answering = False
+        self.__forced_tokens = (
+            0  # the tokens of the output before it is forced to answer
+        )
+        self.tokens = 0
+        self.reasoning_tokens = 0
+
+    @property
+    def budget(self) -> GenerationBudget:
+        return self.__budget
+
+    @property
+    def stopped(self) -> bool:
+        """
+        If the output is stopped at a valid JSON object.
+        """
+        return self.__json is not None
+
+    @property
+    def forced(self) -> bool:
+        """
+        If the reasoning is cut by its budget.
+        """
+        return self.__forced
+
+    @property
+    def think(self) -> str:
+        return "".join(self.__think).strip()
+
+    @property
+    def raw(self) -> str:
+        return "".join(self.__raw)
+
+    @property
+    def content(self) -> str:
+        """
+        The JSON object if the output is stopped at it, the output without the think sections
+        otherwise.
+        """
+        if self.__json is not None:
+            return self.__json
+        return "".join(self.__visible).strip()
+
+    def feed(self, text: str) -> Optional[str]:
+        """
+        Feed a chunk of the output. Return `STOP` once a valid JSON object is received,
+        and `FORCE` once the reasoning budget is exhausted, None otherwise.
+        """
+        self.tokens += 1
+        if self.__state == "think":
+            self.reasoning_tokens += 1
+        elif self.__state == "seek" and not self.__answering:
+            self.__pending_reasoning += 1
+        self.__raw.append(text)
+        if self.__json is None:
+            for char in text:
+                self.__consume(char)
+                if self.__json is not None:
+                    break
+        if self.__json is not None:
+            return self.STOP if self.__budget.early_stop else None
+        budget = self.__budget.reasoning_tokens
+        if budget is None or self.__forced:
+            return None
+        if self.__state == "think" and self.reasoning_tokens >= budget:
+            return self.FORCE
+        if (
+            self.__state == "seek"
+            and not self.__answering
+            and self.reasoning_tokens + self.__pending_reasoning >= budget
+        ):
+            # an unterminated reasoning, of a template opening the think section
+            return self.FORCE
+        return None
+
+    def force_answer(self, messages: list[dict]) -> tuple[str, list[dict]]:
+        """
+        Close the think section once the reasoning budget is exhausted.
+        Return the closing text, and the messages to continue the output from there:
+        the output so far, closed, as the (last) assistant message.
+        """
+        closing = f"\n{_THINK_CLOSE}\n\n"
+        prefix = self.raw + closing
+        if messages and messages[-1]["role"] == "assistant":
+            messages = messages[:-1] + [
+                {"role": "assistant", "content": messages[-1]["content"] + prefix}
+            ]
+        else:
+            messages = messages + [{"role": "assistant", "content": prefix}]
+        for char in closing:
+            self.__consume(char)
+        self.__raw.append(closing)
+        self.__forced = True
+        self.__forced_tokens = self.tokens
+        return closing, messages
+
+    def response(self, model: str, last_chunk: Optional[ChatResponse]) -> ChatResponse:
+        """
+        The chat response of the output, with `content` as its content.
+        The stats of ollama are known only if the output is complete (`last_chunk.done`),
+        otherwise `eval_count` is the streamed tokens. The tokens of the output before
+        it is forced to answer are added to the ones ollama reports for the continuation.
+        """
+        message = Message(role="assistant", content=self.content)
+        if last_chunk is not None and last_chunk.done:
+            return ChatResponse(
+                **{
+                    **last_chunk.model_dump(exclude={"message"}),
+                    "eval_count": (last_chunk.eval_count or 0) + self.__forced_tokens,
+                    "message": message,
+                }
+            )
+        return ChatResponse(
+            model=model,
+            created_at=None if last_chunk is None else last_chunk.created_at,
+            done=True,
+            done_reason="early_stop",
+            eval_count=self.tokens,
+            message=message,
+        )
+
+    def __consume(self, char: str):
+        state = self.__state
+        if state == "think":
+            self.__think.append(char)
+            self.__tail = (self.__tail + char)[-len(_THINK_CLOSE) :]
+            if self.__tail == _THINK_CLOSE:
+                del self.__think[-len(_THINK_CLOSE) :]
+                self.__state = "seek"
+                self.__tail = ""
+                self.__answering = True
+            return
+        self.__visible.append(char)
+        self.__tail = (self.__tail + char)[-len(_THINK_CLOSE) :]
+        if self.__tail.endswith(_THINK_OPEN):
+            del self.__visible[-len(_THINK_OPEN) :]
+            # the opening tag is not in a pre-opened section
+            self.__pending_reasoning = 0
+            self.__state = "think"
+            self.__object = []
+            self.__tail = ""
+            return
+        if self.__tail == _THINK_CLOSE:
+            # the reasoning models may open the section in the prompt template,
+            # so the output before the closing tag is the reasoning
+            self.__think.extend(self.__visible[: -len(_THINK_CLOSE)])
+            self.__visible = []
+            if not self.__answering:
+                self.reasoning_tokens += self.__pending_reasoning
+                self.__pending_reasoning = 0
+                self.__answering = True
+            self.__state = "seek"
+            self.__object = []
+            self.__tail = ""
+            return
+        if state == "seek":
+            if char == "{":
+                self.__answering = True
+                self.__state = "object"
+                self.__object = [char]
+                self.__depth = 1
+                self.__in_string = False
+                self.__escape = False
+            return
+        # in an object
+        self.__object.append(char)
+        if self.__in_string:
+            if self.__escape:
+                self.__escape = False
+            elif char == "\\":
+                self.__escape = True
+            elif char == '"':
+                self.__in_string = False
+        elif char == '"':
+            self.__in_string = True
+        elif char in "{[":
+            self.__depth += 1
+        elif char in "}]":
+            self.__depth -= 1
+            if self.__depth == 0:
+                text = "".join(self.__object)
+                self.__state = "seek"
+                self.__object = []
+                if self.__validate is None or self.__validate(text):
+                    self.__json = text
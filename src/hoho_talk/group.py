@@ -0,0 +1,402 @@
+"""
+Group conversations: rooms of `OllamaTalkAgent`s over a shared `ConversationContext`.
+
+A `SpeakerPolicy` picks who speaks next. While the speaker's draft goes through its
+critic/revision loop, the turns of the most likely next speakers (`lookahead`) are computed
+concurrently on the conversation extended with the draft, betting that the draft is accepted
+as is. A precomputed turn is used if the policy picks its speaker and the conversation it
+assumed is the actual one, and discarded as stale otherwise.
+
+    with GroupConversation(agents, policy=MentionPolicy()) as room:
+        room.add_message(by="Host", content="What did you all do this weekend?")
+        for message in room.run(turns=20):
+            print(message)
+"""
+
+import abc
+import logging
+import random
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, Optional, Sequence
+
+from .data import AgentResponse, ConversationContext, ConversationMessage
+from .talk_agent import OllamaTalkAgent
+
+__all__ = [
+    "GroupConversation",
+    "MentionPolicy",
+    "RandomPolicy",
+    "RoundRobinPolicy",
+    "SPEAKER_POLICIES",
+    "SpeakerPolicy",
+]
+
+_logger = logging.getLogger(__name__)
+
+
+class SpeakerPolicy(abc.ABC):
+    """
+    Who speaks next in a group conversation.
+
+    `rank` orders the names of the agents by how likely they speak next, and `select` picks
+    the next speaker, the first ranked one by default. The turns of the first ranked speakers
+    are precomputed, so `rank` should be cheap and depend on the conversation only.
+    """
+
+    @abc.abstractmethod
+    def rank(
+        self, conversation: list[ConversationMessage], names: Sequence[str]
+    ) -> list[str]:
+        pass
+
+    def select(
+        self, conversation: list[ConversationMessage], names: Sequence[str]
+    ) -> str:
+        return self.rank(conversation, names)[0]
+
+
+def _last_speaker(
+    conversation: list[ConversationMessage], names: Sequence[str]
+) -> Optional[str]:
+    return next((msg.by for msg in reversed(conversation) if msg.by in names), None)
+
+
+def _last_spoken(
+    conversation: list[ConversationMessage], names: Sequence[str]
+) -> dict[str, int]:
+    # the index of the last message of each agent, -1 if none
+    last_spoken = {name: -1 for name in names}
+    for idx, msg in enumerate(conversation):
+        if msg.by in last_spoken:
+            last_spoken[msg.by] = idx
+    return last_spoken
+
+
+def _last_first(ranked: list[str], last: Optional[str]) -> list[str]:
+    # nobody speaks twice in a row, unless alone
+    return [name for name in ranked if name != last] + (
+        [last] if last in ranked else []
+    )
+
+
+class RoundRobinPolicy(SpeakerPolicy):
+    """
+    The agents speak in turn, in their order.
+    """
+
+    def rank(
+        self, conversation: list[ConversationMessage], names: Sequence[str]
+    ) -> list[str]:
+        last = _last_speaker(conversation, names)
+        start = 0 if last is None else list(names).index(last) + 1
+        return [names[(start + idx) % len(names)] for idx in range(len(names))]
+
+
+class MentionPolicy(SpeakerPolicy):
+    """
+    The agents mentioned in the last message speak first, in the order of the mentions,
+    then the ones who have not spoken for the longest.
+    """
+
+    def rank(
+        self, conversation: list[ConversationMessage], names: Sequence[str]
+    ) -> list[str]:
+        last_spoken = _last_spoken(conversation, names)
+        ranked = sorted(names, key=lambda name: last_spoken[name])
+        if conversation:
+            content = conversation[-1].content
+            mentions = {}
+            for name in names:
+                match = re.search(rf"\b{re.escape(name)}\b", content, re.IGNORECASE)
+                if match is not None:
+                    mentions[name] = match.start()
+            ranked = sorted(mentions, key=mentions.get) + [
+                name for name in ranked if name not in mentions
+            ]
+        return _last_first(ranked, _last_speaker(conversation, names))
+
+
+class RandomPolicy(SpeakerPolicy):
+    """
+    A random agent speaks next, other than the last speaker, with a chance proportional to
+    the messages since it last spoke. The draws are seeded by `seed`.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+
+    def rank(
+        self, conversation: list[ConversationMessage], names: Sequence[str]
+    ) -> list[str]:
+        weights = self.__weights(conversation, names)
+        return _last_first(
+            sorted(names, key=lambda name: -weights[name]),
+            _last_speaker(conversation, names),
+        )
+
+    def select(
+        self, conversation: list[ConversationMessage], names: Sequence[str]
+    ) -> str:
+        weights = self.__weights(conversation, names)
+        last = _last_speaker(conversation, names)
+        candidates = [name for name in names if name != last] or list(names)
+        with self.__lock:
+            return self.__random.choices(
+                candidates, weights=[weights[name] for name in candidates]
+            )[0]
+
+    @staticmethod
+    def __weights(
+        conversation: list[ConversationMessage], names: Sequence[str]
+    ) -> dict[str, int]:
+        last_spoken = _last_spoken(conversation, names)
+        return {name: len(conversation) - last_spoken[name] for name in names}
+
+
+SPEAKER_POLICIES = {
+    "round_robin": RoundRobinPolicy,
+    "mention": MentionPolicy,
+    "random": RandomPolicy,
+}
+
+
+def _fingerprint(conversation: list[ConversationMessage]) -> tuple[int, int]:
+    # the agents see the speakers and the contents of the messages only
+    return len(conversation), hash(tuple((msg.by, msg.content) for msg in conversation))
+
+
+class _Precomputed:
+    """
+    A turn computed ahead, on `ctx`.
+    """
+
+    def __init__(self, ctx: ConversationContext):
+        self.ctx = ctx
+        self.cancelled = threading.Event()
+        self.future: Optional[Future] = None
+        self.draft: Optional[AgentResponse] = None
+        self.taken = False  # if it is the turn taken
+
+
+class GroupConversation:
+    """
+    A conversation of `agents` (of distinct names), who speak in the order of `policy`
+    (`RoundRobinPolicy` by default). Other participants, e.g. a human host, join with
+    `add_message`.
+
+    The turns of the `lookahead` first ranked speakers are precomputed concurrently with the
+    current turn (see the module docstring), within the requests ollama runs in parallel
+    (`OLLAMA_NUM_PARALLEL`). As the speaker picked by a deterministic policy (round robin or
+    mentions) is known from the conversation, one is enough for them; more pay off with the
+    policies which draw the speaker (`RandomPolicy`). With
+    `lookahead=0`, the turns are computed one by one. The turns of the agents with a context
+    window or a memory extractor are not precomputed, as they change the agent.
+    """
+
+    def __init__(
+        self,
+        agents: Sequence[OllamaTalkAgent],
+        policy: Optional[SpeakerPolicy] = None,
+        ctx: Optional[ConversationContext] = None,
+        lookahead: int = 1,
+        temperature: float = 0.6,
+    ):
+        names = [agent.name for agent in agents]
+        if not names or len(set(names)) != len(names):
+            raise ValueError(f"expected agents of distinct names, got {names}")
+        self.__agents = {agent.name: agent for agent in agents}
+        self.__names = names
+        self.__policy = RoundRobinPolicy() if policy is None else policy
+        self.__ctx = ConversationContext() if ctx is None else ctx
+        self.__lookahead = lookahead
+        self.__temperature = temperature
+        # an agent takes one turn at a time
+        self.__agent_locks = {name: threading.Lock() for name in names}
+        self.__lock = threading.Lock()
+        self.__precomputed: dict[tuple[int, int, str], _Precomputed] = {}
+        self.__executor = (
+            # the precomputed turns, and the one taken
+            ThreadPoolExecutor(max_workers=lookahead + 1, thread_name_prefix="group")
+            if lookahead > 0
+            else None
+        )
+        self.__closed = False
+        self.__stats = {"turns": 0, "precomputed": 0, "hits": 0, "stale": 0}
+
+    @property
+    def ctx(self) -> ConversationContext:
+        return self.__ctx
+
+    @property
+    def names(self) -> list[str]:
+        return list(self.__names)
+
+    @property
+    def policy(self) -> SpeakerPolicy:
+        return self.__policy
+
+    @property
+    def lookahead(self) -> int:
+        return self.__lookahead
+
+    def stats(self) -> dict:
+        """
+        The turns taken, the turns precomputed, and the precomputed turns used (`hits`)
+        and discarded (`stale`).
+        """
+        with self.__lock:
+            return dict(self.__stats)
+
+    def add_message(self, by: str, content: str) -> ConversationMessage:
+        """
+        Add the message of a participant other than the agents.
+        """
+        with self.__lock:
+            self.__ctx.add_message(by=by, content=content)
+            return self.__ctx.conversation[-1]
+
+    def step(self) -> ConversationMessage:
+        """
+        Take the next turn, and return its message.
+        """
+        speaker = self.__policy.select(self.__ctx.conversation, self.__names)
+        with self.__lock:
+            precomputed = self.__precomputed.pop(
+                (*_fingerprint(self.__ctx.conversation), speaker), None
+            )
+            self.__discard_stale()
+            if precomputed is not None:
+                precomputed.taken = True
+                if precomputed.draft is not None:
+                    self.__precompute(speaker, precomputed.ctx, precomputed.draft)
+        response = None
+        if precomputed is not None:
+            try:
+                response = precomputed.future.result()
+            except Exception as error:
+                _logger.debug("the precomputed turn of %s failed: %r", speaker, error)
+        hit = response is not None
+        if response is None:
+            response = self.__take_turn(speaker, self.__ctx)
+        with self.__lock:
+            self.__stats["turns"] += 1
+            if hit:
+                self.__stats["hits"] += 1
+            self.__ctx.add_message(
+                by=speaker,
+                content=response.text_response,
+                mood=response.mood,
+                tone=response.tone,
+                sentiment=response.sentiment,
+            )
+            return self.__ctx.conversation[-1]
+
+    def run(self, turns: int) -> Iterator[ConversationMessage]:
+        for _ in range(turns):
+            yield self.step()
+
+    def close(self, wait: bool = False):
+        """
+        Discard the precomputed turns. The ones in flight can not be interrupted,
+        but they are waited for only if `wait`.
+        """
+        with self.__lock:
+            self.__closed = True
+            for precomputed in self.__precomputed.values():
+                self.__cancel(precomputed)
+            self.__precomputed = {}
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __take_turn(
+        self,
+        speaker: str,
+        ctx: ConversationContext,
+        precomputed: Optional[_Precomputed] = None,
+    ) -> AgentResponse:
+        with self.__agent_locks[speaker]:
+            if precomputed is not None and precomputed.cancelled.is_set():
+                raise RuntimeError("the precomputed turn is stale")
+            return self.__agents[speaker].get_response(
+                ctx,
+                temperature=self.__temperature,
+                on_draft=lambda draft: self.__on_draft(
+                    speaker, ctx, draft, precomputed
+                ),
+            )
+
+    def __on_draft(
+        self,
+        speaker: str,
+        ctx: ConversationContext,
+        draft: AgentResponse,
+        precomputed: Optional[_Precomputed],
+    ):
+        with self.__lock:
+            if precomputed is not None:
+                if precomputed.cancelled.is_set():
+                    # skip the critic/revision loop of the stale turn
+                    raise RuntimeError("the precomputed turn is stale")
+                precomputed.draft = draft
+                # the turns after a precomputed turn are precomputed once it is taken
+                if not precomputed.taken:
+                    return
+            self.__precompute(speaker, ctx, draft)
+
+    def __precompute(
+        self, speaker: str, ctx: ConversationContext, draft: AgentResponse
+    ):
+        """
+        Start the turns of the likely next speakers, as if `draft` is accepted.
+        """
+        if self.__executor is None or self.__closed:
+            return
+        predicted = ConversationContext(conversation_id=ctx.conversation_id).extend(
+            list(ctx.conversation)
+        )
+        predicted.add_message(
+            by=speaker,
+            content=draft.text_response,
+            mood=draft.mood,
+            tone=draft.tone,
+            sentiment=draft.sentiment,
+        )
+        fingerprint = _fingerprint(predicted.conversation)
+        for name in self.__policy.rank(predicted.conversation, self.__names)[
+            : self.__lookahead
+        ]:
+            agent = self.__agents[name]
+            key = (*fingerprint, name)
+            if (
+                key in self.__precomputed
+                or agent.context_window is not None
+                or agent.memory_extractor is not None
+            ):
+                continue
+            precomputed = _Precomputed(predicted)
+            precomputed.future = self.__executor.submit(
+                self.__take_turn, name, predicted, precomputed
+            )
+            self.__precomputed[key] = precomputed
+            self.__stats["precomputed"] += 1
+
+    def __discard_stale(self):
+        # the turns precomputed for this turn or before, other than the one taken
+        num_messages = len(self.__ctx.conversation)
+        for key in [key for key in self.__precomputed if key[0] <= num_messages]:
+            self.__cancel(self.__precomputed.pop(key))
+            self.__stats["stale"] += 1
+
+    @staticmethod
+    def __cancel(precomputed: _Precomputed):
+        precomputed.cancelled.set()
+        precomputed.future.cancel()
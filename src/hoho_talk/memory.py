@@ -0,0 +1,266 @@
+import logging
+import queue
+import threading
+import weakref
+from typing import TYPE_CHECKING, Optional, Sequence
+
+from ollama import Client
+
+from .data import AgentResponse, ContextBlock, Conversation, ConversationMessage
+from .metrics import MetricsHook
+from .scheduler import RequestScheduler
+from .talk_agent import OllamaAgent
+from .tools import ToolRegistry
+from .utils import dedup_tool_calls, format_conversation
+
+if TYPE_CHECKING:
+    from .talk_agent import OllamaTalkAgent
+
+__all__ = ["MemoryExtractor"]
+
+_logger = logging.getLogger(__name__)
+_STOP = object()
+
+
+class MemoryExtractor(OllamaAgent):
+    """
+    Update the context blocks of the agents with the `insert_context_block` tool,
+    in a background worker, off the critical path of the responses.
+
+    `submit` only enqueues the turn. The worker batches the turns queued in the meantime:
+    the turns of the same agent are folded into a single tool call request covering all the
+    messages since the last extraction. The tool calls are deduplicated by name and
+    arguments, and the blocks already known by the agent are skipped. An invalid tool call
+    (e.g. an unknown block type) is logged and counted in `invalid_calls`, and does not
+    stop the other calls of the batch.
+    """
+
+    _role = "memorize"
+    _TOOL_NAME = "insert_context_block"
+
+    def __init__(
+        self,
+        client: Optional[Client] = None,
+        model: str = "qwq:latest",
+        max_batch: int = 8,
+        max_messages: int = 20,
+        scheduler: Optional[RequestScheduler] = None,
+        metrics_hooks: Sequence[MetricsHook] = (),
+    ):
+        super().__init__(client, scheduler=scheduler, metrics_hooks=metrics_hooks)
+        self.__model = model[:]
+        self.__max_batch = max_batch
+        self.__max_messages = max_messages
+        self.__queue: queue.Queue = queue.Queue()
+        self.__worker: Optional[threading.Thread] = None
+        self.__worker_lock = threading.Lock()
+        # the last message extracted by agent, forgotten with the agent
+        self.__last_message_ids: weakref.WeakKeyDictionary["OllamaTalkAgent", str] = (
+            weakref.WeakKeyDictionary()
+        )
+        self.__stats_lock = threading.Lock()
+        self.__stats = {
+            "submitted": 0,
+            "batches": 0,
+            "tool_calls": 0,
+            "duplicates": 0,
+            "inserted": 0,
+            "invalid_calls": 0,
+            "failures": 0,
+        }
+
+    @property
+    def model(self):
+        return self.__model
+
+    def stats(self) -> dict:
+        with self.__stats_lock:
+            return dict(self.__stats)
+
+    def submit(
+        self,
+        agent: "OllamaTalkAgent",
+        conversation: Conversation,
+        agent_response: AgentResponse,
+    ):
+        """
+        Queue the turn (the conversation and the response of `agent` to it) for extraction.
+        """
+        messages = (
+            conversation
+            if isinstance(conversation, list)
+            else conversation.conversation
+        )
+        self.__ensure_worker()
+        # snapshot the messages, the conversation goes on while the job is queued
+        self.__queue.put((agent, list(messages), agent_response))
+        self.__count("submitted")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the queued turns to be processed.
+        Return False if they are still being processed after `timeout` seconds.
+        """
+        if timeout is None:
+            self.__queue.join()
+            return True
+        done = threading.Event()
+        threading.Thread(
+            target=lambda: (self.__queue.join(), done.set()), daemon=True
+        ).start()
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Process the queued turns and stop the worker.
+        """
+        with self.__worker_lock:
+            worker, self.__worker = self.__worker, None
+        if worker is None:
+            return
+        self.__queue.put(_STOP)
+        worker.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __ensure_worker(self):
+        with self.__worker_lock:
+            if self.__worker is None:
+                self.__worker = threading.Thread(
+                    target=self.__run, name="memory-extractor", daemon=True
+                )
+                self.__worker.start()
+
+    def __count(self, key: str, num: int = 1):
+        with self.__stats_lock:
+            self.__stats[key] += num
+
+    def __run(self):
+        while True:
+            jobs = [self.__queue.get()]
+            while len(jobs) < self.__max_batch:
+                try:
+                    jobs.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(job is _STOP for job in jobs)
+            # the latest turn of an agent covers its earlier turns
+            latest = {id(job[0]): job for job in jobs if job is not _STOP}
+            try:
+                for agent, messages, agent_response in latest.values():
+                    self.__count("batches")
+                    try:
+                        self.__extract(agent, messages, agent_response)
+                    except Exception as error:
+                        self.__count("failures")
+                        _logger.warning(
+                            "failed to update the memory of %s: %r", agent.name, error
+                        )
+            finally:
+                for _ in jobs:
+                    self.__queue.task_done()
+            if stop:
+                return
+
+    def __extract(
+        self,
+        agent: "OllamaTalkAgent",
+        messages: list[ConversationMessage],
+        agent_response: AgentResponse,
+    ):
+        last_id = self.__last_message_ids.get(agent)
+        start = 0
+        for idx, msg in enumerate(messages):
+            if msg.message_id == last_id:
+                start = idx + 1
+        new_messages = messages[max(start, len(messages) - self.__max_messages) :]
+        if not new_messages:
+            return
+        tool, _ = ToolRegistry.get_llm_tool(self._TOOL_NAME)
+        response = self._chat(
+            self.__compose_messages(agent, new_messages, agent_response),
+            tools=[tool],
+            options={"temperature": 0.1},
+        )
+        self.__last_message_ids[agent] = messages[-1].message_id
+        tool_calls = [
+            call
+            for call in response.message.tool_calls or []
+            if call.function.name == self._TOOL_NAME
+        ]
+        unique_calls = dedup_tool_calls(tool_calls)
+        self.__count("tool_calls", len(tool_calls))
+        self.__count("duplicates", len(tool_calls) - len(unique_calls))
+        known = {
+            (block.block_type.value, block.block_content.strip())
+            for block in agent.context_blocks
+        }
+        for call in unique_calls:
+            arguments = dict(call.function.arguments)
+            key = (
+                str(arguments.get("block_type", "")),
+                str(arguments.get("block_content", "")).strip(),
+            )
+            if key in known:
+                self.__count("duplicates")
+                continue
+            try:
+                block: ContextBlock = ToolRegistry.call(
+                    self._TOOL_NAME, agent, arguments
+                )
+            except Exception as error:
+                self.__count("invalid_calls")
+                _logger.warning(
+                    "invalid %s call for %s: %r", self._TOOL_NAME, agent.name, error
+                )
+                continue
+            known.add(key)
+            self.__count("inserted")
+            _logger.debug("inserted a %s block to %s", block.block_type, agent.name)
+
+    def __compose_messages(
+        self,
+        agent: "OllamaTalkAgent",
+        new_messages: list[ConversationMessage],
+        agent_response: AgentResponse,
+    ) -> list[dict]:
+        blocks = "\n".join(str(block) for block in agent.context_blocks)
+        return [
+            {
+                "role": "system",
+                "content": f"""\
+You maintain the context blocks of {agent.name}, a participant of a conversation.
+You have access to the tool, `insert_context_block`, which allows you to update the context blocks.
+Use the `insert_context_block` tool when there is significant information in the conversation which is not included in the context blocks.
+Each block should be short and self-contained, and MUST be written in the same language as the conversation.
+Do not call the tool if there is nothing new worth remembering.
+""",
+            },
+            {
+                "role": "user",
+                "content": f"""\
+The persona of {agent.name} is as following:
+```
+{agent.persona}
+```
+The current context blocks are as following:
+```
+{blocks or "(no context blocks yet)"}
+```
+""",
+            },
+            {
+                "role": "user",
+                "content": f"""\
+The new messages of the conversation are as following:
+```
+{format_conversation(new_messages)}
+{agent.name}: {agent_response.text_response}
+```
+""",
+            },
+        ]
@@ -0,0 +1,298 @@
+"""
+The instrumentation hooks of the agents.
+
+The agents report to their `metrics_hooks` (see `MetricsHook`):
+
+- each chat call with its `LLMCallStats` (the wall time and ollama's token counts and durations),
+- the wall time of the stages of a turn (`turn`, `context_window`, `retrieval`, `generate`,
+  `critic`, the `escalation` of the critic verdicts, `revise`, `revision_trial` and the `parse`
+  of the outputs),
+- and each verdict of the critics.
+
+`HistogramExporter` aggregates them in process, and dumps them in the Prometheus text format.
+"""
+
+import bisect
+import logging
+import math
+import threading
+from typing import Iterable, Optional
+
+from .data import LLMCallStats
+
+__all__ = [
+    "DEFAULT_SECONDS_BUCKETS",
+    "DEFAULT_TOKENS_BUCKETS",
+    "Histogram",
+    "HistogramExporter",
+    "MetricsHook",
+]
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_SECONDS_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+DEFAULT_TOKENS_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+class MetricsHook:
+    """
+    The callbacks of the instrumentation, which do nothing by default.
+    Override the ones of interest.
+
+    They are called from the threads (or the event loop) running the calls,
+    so they should be thread-safe and fast. The errors they raise are logged and ignored.
+    """
+
+    def on_call(self, stats: LLMCallStats):
+        """
+        A chat call is done.
+        """
+
+    def on_stage(self, stage: str, seconds: float, **labels: str):
+        """
+        A stage of a turn is done in `seconds`.
+        """
+
+    def on_verdict(self, is_aligned: bool, cached: bool):
+        """
+        A critic gives its verdict, from its cache or not.
+        """
+
+
+class Histogram:
+    """
+    The counts of the observations by upper bound (`bounds`, plus `+Inf`), as in Prometheus.
+    """
+
+    def __init__(self, bounds: Iterable[float]):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate the `q` quantile by the linear interpolation within its bucket.
+        """
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if idx == len(self.bounds):
+                    # no upper bound, the best guess is the largest bound
+                    return self.bounds[-1] if self.bounds else math.nan
+                lower = self.bounds[idx - 1] if idx else 0.0
+                return lower + (self.bounds[idx] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.mean,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], **extra: str) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class HistogramExporter(MetricsHook):
+    """
+    Aggregate the instrumentation into histograms by metric and labels:
+
+    - `hoho_talk_stage_seconds{stage=...}`: the wall time of the stages of the turns.
+    - `hoho_talk_call_seconds{role=...,model=...}`: the wall time of the chat calls.
+    - `hoho_talk_prompt_tokens` and `hoho_talk_eval_tokens`: ollama's `prompt_eval_count`
+      and `eval_count` of the calls.
+    - `hoho_talk_reasoning_tokens`: the `<think>` tokens of the controlled calls
+      (see `generation`).
+    - `hoho_talk_load_seconds`, `hoho_talk_prompt_eval_seconds` and `hoho_talk_eval_seconds`:
+      ollama's `load_duration`, `prompt_eval_duration` and `eval_duration` of the calls.
+
+    and count the critic verdicts (`hoho_talk_critic_verdicts_total{verdict=...,cached=...}`).
+    """
+
+    def __init__(
+        self,
+        seconds_buckets: Iterable[float] = DEFAULT_SECONDS_BUCKETS,
+        tokens_buckets: Iterable[float] = DEFAULT_TOKENS_BUCKETS,
+    ):
+        self.__seconds_buckets = tuple(seconds_buckets)
+        self.__tokens_buckets = tuple(tokens_buckets)
+        self.__lock = threading.Lock()
+        # name -> labels -> histogram
+        self.__histograms: dict[str, dict[tuple, Histogram]] = {}
+        self.__verdicts: dict[tuple, int] = {}
+
+    def on_call(self, stats: LLMCallStats):
+        labels = (("role", stats.role), ("model", stats.model))
+        with self.__lock:
+            if stats.wall_time is not None:
+                self.__observe("hoho_talk_call_seconds", labels, stats.wall_time)
+            for name, value, tokens in (
+                ("hoho_talk_prompt_tokens", stats.prompt_eval_count, True),
+                ("hoho_talk_eval_tokens", stats.eval_count, True),
+                ("hoho_talk_reasoning_tokens", stats.reasoning_tokens, True),
+                ("hoho_talk_load_seconds", stats.load_duration, False),
+                ("hoho_talk_prompt_eval_seconds", stats.prompt_eval_duration, False),
+                ("hoho_talk_eval_seconds", stats.eval_duration, False),
+            ):
+                if value is not None:
+                    self.__observe(
+                        name, labels, value if tokens else value / 1e9, tokens=tokens
+                    )
+
+    def on_stage(self, stage: str, seconds: float, **labels: str):
+        labels = (("stage", stage),) + tuple(sorted(labels.items()))
+        with self.__lock:
+            self.__observe("hoho_talk_stage_seconds", labels, seconds)
+
+    def on_verdict(self, is_aligned: bool, cached: bool):
+        key = ("accepted" if is_aligned else "rejected", "true" if cached else "false")
+        with self.__lock:
+            self.__verdicts[key] = self.__verdicts.get(key, 0) + 1
+
+    def __observe(self, name: str, labels: tuple, value: float, tokens=False):
+        by_labels = self.__histograms.setdefault(name, {})
+        if labels not in by_labels:
+            by_labels[labels] = Histogram(
+                self.__tokens_buckets if tokens else self.__seconds_buckets
+            )
+        by_labels[labels].observe(value)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        """
+        The histogram of `name` with exactly `labels`, e.g. `histogram("hoho_talk_stage_seconds",
+        stage="critic")`.
+        """
+        with self.__lock:
+            for key, histogram in self.__histograms.get(name, {}).items():
+                if dict(key) == labels:
+                    return histogram
+        return None
+
+    @property
+    def accept_rate(self) -> Optional[float]:
+        """
+        The rate of the critic verdicts accepting the response, `None` before any verdict.
+        """
+        with self.__lock:
+            total = sum(self.__verdicts.values())
+            accepted = sum(
+                count
+                for (verdict, _), count in self.__verdicts.items()
+                if verdict == "accepted"
+            )
+        return accepted / total if total else None
+
+    def latency_by_role(self) -> list[dict]:
+        """
+        The summaries of the wall time of the chat calls by role and model, to tune the models
+        of the roles (see `OllamaTalkAgent`'s `critic_model` and `revise_model`).
+        """
+        with self.__lock:
+            return [
+                {**dict(labels), **histogram.to_dict()}
+                for labels, histogram in sorted(
+                    self.__histograms.get("hoho_talk_call_seconds", {}).items()
+                )
+            ]
+
+    def snapshot(self) -> dict:
+        """
+        The summaries (count, sum, mean and estimated quantiles) of the histograms,
+        the verdict counts and the accept rate, as a JSON-able dict.
+        """
+        with self.__lock:
+            histograms = {
+                name: [
+                    {"labels": dict(labels), **histogram.to_dict()}
+                    for labels, histogram in by_labels.items()
+                ]
+                for name, by_labels in self.__histograms.items()
+            }
+            verdicts = [
+                {"verdict": verdict, "cached": cached == "true", "count": count}
+                for (verdict, cached), count in self.__verdicts.items()
+            ]
+        return {
+            "histograms": histograms,
+            "verdicts": verdicts,
+            "accept_rate": self.accept_rate,
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Dump the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.__lock:
+            for name in sorted(self.__histograms):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(self.__histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(
+                        histogram.bounds + (math.inf,), histogram.counts
+                    ):
+                        cumulative += count
+                        lines.append(
+                            f"{name}_bucket{_format_labels(labels, le=_format_value(bound))}"
+                            f" {cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}"
+                    )
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+            name = "hoho_talk_critic_verdicts_total"
+            lines.append(f"# TYPE {name} counter")
+            for (verdict, cached), count in sorted(self.__verdicts.items()):
+                labels = (("verdict", verdict), ("cached", cached))
+                lines.append(f"{name}{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+from .data import ContextBlock, ConversationMessage
+
+__all__ = ["ConversationLog"]
+
+_logger = logging.getLogger(__name__)
+# the offset of a message record in the log, as a little-endian unsigned 64-bit integer
+_OFFSET = struct.Struct("<Q")
+_BLOCK_PREFIX = b'{"kind": "block"'
+_READ_SIZE = 64 * 1024
+
+
+class ConversationLog:
+    """
+    An append-only JSONL write-ahead log of a conversation.
+
+    Each `ConversationMessage` and `ContextBlock` is appended as a record as soon as it is
+    produced, and the log is fsynced every `fsync_every` records or `fsync_interval` seconds,
+    whichever comes first, so a crash loses at most the last batch. The interval is kept by
+    a timer, so the records are synced even if no record follows them.
+
+    The offsets of the message records are kept in a sidecar index (`<path>.idx`) of
+    fixed-size entries, so `tail` seeks straight to the last N messages without reading
+    the rest of the log. The index is checked against the log and caught up on open.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        fsync_every: int = 16,
+        fsync_interval: float = 1.0,
+    ):
+        self.__path = Path(path)
+        self.__index_path = self.__path.with_name(self.__path.name + ".idx")
+        self.__fsync_every = fsync_every
+        self.__fsync_interval = fsync_interval
+        self.__lock = threading.Lock()
+        self.__path.parent.mkdir(parents=True, exist_ok=True)
+        self.__recover()
+        self.__log = self.__path.open("ab")
+        self.__index = self.__index_path.open("ab")
+        self.__pending = 0
+        self.__last_sync = time.monotonic()
+        self.__timer: Optional[threading.Timer] = None
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+
+    def __len__(self):
+        """
+        The number of messages in the log.
+        """
+        return self.__num_messages
+
+    def append_message(self, message: ConversationMessage):
+        self.__append("message", message.model_dump(mode="json"))
+
+    def append_block(self, block: ContextBlock):
+        self.__append("block", block.model_dump(mode="json"))
+
+    def tail(
+        self, num_messages: Optional[int] = None
+    ) -> tuple[list[ConversationMessage], list[ContextBlock]]:
+        """
+        The last `num_messages` messages (all if None) and the blocks logged since the first of them.
+        """
+        with self.__lock:
+            self.__flush()
+            if num_messages is None or num_messages >= self.__num_messages:
+                offset = 0
+            elif num_messages <= 0:
+                return [], []
+            else:
+                offset = self.__read_offset(self.__num_messages - num_messages)
+        messages: list[ConversationMessage] = []
+        blocks: list[ContextBlock] = []
+        with self.__path.open("rb") as fid:
+            fid.seek(offset)
+            for line in fid:
+                record = json.loads(line)
+                if record["kind"] == "message":
+                    messages.append(ConversationMessage.model_validate(record["data"]))
+                else:
+                    blocks.append(ContextBlock.model_validate(record["data"]))
+        return messages, blocks
+
+    def last_block(self) -> Optional[ContextBlock]:
+        """
+        The last block of the log (e.g. the latest rolling summary), None if there is none.
+        The log is read backwards from its end.
+        """
+        with self.__lock:
+            self.__flush()
+            end = self.__size
+        partial = b""  # the first line read, which may be cut
+        with self.__path.open("rb") as fid:
+            while end > 0:
+                start = max(0, end - _READ_SIZE)
+                fid.seek(start)
+                lines = (fid.read(end - start) + partial).split(b"\n")
+                partial = lines.pop(0) if start else b""
+                for line in reversed(lines):
+                    if line.startswith(_BLOCK_PREFIX):
+                        return ContextBlock.model_validate(json.loads(line)["data"])
+                end = start
+        return None
+
+    def sync(self):
+        with self.__lock:
+            self.__sync()
+
+    def close(self):
+        with self.__lock:
+            if self.__log.closed:
+                return
+            self.__sync()
+            self.__log.close()
+            self.__index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __append(self, kind: str, data: dict):
+        line = json.dumps({"kind": kind, "data": data}, ensure_ascii=False) + "\n"
+        with self.__lock:
+            offset = self.__size
+            self.__log.write(line.encode("utf-8"))
+            self.__size += len(line.encode("utf-8"))
+            if kind == "message":
+                # the index is written after the record, so it never points past the log
+                self.__index.write(_OFFSET.pack(offset))
+                self.__num_messages += 1
+            self.__pending += 1
+            if (
+                self.__pending >= self.__fsync_every
+                or time.monotonic() - self.__last_sync >= self.__fsync_interval
+            ):
+                self.__sync()
+            elif self.__timer is None:
+                self.__timer = threading.Timer(
+                    self.__last_sync + self.__fsync_interval - time.monotonic(),
+                    self.__sync_idle,
+                )
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def __sync_idle(self):
+        with self.__lock:
+            self.__timer = None
+            if self.__pending and not self.__log.closed:
+                self.__sync()
+
+    def __flush(self):
+        self.__log.flush()
+        self.__index.flush()
+
+    def __sync(self):
+        self.__flush()
+        os.fsync(self.__log.fileno())
+        os.fsync(self.__index.fileno())
+        self.__pending = 0
+        self.__last_sync = time.monotonic()
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+    def __read_offset(self, idx: int) -> int:
+        with self.__index_path.open("rb") as fid:
+            fid.seek(idx * _OFFSET.size)
+            return _OFFSET.unpack(fid.read(_OFFSET.size))[0]
+
+    def __recover(self):
+        """
+        Drop the torn tail of the log and bring the index in line with it.
+        """
+        self.__path.touch(exist_ok=True)
+        self.__index_path.touch(exist_ok=True)
+        size = self.__path.stat().st_size
+        num_entries = self.__index_path.stat().st_size // _OFFSET.size
+        # the entries pointing past the log were written after a lost log batch
+        while num_entries and self.__read_offset(num_entries - 1) >= size:
+            num_entries -= 1
+        scan_from = self.__read_offset(num_entries - 1) if num_entries else 0
+        if num_entries:
+            num_entries -= 1  # re-index from the last indexed record
+        offsets = []
+        end = scan_from
+        with self.__path.open("rb") as fid:
+            fid.seek(scan_from)
+            for line in fid:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("kind") == "message":
+                    offsets.append(end)
+                end += len(line)
+        if end < size:
+            _logger.warning(
+                "dropping %d bytes of a torn record at the end of %s",
+                size - end,
+                self.__path,
+            )
+            with self.__path.open("r+b") as fid:
+                fid.truncate(end)
+        with self.__index_path.open("r+b") as fid:
+            fid.truncate(num_entries * _OFFSET.size)
+            fid.seek(0, os.SEEK_END)
+            fid.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+        self.__size = end
+        self.__num_messages = num_entries + len(offsets)
@@ -0,0 +1,200 @@
+import asyncio
+import enum
+import logging
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional, Sequence, Type, TypeVar, Union
+
+import httpx
+from ollama import AsyncClient, Client
+
+__all__ = [
+    "AgentPool",
+    "ClientPool",
+    "default_agent_pool",
+    "default_client_pool",
+]
+
+_logger = logging.getLogger(__name__)
+_ClientT = TypeVar("_ClientT", Client, AsyncClient)
+_AgentT = TypeVar("_AgentT")
+
+
+class ClientPool:
+    """
+    Shared ollama clients, one per host, whose HTTP connection pools are bounded by
+    `max_connections` and keep at most `max_keepalive_connections` idle connections
+    alive for `keepalive_expiry` seconds.
+
+    `AsyncClient`s are bound to the event loop they are created in, so they are shared
+    per running event loop (and forgotten with it), and not pooled at all outside of one.
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = 64,
+        max_keepalive_connections: Optional[int] = 16,
+        keepalive_expiry: Optional[float] = 30.0,
+    ):
+        self.__limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.__lock = threading.Lock()
+        self.__clients: dict[tuple, Union[Client, AsyncClient]] = {}
+        # the clients of an event loop, by loop, so they go with the loop
+        self.__loop_clients: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[tuple, AsyncClient]
+        ] = weakref.WeakKeyDictionary()
+        self.__created = 0
+        self.__reused = 0
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                "clients": len(self.__clients)
+                + sum(len(clients) for clients in self.__loop_clients.values()),
+                "created": self.__created,
+                "reused": self.__reused,
+            }
+
+    def get(
+        self, host: Optional[str] = None, client_cls: Type[_ClientT] = Client
+    ) -> _ClientT:
+        host = host or os.getenv("OLLAMA_HOST")
+        key = (client_cls, host)
+        with self.__lock:
+            clients = self.__clients
+            if issubclass(client_cls, AsyncClient):
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    self.__created += 1
+                    return client_cls(host=host, limits=self.__limits)
+                for stale in [
+                    stale for stale in self.__loop_clients if stale.is_closed()
+                ]:
+                    del self.__loop_clients[stale]
+                clients = self.__loop_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = clients[key] = client_cls(host=host, limits=self.__limits)
+                self.__created += 1
+                _logger.debug("new %s for %s", client_cls.__name__, host)
+            else:
+                self.__reused += 1
+            return client
+
+    def close(self):
+        """
+        Close the pooled sync clients, and forget all the clients.
+        """
+        with self.__lock:
+            clients, self.__clients = self.__clients, {}
+            self.__loop_clients.clear()
+        for client in clients.values():
+            if isinstance(client, Client):
+                client._client.close()
+
+
+def _identity(value):
+    if value is None or isinstance(value, (str, int, float, bool, enum.Enum)):
+        return value
+    # the pooled agents hold a reference to the value, so its id is not reused
+    return ("id", id(value))
+
+
+class AgentPool:
+    """
+    Idle agents (e.g. the critic and revise agents) kept for reuse across turns and sessions,
+    by class and configuration. At most `max_idle` agents of a configuration are kept, for
+    the `max_configs` most recently used configurations: the configurations hold their
+    clients and caches alive, and those of the other sessions would pile up otherwise.
+
+    An agent is borrowed exclusively (see `borrow`), and is rebound to the parse stats, the
+    scheduling key and the metrics hooks of the borrower, so agents of different sessions
+    can share it.
+    """
+
+    def __init__(self, max_idle: int = 32, max_configs: int = 64):
+        self.__max_idle = max_idle
+        self.__max_configs = max_configs
+        self.__lock = threading.Lock()
+        self.__idle: OrderedDict[tuple, list] = OrderedDict()
+        self.__created = 0
+        self.__reused = 0
+        self.__evicted = 0
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                "idle": sum(len(agents) for agents in self.__idle.values()),
+                "configs": len(self.__idle),
+                "created": self.__created,
+                "reused": self.__reused,
+                "evicted": self.__evicted,
+            }
+
+    @contextmanager
+    def borrow(
+        self,
+        agent_cls: Type[_AgentT],
+        config: dict,
+        parse_stats=None,
+        scheduling_key: Optional[str] = None,
+        metrics_hooks: Sequence = (),
+    ) -> Iterator[_AgentT]:
+        key = (
+            agent_cls,
+            tuple(sorted((name, _identity(value)) for name, value in config.items())),
+        )
+        with self.__lock:
+            idle = self.__idle.get(key)
+            agent = idle.pop() if idle else None
+            if agent is None:
+                self.__created += 1
+            else:
+                self.__reused += 1
+        if agent is None:
+            agent = agent_cls(**config)
+        agent._rebind(
+            parse_stats=parse_stats,
+            scheduling_key=scheduling_key,
+            metrics_hooks=metrics_hooks,
+        )
+        try:
+            yield agent
+        finally:
+            with self.__lock:
+                idle = self.__idle.setdefault(key, [])
+                self.__idle.move_to_end(key)
+                if len(idle) < self.__max_idle:
+                    idle.append(agent)
+                if not idle:
+                    # nothing holds the values of the key alive, their ids may be reused
+                    del self.__idle[key]
+                while len(self.__idle) > self.__max_configs:
+                    _, agents = self.__idle.popitem(last=False)
+                    self.__evicted += len(agents)
+
+
+_default_client_pool = ClientPool()
+_default_agent_pool = AgentPool()
+
+
+def default_client_pool() -> ClientPool:
+    """
+    The client pool of the agents which are not given a client.
+    """
+    return _default_client_pool
+
+
+def default_agent_pool() -> AgentPool:
+    """
+    The pool of the critic and revise agents of the talk agents which are not given a pool.
+    """
+    return _default_agent_pool
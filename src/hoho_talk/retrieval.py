@@ -0,0 +1,171 @@
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+from ollama import Client
+
+from .cache import make_cache_key
+from .data import ContextBlock
+from .pool import default_client_pool
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+__all__ = ["ContextBlockIndex"]
+
+_logger = logging.getLogger(__name__)
+
+
+class ContextBlockIndex:
+    """
+    An embedding index over context blocks, which retrieves the top-k blocks
+    relevant to a query by cosine similarity.
+
+    The blocks are embedded once with ollama embeddings. With `cache_dir`, the vectors
+    are also cached on disk (per embedding model), keyed by the content hash of the blocks,
+    so the knowledge base is not re-embedded across runs. The new vectors are appended
+    to the cache files, which are never rewritten.
+
+    Requires numpy (`pip install hoho-talk[retrieval]`).
+    """
+
+    def __init__(
+        self,
+        client: Optional[Client] = None,
+        embed_model: str = "nomic-embed-text",
+        cache_dir: Optional[Union[str, Path]] = None,
+        batch_size: int = 64,
+    ):
+        if np is None:
+            raise ImportError(
+                "numpy is required by ContextBlockIndex, install it with `pip install hoho-talk[retrieval]`"
+            )
+        self._client = default_client_pool().get() if client is None else client
+        self.__embed_model = embed_model
+        self.__batch_size = batch_size
+        self.__lock = threading.Lock()
+        self.__blocks: list[ContextBlock] = []
+        self.__matrix = np.zeros((0, 0), dtype=np.float32)
+        self.__cache_dir = None
+        self.__cached: dict[str, np.ndarray] = {}
+        if cache_dir is not None:
+            self.__cache_dir = Path(cache_dir) / embed_model.replace("/", "_").replace(
+                ":", "_"
+            )
+            self.__load_cache()
+
+    @property
+    def embed_model(self):
+        return self.__embed_model
+
+    @property
+    def blocks(self) -> list[ContextBlock]:
+        return list(self.__blocks)
+
+    def __len__(self):
+        return len(self.__blocks)
+
+    def add(self, blocks: list[ContextBlock]):
+        """
+        Add the blocks to the index, embedding those which are not cached yet.
+        """
+        if not blocks:
+            return
+        keys = [self.__block_key(block) for block in blocks]
+        with self.__lock:
+            missing = list(
+                dict.fromkeys(key for key in keys if key not in self.__cached)
+            )
+        # embed outside of the lock, so that the searches are not blocked meanwhile
+        embedded: dict[str, np.ndarray] = {}
+        if missing:
+            contents = {key: block.block_content for key, block in zip(keys, blocks)}
+            for start in range(0, len(missing), self.__batch_size):
+                batch = missing[start : start + self.__batch_size]
+                embedded.update(
+                    zip(batch, self.embed([contents[key] for key in batch]))
+                )
+            _logger.debug("embedded %d context blocks", len(missing))
+        with self.__lock:
+            # another thread may have embedded some of the blocks meanwhile
+            new_keys = [key for key in embedded if key not in self.__cached]
+            self.__cached.update((key, embedded[key]) for key in new_keys)
+            self.__append_cache(new_keys)
+            new_rows = np.stack([self.__cached[key] for key in keys])
+            self.__matrix = (
+                new_rows
+                if not self.__blocks
+                else np.concatenate([self.__matrix, new_rows], axis=0)
+            )
+            self.__blocks.extend(blocks)
+
+    def search(self, query: str, k: int) -> list[ContextBlock]:
+        """
+        The (at most) `k` blocks most similar to `query`, the most similar first.
+        """
+        with self.__lock:
+            blocks, matrix = self.__blocks, self.__matrix
+        if k <= 0 or not blocks:
+            return []
+        if k >= len(blocks):
+            return list(blocks)
+        scores = matrix @ self.embed([query])[0]
+        top_k = np.argpartition(-scores, k)[:k]
+        return [blocks[idx] for idx in top_k[np.argsort(-scores[top_k])]]
+
+    def embed(self, texts: list[str]) -> "np.ndarray":
+        """
+        The L2-normalized embeddings of the texts.
+        """
+        response = self._client.embed(model=self.__embed_model, input=texts)
+        vectors = np.asarray(response.embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def __block_key(self, block: ContextBlock) -> str:
+        return make_cache_key(block.block_type.value, block.block_content)
+
+    def __load_cache(self):
+        keys_path = self.__cache_dir / "keys.jsonl"
+        vectors_path = self.__cache_dir / "vectors.f32"
+        if not keys_path.exists() or not vectors_path.exists():
+            return
+        keys = []
+        keys_size = 0
+        with keys_path.open("rb") as fid:
+            for line in fid:
+                if not line.endswith(b"\n"):
+                    break  # an interrupted append
+                keys.append(json.loads(line))
+                keys_size += len(line)
+        vectors = np.fromfile(vectors_path, dtype=np.float32)
+        dim = len(vectors) // len(keys) if keys else 0
+        if keys and (dim == 0 or len(keys) * dim > len(vectors)):
+            _logger.warning(
+                "corrupted embedding cache in %s, ignored", self.__cache_dir
+            )
+            return
+        # the vectors are appended before the keys, so the extra vectors (an interrupted
+        # append) are dropped, and the files truncated to keep them aligned
+        vectors = vectors[: len(keys) * dim]
+        for path, size in ((keys_path, keys_size), (vectors_path, vectors.nbytes)):
+            if path.stat().st_size > size:
+                with path.open("r+b") as fid:
+                    fid.truncate(size)
+        self.__cached = dict(zip(keys, vectors.reshape(len(keys), dim)))
+
+    def __append_cache(self, keys: list[str]):
+        if self.__cache_dir is None or not keys:
+            return
+        self.__cache_dir.mkdir(parents=True, exist_ok=True)
+        # append the vectors before the keys, so the keys never outnumber the vectors
+        with (self.__cache_dir / "vectors.f32").open("ab") as fid:
+            np.stack([self.__cached[key] for key in keys]).astype(np.float32).tofile(
+                fid
+            )
+        with (self.__cache_dir / "keys.jsonl").open("a") as fid:
+            fid.writelines(f"{json.dumps(key)}\n" for key in keys)
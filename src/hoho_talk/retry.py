@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from enum import Enum
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+from ollama import ResponseError
+from pydantic import ValidationError
+
+__all__ = ["FailureClass", "RetryError", "RetryPolicy", "classify_failure"]
+
+_logger = logging.getLogger(__name__)
+_T = TypeVar("_T")
+
+
+class FailureClass(str, Enum):
+    """
+    The class of a failed agent call.
+
+    - `transport`: the ollama server is unreachable, times out or fails (5xx, 429).
+    - `parse`: the model output can not be parsed as JSON.
+    - `validation`: the parsed output does not comply with the response schema.
+    - `other`: anything else, e.g. a bug or a bad request, which is not worth retrying.
+    """
+
+    transport = "transport"
+    parse = "parse"
+    validation = "validation"
+    other = "other"
+
+
+def classify_failure(error: BaseException) -> FailureClass:
+    if isinstance(error, ValidationError):
+        if any(err["type"] == "json_invalid" for err in error.errors()):
+            # raised by `model_validate_json` on malformed JSON
+            return FailureClass.parse
+        return FailureClass.validation
+    if isinstance(error, ResponseError):
+        if error.status_code >= 500 or error.status_code in (408, 429):
+            return FailureClass.transport
+        return FailureClass.other
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return FailureClass.transport
+    if isinstance(error, (json.JSONDecodeError, ValueError, KeyError, TypeError)):
+        return FailureClass.parse
+    return FailureClass.other
+
+
+class RetryError(RuntimeError):
+    """
+    Raised when a call still fails after the retries allowed by a `RetryPolicy`.
+    """
+
+    def __init__(self, attempts: int, last_error: BaseException):
+        self.attempts = attempts
+        self.last_error = last_error
+        self.failure_class = classify_failure(last_error)
+        super().__init__(
+            f"giving up after {attempts} attempt(s), "
+            f"last {self.failure_class.value} failure: {last_error!r}"
+        )
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff and jitter.
+
+    - `max_attempts`: the maximum number of attempts of a call.
+    - `base_delay`/`max_delay`: the delay before the n-th retry is `base_delay * 2 ** (n - 1)`,
+      capped at `max_delay`, and reduced by a random fraction up to `jitter`.
+    - `deadline`: the time budget (in seconds) of the retries of a call: no retry is made
+      if it would start past the deadline. An attempt in flight is not interrupted, so a hung
+      call is bounded by the timeout of its client (e.g. `ollama.Client(timeout=...)`) only.
+    - `retry_on`: the failure classes worth retrying. Other failures are raised as is.
+
+    The counters are shared by all the calls made with the policy, see `stats`.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        jitter: float = 0.5,
+        deadline: Optional[float] = None,
+        retry_on: tuple[FailureClass, ...] = (
+            FailureClass.transport,
+            FailureClass.parse,
+            FailureClass.validation,
+        ),
+    ):
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts should be at least 1: {max_attempts}")
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"jitter should be in [0, 1]: {jitter}")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_on = frozenset(FailureClass(cls) for cls in retry_on)
+        self._lock = threading.Lock()
+        self._attempts = 0
+        self._successes = 0
+        self._give_ups = 0
+        self._failures = {cls: 0 for cls in FailureClass}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "attempts": self._attempts,
+                "successes": self._successes,
+                "give_ups": self._give_ups,
+                "failures": {cls.value: n for cls, n in self._failures.items()},
+            }
+
+    def call(self, func: Callable[..., _T], *args, **kwargs) -> _T:
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._count_attempt()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                delay = self._on_failure(error, attempt, start)
+                time.sleep(delay)
+            else:
+                self._count_success()
+                return result
+
+    async def acall(self, func: Callable[..., Awaitable[_T]], *args, **kwargs) -> _T:
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._count_attempt()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as error:
+                delay = self._on_failure(error, attempt, start)
+                await asyncio.sleep(delay)
+            else:
+                self._count_success()
+                return result
+
+    def _count_attempt(self):
+        with self._lock:
+            self._attempts += 1
+
+    def _count_success(self):
+        with self._lock:
+            self._successes += 1
+
+    def _on_failure(self, error: Exception, attempt: int, start: float) -> float:
+        """
+        Count the failure and return the delay before the next attempt.
+        Raise if the call should not be retried.
+        """
+        failure_class = classify_failure(error)
+        with self._lock:
+            self._failures[failure_class] += 1
+        if failure_class not in self.retry_on:
+            raise error
+        delay = self.delay(attempt)
+        out_of_time = (
+            self.deadline is not None
+            and time.monotonic() - start + delay > self.deadline
+        )
+        if attempt >= self.max_attempts or out_of_time:
+            with self._lock:
+                self._give_ups += 1
+            raise RetryError(attempt, error) from error
+        _logger.warning(
+            "%s failure on attempt %d/%d, retry in %.2fs: %r",
+            failure_class.value,
+            attempt,
+            self.max_attempts,
+            delay,
+            error,
+        )
+        return delay
+
+    def delay(self, attempt: int) -> float:
+        """
+        The delay after the `attempt`-th failed attempt.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
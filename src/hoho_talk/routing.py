@@ -0,0 +1,94 @@
+"""
+The routing of the critic verdicts between a cheap and a strong model.
+
+`OllamaTalkAgent` can use separate models to generate, criticize and revise the responses
+(`model`, `critic_model` and `revise_model`). With an `EscalationPolicy`, the verdicts of the
+cheap critic which are rejections or uncertain are checked again by the critic of a stronger
+model, whose verdict is final.
+"""
+
+import threading
+from typing import Optional
+
+from .data import CriticResponse
+
+__all__ = ["EscalationPolicy"]
+
+
+class EscalationPolicy:
+    """
+    When the verdict of the critic is escalated to the critic of the stronger `model`
+    (the model of the talk agent by default).
+
+    - `on_reject`: escalate the rejections, so a response is revised only if the stronger
+      critic rejects it too.
+    - `min_confidence`: escalate the verdicts whose confidence is below it. The critic is then
+      asked for its confidence (see `data.ScoredCriticResponse`), unless it is None.
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        on_reject: bool = True,
+        min_confidence: Optional[float] = 0.7,
+    ):
+        self.__model = model
+        self.__on_reject = on_reject
+        self.__min_confidence = min_confidence
+        self.__lock = threading.Lock()
+        self.__stats = {"verdicts": 0, "rejected": 0, "uncertain": 0, "overturned": 0}
+
+    @property
+    def model(self) -> Optional[str]:
+        return self.__model
+
+    @property
+    def on_reject(self) -> bool:
+        return self.__on_reject
+
+    @property
+    def min_confidence(self) -> Optional[float]:
+        return self.__min_confidence
+
+    def reason(self, critic_response: CriticResponse) -> Optional[str]:
+        """
+        Why the verdict is escalated (`"rejected"` or `"uncertain"`), None if it is final.
+        """
+        confidence = getattr(critic_response, "confidence", None)
+        if self.__on_reject and not critic_response.is_aligned:
+            reason = "rejected"
+        elif (
+            self.__min_confidence is not None
+            and confidence is not None
+            and confidence < self.__min_confidence
+        ):
+            reason = "uncertain"
+        else:
+            reason = None
+        with self.__lock:
+            self.__stats["verdicts"] += 1
+            if reason is not None:
+                self.__stats[reason] += 1
+        return reason
+
+    def record(self, critic_response: CriticResponse, escalated: CriticResponse):
+        """
+        Record the verdict of the stronger critic on an escalated verdict.
+        """
+        if escalated.is_aligned != critic_response.is_aligned:
+            with self.__lock:
+                self.__stats["overturned"] += 1
+
+    def stats(self) -> dict:
+        """
+        The verdicts of the critic, the escalated ones by reason,
+        and the escalated ones overturned by the stronger critic.
+        """
+        with self.__lock:
+            return dict(self.__stats)
+
+    def __repr__(self) -> str:
+        return (
+            f"EscalationPolicy(model={self.__model!r}, on_reject={self.__on_reject!r}, "
+            f"min_confidence={self.__min_confidence!r})"
+        )
@@ -0,0 +1,228 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Optional, Union
+
+__all__ = ["DEFAULT_PRIORITIES", "RequestScheduler"]
+
+_logger = logging.getLogger(__name__)
+
+# the smaller, the more urgent: the first drafts beat the critics and the revisions,
+# and the background work (summaries and memories) comes last
+DEFAULT_PRIORITIES = {
+    "generate": 0,
+    "critic": 1,
+    "revise": 2,
+    "summarize": 3,
+    "memorize": 4,
+}
+
+
+class _Waiter:
+    def __init__(self, role: str, grant: Callable[[], None]):
+        self.role = role
+        self.grant = grant
+        self.granted = False
+        self.cancelled = False
+        self.enqueued_at = time.monotonic()
+
+
+class _ModelQueue:
+    """
+    The slots of a model and the requests waiting for them,
+    by priority, then round-robin by conversation.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.active = 0
+        # priority -> conversation key -> waiters, the keys in round-robin order
+        self.waiters: dict[int, OrderedDict[str, deque[_Waiter]]] = {}
+        self.priorities: list[int] = []  # a heap of the priorities with waiters
+        self.depth = 0
+
+    def push(self, priority: int, key: str, waiter: _Waiter):
+        if priority not in self.waiters:
+            self.waiters[priority] = OrderedDict()
+            heapq.heappush(self.priorities, priority)
+        self.waiters[priority].setdefault(key, deque()).append(waiter)
+        self.depth += 1
+
+    def pop(self) -> Optional[_Waiter]:
+        while self.priorities:
+            priority = self.priorities[0]
+            by_key = self.waiters[priority]
+            while by_key:
+                key, waiters = next(iter(by_key.items()))
+                waiter = waiters.popleft()
+                # the conversation goes to the back of the round
+                by_key.move_to_end(key)
+                if not waiters:
+                    del by_key[key]
+                if not waiter.cancelled:
+                    self.depth -= 1
+                    return waiter
+            heapq.heappop(self.priorities)
+            del self.waiters[priority]
+        return None
+
+
+class RequestScheduler:
+    """
+    Schedule the model calls of the agents sharing an ollama server.
+
+    Each model has `max_concurrency` slots (an int for all models, or a dict by model with
+    the default under `"*"`). When the slots are taken, the calls wait in priority classes
+    by the role of the agent (`priorities`, see `DEFAULT_PRIORITIES`), so the first drafts
+    of new conversations are not starved by long critic/revision chains. Within a class,
+    the conversations take turns (round-robin), whatever the number of calls each queues.
+
+    It serves both the threads (`slot`) and the asyncio tasks (`aslot`).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Union[int, dict[str, int]] = 2,
+        priorities: Optional[dict[str, int]] = None,
+    ):
+        if isinstance(max_concurrency, int):
+            max_concurrency = {"*": max_concurrency}
+        if any(slots < 1 for slots in max_concurrency.values()):
+            raise ValueError(f"max_concurrency should be positive: {max_concurrency}")
+        self.__max_concurrency = dict(max_concurrency)
+        self.__priorities = dict(
+            DEFAULT_PRIORITIES if priorities is None else priorities
+        )
+        self.__lock = threading.Lock()
+        self.__queues: dict[str, _ModelQueue] = {}
+        self.__waits: dict[str, list[float]] = {}  # role -> [count, total, max]
+
+    def priority(self, role: str) -> int:
+        return self.__priorities.get(role, max(self.__priorities.values(), default=0))
+
+    def stats(self) -> dict:
+        """
+        The active calls and the queue depth by model, and the wait times by role.
+        """
+        with self.__lock:
+            return {
+                "models": {
+                    model: {
+                        "slots": queue.slots,
+                        "active": queue.active,
+                        "queued": queue.depth,
+                    }
+                    for model, queue in self.__queues.items()
+                },
+                "waits": {
+                    role: {
+                        "count": int(count),
+                        "mean": total / count if count else 0.0,
+                        "max": max_wait,
+                    }
+                    for role, (count, total, max_wait) in self.__waits.items()
+                },
+            }
+
+    @contextmanager
+    def slot(self, model: str, role: str, key: str, timeout: Optional[float] = None):
+        """
+        Hold a slot of `model` for a call by the agent of `role` in the conversation `key`.
+        Raise `TimeoutError` if no slot is granted in `timeout` seconds.
+        """
+        granted = threading.Event()
+        waiter = self.__enqueue(model, role, key, granted.set)
+        if not granted.wait(timeout):
+            self.__cancel(model, waiter)
+            raise TimeoutError(f"no slot of {model} in {timeout} seconds")
+        try:
+            yield
+        finally:
+            self.__release(model)
+
+    @asynccontextmanager
+    async def aslot(
+        self, model: str, role: str, key: str, timeout: Optional[float] = None
+    ):
+        """
+        The asyncio counterpart of `slot`.
+        """
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None)
+            )
+
+        waiter = self.__enqueue(model, role, key, grant)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            self.__cancel(model, waiter)
+            if isinstance(error, asyncio.TimeoutError):
+                raise TimeoutError(f"no slot of {model} in {timeout} seconds")
+            raise
+        try:
+            yield
+        finally:
+            self.__release(model)
+
+    def __queue(self, model: str) -> _ModelQueue:
+        if model not in self.__queues:
+            slots = self.__max_concurrency.get(
+                model, self.__max_concurrency.get("*", 1)
+            )
+            self.__queues[model] = _ModelQueue(slots)
+        return self.__queues[model]
+
+    def __enqueue(
+        self, model: str, role: str, key: str, grant: Callable[[], None]
+    ) -> _Waiter:
+        waiter = _Waiter(role, grant)
+        with self.__lock:
+            queue = self.__queue(model)
+            if queue.active < queue.slots and queue.depth == 0:
+                self.__grant(queue, waiter)
+            else:
+                queue.push(self.priority(role), key, waiter)
+                _logger.debug(
+                    "%s call of %s queued for %s (%d queued)",
+                    role,
+                    key,
+                    model,
+                    queue.depth,
+                )
+        return waiter
+
+    def __grant(self, queue: _ModelQueue, waiter: _Waiter):
+        queue.active += 1
+        waiter.granted = True
+        wait = time.monotonic() - waiter.enqueued_at
+        count, total, max_wait = self.__waits.get(waiter.role, (0, 0.0, 0.0))
+        self.__waits[waiter.role] = [count + 1, total + wait, max(max_wait, wait)]
+        waiter.grant()
+
+    def __release(self, model: str):
+        with self.__lock:
+            queue = self.__queues[model]
+            queue.active -= 1
+            while queue.active < queue.slots:
+                waiter = queue.pop()
+                if waiter is None:
+                    break
+                self.__grant(queue, waiter)
+
+    def __cancel(self, model: str, waiter: _Waiter):
+        with self.__lock:
+            if not waiter.granted:
+                # it is skipped when its turn comes
+                waiter.cancelled = True
+                self.__queues[model].depth -= 1
+                return
+        # granted in the meantime, give the slot back
+        self.__release(model)
@@ -0,0 +1,558 @@
+"""
+The HTTP server mode of hoho_talk.
+
+    $ python -m hoho_talk serve --port 8000
+
+- `POST /sessions` with `{"name": ..., "persona": ..., "context_blocks": [...]}` creates a session.
+- `GET /sessions/<id>` returns the conversation of the session; `DELETE /sessions/<id>` closes it.
+- `POST /sessions/<id>/messages` with `{"by": ..., "content": ...}` adds a message.
+- `POST /sessions/<id>/responses` with `{"temperature": ..., "stream": ..., "use_cache": ...}`
+  gets the response of the agent and adds it to the conversation. With `"stream": true`, the response is
+  streamed as NDJSON: `{"type": "chunk", ...}` lines, then a `{"type": "response", ...}` line.
+- `GET /health` and `GET /stats`, and `GET /metrics` for the latency and token metrics
+  in the Prometheus text format.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from uuid import uuid4
+
+from pydantic import ValidationError
+
+from .cache import LRUCache
+from .data import AgentResponse, ContextBlock, ConversationContext, PromptLayout
+from .generation import GenerationBudget
+from .metrics import HistogramExporter
+from .pool import default_client_pool
+from .retry import RetryPolicy
+from .routing import EscalationPolicy
+from .scheduler import RequestScheduler
+from .talk_agent import OllamaTalkAgent
+
+__all__ = ["Session", "SessionCache", "TalkServer", "serve"]
+
+_logger = logging.getLogger(__name__)
+# the rough overhead of a live session (agent, context and pydantic objects) in bytes
+_SESSION_OVERHEAD = 16 * 1024
+
+
+class Session:
+    """
+    A live `OllamaTalkAgent` and its `ConversationContext`.
+    The turns of a session are serialized by its lock.
+    """
+
+    def __init__(
+        self, agent: OllamaTalkAgent, ctx: Optional[ConversationContext] = None
+    ):
+        self.session_id = f"session-{uuid4()}"
+        self.agent = agent
+        self.ctx = ConversationContext() if ctx is None else ctx
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def size(self) -> int:
+        """
+        The estimated memory footprint of the session in bytes.
+        """
+        chars = len(self.agent.persona) + sum(
+            len(msg.content) for msg in self.ctx.conversation
+        )
+        chars += sum(len(block.block_content) for block in self.agent.context_blocks)
+        # the text is kept in the messages, the transcript lines and the prompts in flight
+        return _SESSION_OVERHEAD + 3 * 2 * chars
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "name": self.agent.name,
+            "model": self.agent.model,
+            "conversation_id": self.ctx.conversation_id,
+            "conversation": [
+                msg.model_dump(mode="json") for msg in self.ctx.conversation
+            ],
+        }
+
+
+class SessionCache:
+    """
+    An LRU cache of the live sessions.
+
+    A session expires after `ttl` seconds of inactivity. The least recently used sessions
+    are evicted once there are more than `max_sessions` sessions or their estimated memory
+    (`Session.size`) exceeds `max_memory` bytes.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1024,
+        ttl: Optional[float] = 3600.0,
+        max_memory: Optional[int] = 512 * 1024 * 1024,
+    ):
+        self.__max_sessions = max_sessions
+        self.__ttl = ttl
+        self.__max_memory = max_memory
+        self.__lock = threading.Lock()
+        self.__sessions: OrderedDict[str, Session] = OrderedDict()
+        self.__sizes: dict[str, int] = {}
+        self.__evictions = 0
+
+    def __len__(self):
+        return len(self.__sessions)
+
+    @property
+    def memory(self) -> int:
+        return sum(self.__sizes.values())
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                "sessions": len(self.__sessions),
+                "memory": sum(self.__sizes.values()),
+                "evictions": self.__evictions,
+            }
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self.__lock:
+            self.__evict_expired()
+            session = self.__sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self.__sessions.move_to_end(session_id)
+            return session
+
+    def put(self, session: Session):
+        with self.__lock:
+            session.last_used = time.monotonic()
+            self.__sessions[session.session_id] = session
+            self.__sessions.move_to_end(session.session_id)
+            self.__sizes[session.session_id] = session.size()
+            self.__evict(keep=session.session_id)
+
+    def update(self, session: Session):
+        """
+        Refresh the memory estimate of the session after a turn.
+        """
+        with self.__lock:
+            if session.session_id in self.__sessions:
+                self.__sizes[session.session_id] = session.size()
+                self.__evict(keep=session.session_id)
+
+    def pop(self, session_id: str) -> Optional[Session]:
+        with self.__lock:
+            self.__sizes.pop(session_id, None)
+            return self.__sessions.pop(session_id, None)
+
+    def __evict_expired(self):
+        if self.__ttl is None:
+            return
+        now = time.monotonic()
+        # the sessions are ordered by their last use
+        while self.__sessions:
+            session_id, session = next(iter(self.__sessions.items()))
+            if now - session.last_used <= self.__ttl:
+                break
+            self.__drop(session_id, "expired")
+
+    def __evict(self, keep: str):
+        self.__evict_expired()
+        while len(self.__sessions) > 1 and (
+            len(self.__sessions) > self.__max_sessions
+            or (
+                self.__max_memory is not None
+                and sum(self.__sizes.values()) > self.__max_memory
+            )
+        ):
+            session_id = next(iter(self.__sessions))
+            if session_id == keep:
+                break
+            self.__drop(session_id, "evicted")
+
+    def __drop(self, session_id: str, reason: str):
+        self.__sessions.pop(session_id)
+        self.__sizes.pop(session_id, None)
+        self.__evictions += 1
+        _logger.info("session %s %s", session_id, reason)
+
+
+class TalkServer(ThreadingHTTPServer):
+    """
+    Serve `OllamaTalkAgent` sessions over HTTP.
+
+    At most `max_concurrency` turns run at the same time; the other requests wait up to
+    `queue_timeout` seconds for a slot, then get a 503. A request waits for the previous
+    turn of its session before taking a slot, so the queued turns of a session do not
+    hold the slots of the other sessions.
+    The stats of `scheduler`, the scheduler of the model calls of the agents, are reported too,
+    and the metrics of `metrics`, the exporter the agents report to, are served by `/metrics`.
+    The stats of `escalation_policy`, the escalation policy of the critics, are reported too.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        agent_factory: Optional[Callable[..., OllamaTalkAgent]] = None,
+        sessions: Optional[SessionCache] = None,
+        max_concurrency: int = 4,
+        queue_timeout: float = 30.0,
+        scheduler: Optional[RequestScheduler] = None,
+        metrics: Optional[HistogramExporter] = None,
+        escalation_policy: Optional[EscalationPolicy] = None,
+    ):
+        super().__init__((host, port), _TalkHandler)
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.escalation_policy = escalation_policy
+        self.agent_factory = OllamaTalkAgent if agent_factory is None else agent_factory
+        self.sessions = SessionCache() if sessions is None else sessions
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.stats_lock = threading.Lock()
+        self.counters = {"turns": 0, "rejected": 0, "failures": 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str):
+        with self.stats_lock:
+            self.counters[key] += 1
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            stats = {**self.counters, **self.sessions.stats()}
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        if self.metrics is not None:
+            stats["critic_accept_rate"] = self.metrics.accept_rate
+            stats["latency_by_role"] = self.metrics.latency_by_role()
+        if self.escalation_policy is not None:
+            stats["escalation"] = self.escalation_policy.stats()
+        return stats
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class _TalkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: TalkServer
+
+    _ROUTES = [
+        ("GET", re.compile(r"^/health$"), "_health"),
+        ("GET", re.compile(r"^/stats$"), "_stats"),
+        ("GET", re.compile(r"^/metrics$"), "_metrics"),
+        ("POST", re.compile(r"^/sessions$"), "_create_session"),
+        ("GET", re.compile(r"^/sessions/(?P<session_id>[\w-]+)$"), "_get_session"),
+        (
+            "DELETE",
+            re.compile(r"^/sessions/(?P<session_id>[\w-]+)$"),
+            "_delete_session",
+        ),
+        (
+            "POST",
+            re.compile(r"^/sessions/(?P<session_id>[\w-]+)/messages$"),
+            "_add_message",
+        ),
+        (
+            "POST",
+            re.compile(r"^/sessions/(?P<session_id>[\w-]+)/responses$"),
+            "_get_response",
+        ),
+    ]
+
+    def log_message(self, format, *args):
+        _logger.debug("%s %s", self.address_string(), format % args)
+
+    def end_headers(self):
+        super().end_headers()
+        self._headers_sent = True
+
+    def do_GET(self):
+        self.__dispatch("GET")
+
+    def do_POST(self):
+        self.__dispatch("POST")
+
+    def do_DELETE(self):
+        self.__dispatch("DELETE")
+
+    def __dispatch(self, method: str):
+        path = self.path.split("?", 1)[0]
+        self._headers_sent = False
+        try:
+            for route_method, pattern, handler in self._ROUTES:
+                match = pattern.match(path)
+                if match is not None and route_method == method:
+                    getattr(self, handler)(**match.groupdict())
+                    return
+            raise _HTTPError(HTTPStatus.NOT_FOUND, f"no route for {method} {path}")
+        except _HTTPError as error:
+            self._send_json({"error": error.message}, status=error.status)
+        except KeyError as error:
+            self._send_json(
+                {"error": f"missing field: {error}"}, status=HTTPStatus.BAD_REQUEST
+            )
+        except (ValidationError, ValueError, TypeError) as error:
+            self._send_json({"error": str(error)}, status=HTTPStatus.BAD_REQUEST)
+        except Exception as error:
+            _logger.exception("failed to handle %s %s", method, path)
+            if self._headers_sent:
+                # the response is partially sent already, drop the connection
+                self.close_connection = True
+                return
+            self._send_json(
+                {"error": repr(error)}, status=HTTPStatus.INTERNAL_SERVER_ERROR
+            )
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        body = json.loads(self.rfile.read(length))
+        if not isinstance(body, dict):
+            raise _HTTPError(HTTPStatus.BAD_REQUEST, "the body should be a JSON object")
+        return body
+
+    def _send_json(self, payload: dict, status: HTTPStatus = HTTPStatus.OK):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_line(self, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def __session(self, session_id: str) -> Session:
+        session = self.server.sessions.get(session_id)
+        if session is None:
+            raise _HTTPError(HTTPStatus.NOT_FOUND, f"session not found: {session_id}")
+        return session
+
+    def _health(self):
+        self._send_json({"status": "ok"})
+
+    def _stats(self):
+        self._send_json(self.server.stats())
+
+    def _metrics(self):
+        if self.server.metrics is None:
+            raise _HTTPError(HTTPStatus.NOT_FOUND, "no metrics")
+        data = self.server.metrics.to_prometheus().encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _create_session(self):
+        body = self._read_json()
+        agent = self.server.agent_factory(
+            name=body["name"],
+            persona=body["persona"],
+            historical_context_blocks=[
+                ContextBlock.model_validate(block)
+                for block in body.get("context_blocks", [])
+            ],
+        )
+        session = Session(agent)
+        for msg in body.get("conversation", []):
+            session.ctx.add_message(**msg)
+        self.server.sessions.put(session)
+        self._send_json(session.to_dict(), status=HTTPStatus.CREATED)
+
+    def _get_session(self, session_id: str):
+        self._send_json(self.__session(session_id).to_dict())
+
+    def _delete_session(self, session_id: str):
+        if self.server.sessions.pop(session_id) is None:
+            raise _HTTPError(HTTPStatus.NOT_FOUND, f"session not found: {session_id}")
+        self._send_json({"session_id": session_id})
+
+    def _add_message(self, session_id: str):
+        session = self.__session(session_id)
+        body = self._read_json()
+        with session.lock:
+            session.ctx.add_message(by=body["by"], content=body["content"])
+            message = session.ctx.conversation[-1]
+        self.server.sessions.update(session)
+        self._send_json(message.model_dump(mode="json"), status=HTTPStatus.CREATED)
+
+    def _get_response(self, session_id: str):
+        session = self.__session(session_id)
+        body = self._read_json()
+        temperature = float(body.get("temperature", 0.6))
+        use_cache = bool(body.get("use_cache", True))
+        # take the session before the slot, so a slot is not held waiting for the session
+        deadline = time.monotonic() + self.server.queue_timeout
+        if not session.lock.acquire(timeout=self.server.queue_timeout):
+            self.server.count("rejected")
+            raise _HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "the session is busy")
+        try:
+            if not self.server.slots.acquire(
+                timeout=max(deadline - time.monotonic(), 0.0)
+            ):
+                self.server.count("rejected")
+                raise _HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "the server is busy")
+            try:
+                if body.get("stream", False):
+                    self.__stream_response(session, temperature, use_cache)
+                else:
+                    try:
+                        agent_response = session.agent.get_response(
+                            session.ctx, temperature=temperature, use_cache=use_cache
+                        )
+                    except Exception as error:
+                        self.server.count("failures")
+                        _logger.warning("failed to get the response: %r", error)
+                        raise _HTTPError(HTTPStatus.BAD_GATEWAY, repr(error))
+                    self._send_json(self.__add_response(session, agent_response))
+            finally:
+                self.server.slots.release()
+        finally:
+            session.lock.release()
+        self.server.sessions.update(session)
+
+    def __stream_response(self, session: Session, temperature: float, use_cache: bool):
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for item in session.agent.get_response(
+                session.ctx, temperature=temperature, stream=True, use_cache=use_cache
+            ):
+                if isinstance(item, AgentResponse):
+                    self._send_line(self.__add_response(session, item))
+                else:
+                    self._send_line({"type": "chunk", **item.model_dump()})
+        except (BrokenPipeError, ConnectionResetError):
+            _logger.info("the client of %s disconnected", session.session_id)
+            return
+        except Exception as error:
+            # the status is sent already, report the failure in the stream
+            self.server.count("failures")
+            _logger.warning("failed to stream the response: %r", error)
+            self._send_line({"type": "error", "error": repr(error)})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def __add_response(self, session: Session, agent_response: AgentResponse) -> dict:
+        session.ctx.add_message(
+            by=session.agent.name,
+            content=agent_response.text_response,
+            mood=agent_response.mood,
+            tone=agent_response.tone,
+            sentiment=agent_response.sentiment,
+        )
+        self.server.count("turns")
+        return {
+            "type": "response",
+            "response": agent_response.model_dump(),
+            "message": session.ctx.conversation[-1].model_dump(mode="json"),
+        }
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    model: str = "qwq:latest",
+    ollama_host: Optional[str] = None,
+    prompt_layout: PromptLayout = PromptLayout.legacy,
+    structured_output: bool = False,
+    max_sessions: int = 1024,
+    session_ttl: Optional[float] = 3600.0,
+    max_memory_mb: Optional[float] = 512.0,
+    max_concurrency: int = 4,
+    queue_timeout: float = 30.0,
+    max_attempts: int = 5,
+    max_model_concurrency: int = 2,
+    response_cache_size: int = 0,
+    critic_model: Optional[str] = None,
+    revise_model: Optional[str] = None,
+    escalate: bool = False,
+    escalation_model: Optional[str] = None,
+    escalation_min_confidence: Optional[float] = 0.7,
+    generation_budgets: Optional[dict[str, GenerationBudget]] = None,
+):
+    # the sessions share the connections to ollama, the critic verdicts, the responses
+    # and the retry stats
+    client = default_client_pool().get(ollama_host)
+    critic_cache = LRUCache(maxsize=4096)
+    response_cache = (
+        LRUCache(maxsize=response_cache_size) if response_cache_size > 0 else None
+    )
+    retry_policy = RetryPolicy(max_attempts=max_attempts)
+    scheduler = RequestScheduler(max_concurrency=max_model_concurrency)
+    metrics = HistogramExporter()
+    escalation_policy = (
+        EscalationPolicy(
+            model=escalation_model, min_confidence=escalation_min_confidence
+        )
+        if escalate
+        else None
+    )
+
+    def agent_factory(**kwargs) -> OllamaTalkAgent:
+        return OllamaTalkAgent(
+            client=client,
+            model=model,
+            prompt_layout=prompt_layout,
+            critic_cache=critic_cache,
+            structured_output=structured_output,
+            retry_policy=retry_policy,
+            scheduler=scheduler,
+            metrics_hooks=(metrics,),
+            response_cache=response_cache,
+            critic_model=critic_model,
+            revise_model=revise_model,
+            escalation_policy=escalation_policy,
+            generation_budgets=generation_budgets,
+            **kwargs,
+        )
+
+    server = TalkServer(
+        host,
+        port,
+        agent_factory=agent_factory,
+        sessions=SessionCache(
+            max_sessions=max_sessions,
+            ttl=session_ttl,
+            max_memory=(
+                None if max_memory_mb is None else int(max_memory_mb * 1024 * 1024)
+            ),
+        ),
+        max_concurrency=max_concurrency,
+        queue_timeout=queue_timeout,
+        scheduler=scheduler,
+        metrics=metrics,
+        escalation_policy=escalation_policy,
+    )
+    _logger.info("serving on %s", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
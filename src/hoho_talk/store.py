@@ -0,0 +1,373 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+from .data import BlockType, ContextBlock, ConversationContext, ConversationMessage
+
+__all__ = ["ConversationStore"]
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id TEXT PRIMARY KEY,
+    agent_name TEXT,
+    user_name TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations (conversation_id),
+    message_id TEXT NOT NULL UNIQUE,
+    speaker TEXT NOT NULL,
+    content TEXT NOT NULL,
+    mood TEXT,
+    tone TEXT,
+    sentiment TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, seq);
+CREATE INDEX IF NOT EXISTS messages_speaker ON messages (speaker, seq);
+CREATE TABLE IF NOT EXISTS context_blocks (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations (conversation_id),
+    block_type TEXT NOT NULL,
+    block_content TEXT NOT NULL,
+    message_id TEXT
+);
+CREATE INDEX IF NOT EXISTS context_blocks_conversation ON context_blocks (conversation_id, seq);
+CREATE INDEX IF NOT EXISTS context_blocks_message ON context_blocks (message_id);
+CREATE UNIQUE INDEX IF NOT EXISTS context_blocks_unique
+    ON context_blocks (conversation_id, block_type, block_content, IFNULL(message_id, ''));
+"""
+
+_MESSAGE_COLUMNS = "message_id, speaker, content, mood, tone, sentiment"
+
+
+class ConversationStore:
+    """
+    A SQLite store of conversations, their messages and their context blocks.
+
+    The messages are indexed by conversation, speaker and message id. Inserts are bulk
+    (`executemany` in a single transaction) and idempotent, so saving a conversation again
+    only adds its new messages. History reads are paginated by the message sequence number.
+
+    The store keeps a pool of up to `pool_size` connections in WAL mode,
+    so concurrent sessions can read while another one writes.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        pool_size: int = 4,
+        timeout: float = 30.0,
+    ):
+        if pool_size < 1:
+            raise ValueError(f"pool_size should be at least 1: {pool_size}")
+        self.__path = str(path)
+        self.__timeout = timeout
+        self.__pool: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        self.__semaphore = threading.BoundedSemaphore(pool_size)
+        self.__closed = False
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection of the pool, in a transaction committed on exit.
+        """
+        if self.__closed:
+            raise RuntimeError("the conversation store is closed")
+        self.__semaphore.acquire()
+        try:
+            try:
+                conn = self.__pool.get_nowait()
+            except queue.Empty:
+                conn = self.__connect()
+            try:
+                with conn:
+                    yield conn
+            finally:
+                self.__pool.put_nowait(conn)
+        finally:
+            self.__semaphore.release()
+
+    def __connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.__path, timeout=self.__timeout, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def close(self):
+        self.__closed = True
+        while True:
+            try:
+                self.__pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def save(
+        self,
+        ctx: ConversationContext,
+        agent_name: Optional[str] = None,
+        user_name: Optional[str] = None,
+        context_blocks: Optional[list[ContextBlock]] = None,
+    ):
+        """
+        Save the conversation, its messages and the context blocks.
+        The messages and the blocks already saved are skipped.
+        """
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO conversations
+                    (conversation_id, agent_name, user_name, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (conversation_id) DO UPDATE SET
+                    agent_name = IFNULL(excluded.agent_name, agent_name),
+                    user_name = IFNULL(excluded.user_name, user_name),
+                    updated_at = excluded.updated_at
+                """,
+                (ctx.conversation_id, agent_name, user_name, now, now),
+            )
+            self.__insert_messages(conn, ctx.conversation_id, ctx.conversation)
+            if context_blocks:
+                self.__insert_blocks(conn, ctx.conversation_id, context_blocks)
+
+    def add_messages(self, conversation_id: str, messages: list[ConversationMessage]):
+        """
+        Bulk insert the messages into an existing conversation.
+        """
+        with self._connection() as conn:
+            self.__insert_messages(conn, conversation_id, messages)
+            conn.execute(
+                "UPDATE conversations SET updated_at = ? WHERE conversation_id = ?",
+                (time.time(), conversation_id),
+            )
+
+    def add_context_blocks(self, conversation_id: str, blocks: list[ContextBlock]):
+        with self._connection() as conn:
+            self.__insert_blocks(conn, conversation_id, blocks)
+
+    def __insert_messages(
+        self,
+        conn: sqlite3.Connection,
+        conversation_id: str,
+        messages: list[ConversationMessage],
+    ):
+        conn.executemany(
+            f"""
+            INSERT OR IGNORE INTO messages (conversation_id, {_MESSAGE_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    conversation_id,
+                    msg.message_id,
+                    msg.by,
+                    msg.content,
+                    msg.mood,
+                    msg.tone,
+                    msg.sentiment,
+                )
+                for msg in messages
+            ],
+        )
+
+    def __insert_blocks(
+        self,
+        conn: sqlite3.Connection,
+        conversation_id: str,
+        blocks: list[ContextBlock],
+    ):
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO context_blocks
+                (conversation_id, block_type, block_content, message_id)
+            VALUES (?, ?, ?, ?)
+            """,
+            [
+                (
+                    conversation_id,
+                    block.block_type.value,
+                    block.block_content,
+                    block.message_id,
+                )
+                for block in blocks
+            ],
+        )
+
+    def list_conversations(self, limit: int = 20, offset: int = 0) -> list[dict]:
+        """
+        The conversations, the most recently updated first,
+        with their numbers of messages.
+        """
+        with self._connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT c.*, (
+                    SELECT COUNT(*) FROM messages m
+                    WHERE m.conversation_id = c.conversation_id
+                ) AS num_messages
+                FROM conversations c
+                ORDER BY c.updated_at DESC
+                LIMIT ? OFFSET ?
+                """,
+                (limit, offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def history(
+        self,
+        conversation_id: str,
+        limit: int = 50,
+        before: Optional[int] = None,
+    ) -> tuple[list[ConversationMessage], Optional[int]]:
+        """
+        A page of (at most `limit`) messages of the conversation, in order, which precede
+        the cursor `before` (the latest messages if None).
+        Return the messages and the cursor of the previous page (None if there is no more).
+        """
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT seq, {_MESSAGE_COLUMNS} FROM messages
+                WHERE conversation_id = ? AND (? IS NULL OR seq < ?)
+                ORDER BY seq DESC
+                LIMIT ?
+                """,
+                # one more row tells whether there is a previous page
+                (conversation_id, before, before, limit + 1),
+            ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        cursor = rows[0]["seq"] if more and rows else None
+        return [self.__to_message(row) for row in rows], cursor
+
+    def messages_by(
+        self, speaker: str, limit: int = 50, offset: int = 0
+    ) -> list[ConversationMessage]:
+        """
+        The messages of the speaker across the conversations, the latest first.
+        """
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {_MESSAGE_COLUMNS} FROM messages
+                WHERE speaker = ?
+                ORDER BY seq DESC
+                LIMIT ? OFFSET ?
+                """,
+                (speaker, limit, offset),
+            ).fetchall()
+        return [self.__to_message(row) for row in rows]
+
+    def get_message(self, message_id: str) -> Optional[ConversationMessage]:
+        with self._connection() as conn:
+            row = conn.execute(
+                f"SELECT {_MESSAGE_COLUMNS} FROM messages WHERE message_id = ?",
+                (message_id,),
+            ).fetchone()
+        return None if row is None else self.__to_message(row)
+
+    def context_blocks(
+        self,
+        conversation_id: str,
+        message_id: Optional[str] = None,
+        summaries: bool = True,
+    ) -> list[ContextBlock]:
+        """
+        The context blocks of the conversation, or only those bound to `message_id`.
+        Without `summaries`, the rolling summaries (the memory blocks bound to a message,
+        see `latest_summary`) are left out.
+        """
+        query = """
+            SELECT block_type, block_content, message_id FROM context_blocks
+            WHERE conversation_id = ?
+        """
+        params: tuple = (conversation_id,)
+        if message_id is not None:
+            query += " AND message_id = ?"
+            params += (message_id,)
+        if not summaries:
+            query += " AND NOT (block_type = ? AND message_id IS NOT NULL)"
+            params += (BlockType.memory.value,)
+        with self._connection() as conn:
+            rows = conn.execute(query + " ORDER BY seq", params).fetchall()
+        return [ContextBlock(**dict(row)) for row in rows]
+
+    def latest_summary(self, conversation_id: str) -> Optional[ContextBlock]:
+        """
+        The latest rolling summary of the conversation (see `ContextWindowManager`),
+        which replaces the previous ones.
+        """
+        with self._connection() as conn:
+            row = conn.execute(
+                """
+                SELECT block_type, block_content, message_id FROM context_blocks
+                WHERE conversation_id = ? AND block_type = ? AND message_id IS NOT NULL
+                ORDER BY seq DESC
+                LIMIT 1
+                """,
+                (conversation_id, BlockType.memory.value),
+            ).fetchone()
+        return None if row is None else ContextBlock(**dict(row))
+
+    def load(
+        self, conversation_id: str, last: Optional[int] = None
+    ) -> ConversationContext:
+        """
+        Load the conversation, or only its `last` messages.
+        """
+        with self._connection() as conn:
+            if (
+                conn.execute(
+                    "SELECT 1 FROM conversations WHERE conversation_id = ?",
+                    (conversation_id,),
+                ).fetchone()
+                is None
+            ):
+                raise KeyError(f"conversation not found: {conversation_id}")
+            rows = conn.execute(
+                f"""
+                SELECT * FROM (
+                    SELECT seq, {_MESSAGE_COLUMNS} FROM messages
+                    WHERE conversation_id = ?
+                    ORDER BY seq DESC
+                    LIMIT ?
+                ) ORDER BY seq
+                """,
+                (conversation_id, -1 if last is None else last),
+            ).fetchall()
+        ctx = ConversationContext(conversation_id=conversation_id)
+        return ctx.extend([self.__to_message(row) for row in rows])
+
+    @staticmethod
+    def __to_message(row: sqlite3.Row) -> ConversationMessage:
+        return ConversationMessage(
+            by=row["speaker"],
+            content=row["content"],
+            message_id=row["message_id"],
+            mood=row["mood"],
+            tone=row["tone"],
+            sentiment=row["sentiment"],
+        )
@@ -0,0 +1,358 @@
+"""
+A stub ollama server for testing and benchmarking without a model.
+
+It implements `/api/chat` (streaming or not, with tools) and `/api/embed`,
+and answers each agent role (generation, critic, revision, summarization and memory)
+with canned but well-formed outputs, after a configurable latency.
+
+    $ python -m hoho_talk.stub_ollama --port 11435
+    $ OLLAMA_HOST=http://127.0.0.1:11435 python -m hoho_talk ...
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+__all__ = ["StubOllamaConfig", "StubOllamaServer"]
+
+_CREATED_AT = "2025-01-01T00:00:00Z"
+
+
+@dataclass
+class StubOllamaConfig:
+    """
+    - `latency`: the seconds before the first token.
+    - `model_latency`: the latency by model, e.g. of a small critic model, instead of `latency`.
+    - `tokens_per_second`: the speed of the generated tokens (one token per 4 characters).
+    - `aligned_rate`: the rate of the critic verdicts which accept the response.
+      The critics asked for their confidence give a uniform one in [`min_confidence`, 1].
+    - `malformed_rate`: the rate of the outputs which are not valid JSON.
+    - `think`: prepend a `<think>` section, like the reasoning models,
+      lengthened by `reasoning_tokens`.
+    - `think_open`: leave out the opening `<think>` tag, like the reasoning models whose
+      template opens the section in the prompt (e.g. qwq).
+    - `trailer_tokens`: the tokens of the remarks after the JSON (without `format`).
+    - `revised_response`: the output of the revisions, `response` by default.
+
+    The outputs are cut at ollama's `num_predict` tokens.
+    """
+
+    latency: float = 0.01
+    model_latency: dict[str, float] = field(default_factory=dict)
+    tokens_per_second: Optional[float] = None
+    aligned_rate: float = 0.5
+    min_confidence: float = 0.4
+    malformed_rate: float = 0.0
+    think: bool = True
+    think_open: bool = False
+    reasoning_tokens: int = 0
+    trailer_tokens: int = 0
+    embedding_dim: int = 64
+    seed: Optional[int] = None
+    response: dict = field(
+        default_factory=lambda: {
+            "mood": "calm",
+            "tone": "warm",
+            "sentiment": "positive",
+            "rationale": "I am glad to talk.",
+            "text_response": "Nice to meet you!",
+        }
+    )
+    revised_response: Optional[dict] = None
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    """
+    `calls` counts the calls by agent role (and `embed`),
+    and the accepted `connections`.
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        config: Optional[StubOllamaConfig] = None,
+    ):
+        super().__init__((host, port), _StubOllamaHandler)
+        self.config = StubOllamaConfig() if config is None else config
+        self.random = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.calls: dict[str, int] = {}
+        self.__thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllamaServer":
+        """
+        Serve in a background thread.
+        """
+        self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def process_request(self, request, client_address):
+        # one call per accepted connection
+        self.count("connections")
+        super().process_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # the clients stop the streams they do not need anymore by disconnecting
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def count(self, role: str):
+        with self.lock:
+            self.calls[role] = self.calls.get(role, 0) + 1
+
+    def chance(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def uniform(self, low: float, high: float) -> float:
+        with self.lock:
+            return self.random.uniform(low, high)
+
+
+def _role_of(body: dict) -> str:
+    if body.get("tools"):
+        return "memorize"
+    contents = [msg.get("content") or "" for msg in body.get("messages", [])]
+    system = contents[0] if contents else ""
+    if system.startswith("You maintain the memory of"):
+        return "summarize"
+    if "revise the given response" in system:
+        return "revise"
+    if any("evaluate if the response" in content for content in contents):
+        return "critic"
+    return "generate"
+
+
+class _StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately, do not let them wait for the ACKs
+    disable_nagle_algorithm = True
+    server: StubOllamaServer
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        if self.path in ("/", "/api/version"):
+            self.__send_json({"version": "0.0.0-stub"})
+        else:
+            self.__send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/api/embed":
+            self.server.count("embed")
+            self.__send_json(self.__embed(body))
+        elif self.path == "/api/chat":
+            self.__chat(body)
+        else:
+            self.__send_json({"error": "not found"}, status=404)
+
+    def __embed(self, body: dict) -> dict:
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dim = self.server.config.embedding_dim
+        embeddings = []
+        for text in inputs:
+            vector = [0.0] * dim
+            for word in text.split():
+                digest = hashlib.md5(word.encode("utf-8")).digest()
+                vector[int.from_bytes(digest[:4], "little") % dim] += 1.0
+            embeddings.append(vector)
+        return {"model": body["model"], "embeddings": embeddings}
+
+    def __chat(self, body: dict):
+        config = self.server.config
+        role = _role_of(body)
+        self.server.count(role)
+        message = {"role": "assistant", "content": self.__content(role, body)}
+        if role == "memorize":
+            message["tool_calls"] = [
+                {
+                    "function": {
+                        "name": "insert_context_block",
+                        "arguments": {
+                            "block_type": "memory",
+                            "block_content": body["messages"][-1]["content"][-80:],
+                        },
+                    }
+                }
+            ]
+        latency = config.model_latency.get(body["model"], config.latency)
+        time.sleep(latency)
+        done_reason = "stop"
+        num_predict = (body.get("options") or {}).get("num_predict")
+        if num_predict is not None and len(message["content"]) > num_predict * 4:
+            message["content"] = message["content"][: num_predict * 4]
+            done_reason = "length"
+        eval_count = max(1, len(message["content"]) // 4)
+        stats = {
+            "done": True,
+            "done_reason": done_reason,
+            "total_duration": 0,
+            "load_duration": 0,
+            "prompt_eval_count": sum(
+                len(msg.get("content") or "") // 4 for msg in body["messages"]
+            ),
+            "prompt_eval_duration": int(latency * 1e9),
+            "eval_count": eval_count,
+            "eval_duration": int(eval_count / (config.tokens_per_second or 1e6) * 1e9),
+        }
+        if not body.get("stream", True):
+            if config.tokens_per_second:
+                time.sleep(eval_count / config.tokens_per_second)
+            self.__send_json(
+                {
+                    "model": body["model"],
+                    "created_at": _CREATED_AT,
+                    "message": message,
+                    **stats,
+                }
+            )
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        content = message.pop("content")
+        stream_start = time.perf_counter()
+        for start in range(0, len(content), 4):
+            if config.tokens_per_second:
+                # paced against the start, so the overhead of the sleeps does not add up
+                delay = (
+                    stream_start
+                    + (start // 4 + 1) / config.tokens_per_second
+                    - time.perf_counter()
+                )
+                if delay > 0:
+                    time.sleep(delay)
+            self.__send_chunk(
+                {
+                    "model": body["model"],
+                    "created_at": _CREATED_AT,
+                    "message": {
+                        "role": "assistant",
+                        "content": content[start : start + 4],
+                    },
+                    "done": False,
+                }
+            )
+        self.__send_chunk(
+            {
+                "model": body["model"],
+                "created_at": _CREATED_AT,
+                "message": {**message, "content": ""},
+                **stats,
+            }
+        )
+        self.wfile.write(b"0\r\n\r\n")
+
+    def __content(self, role: str, body: dict) -> str:
+        config = self.server.config
+        if role in ("summarize", "memorize"):
+            return "" if role == "memorize" else "They talked about the weather."
+        if role == "critic":
+            aligned = self.server.chance(config.aligned_rate)
+            output = {
+                "is_aligned": aligned,
+                "rationale": "It fits the persona." if aligned else "It is too formal.",
+                "suggest_change": None if aligned else "Be more casual.",
+            }
+            if any(
+                '"confidence"' in (msg.get("content") or "") for msg in body["messages"]
+            ):
+                output["confidence"] = round(
+                    self.server.uniform(config.min_confidence, 1.0), 2
+                )
+        elif role == "revise" and config.revised_response is not None:
+            output = config.revised_response
+        else:
+            output = config.response
+        content = json.dumps(output, ensure_ascii=False, indent=2)
+        if self.server.chance(config.malformed_rate):
+            content = content[: len(content) // 2]
+        if body.get("format"):
+            return content
+        content = f"```json\n{content}\n```"
+        if config.trailer_tokens:
+            content += "\n" + " Ok." * config.trailer_tokens
+        messages = body.get("messages") or [{}]
+        # the reasoning is already closed in the assistant message to continue
+        continued = messages[-1].get("role") == "assistant" and "</think>" in (
+            messages[-1].get("content") or ""
+        )
+        if config.think and not continued:
+            reasoning = "Let me think about it." + " Hmm" * config.reasoning_tokens
+            opening = "" if config.think_open else "<think>\n"
+            content = f"{opening}{reasoning}\n</think>\n" + content
+        return content
+
+    def __send_json(self, payload: dict, status: int = 200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __send_chunk(self, payload: dict):
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--aligned-rate", type=float, default=0.5)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    server = StubOllamaServer(
+        args.host,
+        args.port,
+        StubOllamaConfig(
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            aligned_rate=args.aligned_rate,
+            malformed_rate=args.malformed_rate,
+            seed=args.seed,
+        ),
+    )
+    print(f"stub ollama serving on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,32 +1,370 @@
 import json
 import logging
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 from copy import deepcopy
-from typing import Optional
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterator,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+)
 
-from ollama import Client
+from ollama import ChatResponse, Client, Message
+from pydantic import BaseModel
 
+from . import _setup_logger
+from .cache import BaseCache, make_cache_key
 from .data import (
     AgentResponse,
+    AgentResponseChunk,
     BlockType,
     ContextBlock,
-    ConversationMessage,
+    Conversation,
     CriticResponse,
+    LLMCallStats,
+    PromptLayout,
+    ScoredCriticResponse,
+    SpeculationReport,
+)
+from .generation import GenerationBudget, GenerationController
+from .pool import AgentPool, default_agent_pool, default_client_pool
+from .retry import RetryPolicy
+from .routing import EscalationPolicy
+from .utils import (
+    IncrementalJSONParser,
+    ParseStats,
+    format_conversation,
+    parse_json_response,
 )
-from .tools import ToolRegistry
-from .utils import dedup_tool_calls, format_conversation, parse_json_response
+
+if TYPE_CHECKING:
+    from .context_window import ContextWindowManager
+    from .memory import MemoryExtractor
+    from .metrics import MetricsHook
+    from .retrieval import ContextBlockIndex
+    from .scheduler import RequestScheduler
 
 _logger = logging.getLogger(__name__)
+_setup_logger()
+_ResponseT = TypeVar("_ResponseT", bound=BaseModel)
+
+# the temperatures of the speculative candidates are spread upward from the given one
+_CANDIDATE_TEMPERATURE_STEP = 0.15
+_MAX_CANDIDATE_TEMPERATURE = 1.0
+
+
+def _format_context_blocks(blocks: list[ContextBlock]) -> str:
+    return "".join(f"The conversation context:\n{block}\n" for block in blocks)
+
+
+def _normalize_text(text: Optional[str]) -> Optional[str]:
+    if text is None:
+        return None
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
 
 
 class OllamaAgent:
+    _client_factory = Client
+    _role = "agent"
+
+    def __init__(
+        self,
+        client: Optional[Client] = None,
+        structured_output: bool = False,
+        parse_stats: Optional[ParseStats] = None,
+        scheduler: Optional["RequestScheduler"] = None,
+        scheduling_key: Optional[str] = None,
+        metrics_hooks: Sequence["MetricsHook"] = (),
+        generation_budget: Optional[GenerationBudget] = None,
+    ):
+        """
+        With `structured_output`, the outputs are constrained by the JSON schema of the response
+        (ollama's `format`) and validated directly, instead of parsed by `parse_json_response`.
+        `parse_stats` counts how often `parse_json_response` would have failed on them.
 
-    def __init__(self, client: Optional[Client] = None):
+        With `scheduler`, each call waits for a slot of the model, queued by the role of the agent
+        and `scheduling_key` (the conversation, which defaults to the agent itself).
+
+        The calls and the stages of the agent are reported to `metrics_hooks` (see `metrics`).
+
+        With `generation_budget`, the calls are bounded by its `num_predict`, and streamed
+        through a `generation.GenerationController` which stops them at the response
+        and bounds their reasoning.
+        """
         if client is None:
-            client = Client()
+            client = default_client_pool().get(client_cls=self._client_factory)
         self._client = client
+        self._structured_output = structured_output
+        self._parse_stats = ParseStats() if parse_stats is None else parse_stats
+        self._scheduler = scheduler
+        self._scheduling_key = (
+            f"{self._role}-{id(self)}" if scheduling_key is None else scheduling_key
+        )
+        self._metrics_hooks = tuple(metrics_hooks)
+        self._generation_budget = generation_budget
+        self.last_call_stats: Optional[LLMCallStats] = None
+
+    @property
+    def model(self) -> str:
+        raise NotImplementedError()
+
+    @property
+    def generation_budget(self) -> Optional[GenerationBudget]:
+        return self._generation_budget
+
+    def _budget_kwargs(self, kwargs: dict) -> dict:
+        if self._generation_budget is None:
+            return kwargs
+        return {
+            **kwargs,
+            "options": self._generation_budget.options(kwargs.get("options")),
+        }
+
+    def _generation_controller(
+        self, response_cls: Optional[Type[BaseModel]] = None
+    ) -> Optional[GenerationController]:
+        budget = self._generation_budget
+        if budget is None or not budget.streamed:
+            return None
+        if response_cls is None:
+            return GenerationController(budget)
+
+        def validate(text: str) -> bool:
+            try:
+                response_cls.model_validate_json(text)
+            except ValueError:
+                return False
+            return True
+
+        return GenerationController(budget, validate)
+
+    @property
+    def metrics_hooks(self) -> tuple["MetricsHook", ...]:
+        return self._metrics_hooks
+
+    def _emit(self, event: str, *args, **kwargs):
+        for hook in self._metrics_hooks:
+            try:
+                getattr(hook, event)(*args, **kwargs)
+            except Exception:
+                _logger.exception("metrics hook %r failed on %s", hook, event)
+
+    @contextmanager
+    def _stage(self, stage: str, **labels: str):
+        """
+        Report the wall time of the stage to the hooks, unless it fails.
+        """
+        if not self._metrics_hooks:
+            yield
+            return
+        start = time.perf_counter()
+        yield
+        self._emit("on_stage", stage, time.perf_counter() - start, **labels)
+
+    @property
+    def structured_output(self) -> bool:
+        return self._structured_output
+
+    @property
+    def parse_stats(self) -> ParseStats:
+        return self._parse_stats
+
+    def _format(self, response_cls: Type[BaseModel]) -> Optional[dict]:
+        return response_cls.model_json_schema() if self._structured_output else None
+
+    def _parse_output(self, content: str, response_cls: Type[_ResponseT]) -> _ResponseT:
+        with self._stage("parse", role=self._role):
+            return self.__parse_output(content, response_cls)
+
+    def __parse_output(
+        self, content: str, response_cls: Type[_ResponseT]
+    ) -> _ResponseT:
+        if not self._structured_output:
+            return response_cls(**parse_json_response(content.strip()))
+        response = response_cls.model_validate_json(content)
+        try:
+            response_cls(**parse_json_response(content.strip()))
+        except Exception:
+            self._parse_stats.record(legacy_ok=False)
+        else:
+            self._parse_stats.record(legacy_ok=True)
+        return response
+
+    @property
+    def scheduler(self) -> Optional["RequestScheduler"]:
+        return self._scheduler
+
+    def _rebind(
+        self,
+        parse_stats: Optional[ParseStats] = None,
+        scheduling_key: Optional[str] = None,
+        metrics_hooks: Sequence["MetricsHook"] = (),
+    ):
+        """
+        Rebind a pooled agent to its borrower (see `pool.AgentPool`).
+        """
+        self._parse_stats = ParseStats() if parse_stats is None else parse_stats
+        if scheduling_key is not None:
+            self._scheduling_key = scheduling_key
+        self._metrics_hooks = tuple(metrics_hooks)
+        self.last_call_stats = None
+
+    def _slot(self):
+        if self._scheduler is None:
+            return nullcontext()
+        return self._scheduler.slot(self.model, self._role, self._scheduling_key)
+
+    def _chat(
+        self,
+        messages: list[dict],
+        response_cls: Optional[Type[BaseModel]] = None,
+        **kwargs,
+    ) -> ChatResponse:
+        response, self.last_call_stats = self._chat_call(
+            messages, response_cls=response_cls, **kwargs
+        )
+        return response
+
+    def _chat_call(
+        self,
+        messages: list[dict],
+        response_cls: Optional[Type[BaseModel]] = None,
+        **kwargs,
+    ) -> tuple[ChatResponse, LLMCallStats]:
+        """
+        Like `_chat`, but return the stats of the call instead of setting `last_call_stats`,
+        for the calls running concurrently on the agent.
+
+        `response_cls` is the schema of the output, at whose JSON object a controlled call
+        (see `generation_budget`) is stopped.
+        """
+        kwargs = self._budget_kwargs(kwargs)
+        controller = self._generation_controller(response_cls)
+        with self._slot():
+            start = time.perf_counter()
+            if controller is None:
+                response = self._client.chat(
+                    model=self.model, messages=messages, **kwargs
+                )
+            else:
+                last_chunk = None
+                for last_chunk in self._controlled_stream(
+                    messages, controller, **kwargs
+                ):
+                    pass
+                response = controller.response(self.model, last_chunk)
+            wall_time = time.perf_counter() - start
+        return response, self._call_stats(response, wall_time, controller)
+
+    def _controlled_stream(
+        self, messages: list[dict], controller: GenerationController, **kwargs
+    ) -> Iterator[ChatResponse]:
+        """
+        Stream the chat through `controller`: it is stopped at the first valid JSON object,
+        and continued after a chunk closing the reasoning once the reasoning budget is spent.
+        """
+        while True:
+            stream = self._client.chat(
+                model=self.model, messages=messages, stream=True, **kwargs
+            )
+            try:
+                for chunk in stream:
+                    action = controller.feed(chunk.message.content)
+                    yield chunk
+                    if action == controller.STOP:
+                        return
+                    if action == controller.FORCE and not chunk.done:
+                        break
+                else:
+                    return
+            finally:
+                # closing the connection stops the generation
+                stream.close()
+            closing, messages = controller.force_answer(messages)
+            yield ChatResponse(
+                model=self.model,
+                done=False,
+                message=Message(role="assistant", content=closing),
+            )
+
+    def _chat_stream(
+        self,
+        messages: list[dict],
+        controller: Optional[GenerationController] = None,
+        **kwargs,
+    ) -> Iterator[ChatResponse]:
+        """
+        With `controller` (see `_generation_controller`), the output is controlled by it,
+        and its `content` is the output to parse.
+        """
+        kwargs = self._budget_kwargs(kwargs)
+        # the slot is held until the stream is exhausted or closed
+        with self._slot():
+            start = time.perf_counter()
+            if controller is None:
+                for chunk in self._client.chat(
+                    model=self.model, messages=messages, stream=True, **kwargs
+                ):
+                    if chunk.done:
+                        self.last_call_stats = self._call_stats(
+                            chunk, time.perf_counter() - start
+                        )
+                    yield chunk
+                return
+            last_chunk = None
+            for last_chunk in self._controlled_stream(messages, controller, **kwargs):
+                yield last_chunk
+            self.last_call_stats = self._call_stats(
+                controller.response(self.model, last_chunk),
+                time.perf_counter() - start,
+                controller,
+            )
+
+    def _call_stats(
+        self,
+        response: ChatResponse,
+        wall_time: Optional[float] = None,
+        controller: Optional[GenerationController] = None,
+    ) -> LLMCallStats:
+        stats = LLMCallStats(
+            role=self._role,
+            model=self.model,
+            prompt_eval_count=response.prompt_eval_count,
+            prompt_eval_duration=response.prompt_eval_duration,
+            eval_count=response.eval_count,
+            eval_duration=response.eval_duration,
+            load_duration=response.load_duration,
+            total_duration=response.total_duration,
+            wall_time=wall_time,
+            done_reason=response.done_reason,
+            reasoning_tokens=(
+                None if controller is None else controller.reasoning_tokens
+            ),
+        )
+        if controller is not None and controller.budget.log_think and controller.think:
+            _logger.info(
+                "%s reasoning (%d tokens%s):\n%s",
+                self._role,
+                controller.reasoning_tokens,
+                ", cut by the budget" if controller.forced else "",
+                controller.think,
+            )
+        _logger.debug("%s call stats: %s", self._role, stats)
+        self._emit("on_call", stats)
+        return stats
 
 
 class OllamaTalkAgent(OllamaAgent):
+    _role = "generate"
+
     def __init__(
         self,
         name,
@@ -36,8 +374,72 @@ class OllamaTalkAgent(OllamaAgent):
         revision_trials=3,
         historical_context_blocks: list[ContextBlock] = None,
         extra_sys_prompt: Optional[str] = None,
+        prompt_layout: PromptLayout = PromptLayout.legacy,
+        critic_cache: Optional[BaseCache] = None,
+        structured_output: bool = False,
+        retry_policy: Optional[RetryPolicy] = None,
+        context_window: Optional["ContextWindowManager"] = None,
+        context_retriever: Optional["ContextBlockIndex"] = None,
+        retrieval_top_k: int = 8,
+        retrieval_query_messages: int = 6,
+        memory_extractor: Optional["MemoryExtractor"] = None,
+        scheduler: Optional["RequestScheduler"] = None,
+        scheduling_key: Optional[str] = None,
+        agent_pool: Optional[AgentPool] = None,
+        metrics_hooks: Sequence["MetricsHook"] = (),
+        response_cache: Optional[BaseCache] = None,
+        temperature_bucket: float = 0.1,
+        critic_model: Optional[str] = None,
+        revise_model: Optional[str] = None,
+        escalation_policy: Optional[EscalationPolicy] = None,
+        generation_budgets: Optional[dict[str, GenerationBudget]] = None,
     ):
-        super().__init__(client)
+        """
+        `retry_policy` bounds the retries of each model call (generation, critic and revision).
+        Without it, the failures are raised immediately.
+
+        `context_window` keeps the conversation in the prompts within its token budget,
+        folding the older messages into a rolling memory block.
+
+        With `context_retriever`, the historical context blocks are indexed by it, and only
+        the `retrieval_top_k` blocks relevant to the last `retrieval_query_messages` messages
+        are put in the system prompt, instead of all of them.
+
+        With `memory_extractor`, each turn is handed over to it once the response is ready,
+        and it inserts the significant information of the conversation into the context blocks
+        in the background.
+
+        The critic and revise agents share `scheduler` and `scheduling_key` with the agent.
+        They are borrowed from `agent_pool` (`pool.default_agent_pool()` by default) for each turn,
+        instead of being constructed every turn.
+
+        The critic and revise agents report to `metrics_hooks` too, so the hooks see the whole
+        turn: the stages (see `metrics`), the calls and the critic verdicts.
+
+        With `response_cache` (e.g. a `cache.TieredCache` of an `LRUCache` and a `DiskCache`),
+        the final responses are cached by the model, the persona, the system prompt, the context
+        blocks, the conversation (without the message ids) and the temperature, rounded to
+        `temperature_bucket`, so a replayed conversation is answered without calling the model.
+        The conversation is looked up as is, then normalized (NFKC, case and whitespace folded).
+        See `response_cache_stats`.
+
+        The responses are criticized by `critic_model` and revised by `revise_model`, which are
+        `model` by default. With `escalation_policy`, the verdicts of the critic which it deems
+        rejections or uncertain are checked again by the critic of its stronger model
+        (`model` by default), see `routing.EscalationPolicy`.
+
+        `generation_budgets` are the `generation.GenerationBudget`s of the calls by role
+        (`generate`, `critic` and `revise`).
+        """
+        generation_budgets = dict(generation_budgets or {})
+        super().__init__(
+            client,
+            structured_output=structured_output,
+            scheduler=scheduler,
+            scheduling_key=scheduling_key,
+            metrics_hooks=metrics_hooks,
+            generation_budget=generation_budgets.get(self._role),
+        )
         if historical_context_blocks is None:
             historical_context_blocks = []
         else:
@@ -45,6 +447,17 @@ class OllamaTalkAgent(OllamaAgent):
             for block in historical_context_blocks:
                 block.message_id = None
         self.__model = model[:]
+        self.__critic_model = model if critic_model is None else critic_model
+        self.__revise_model = model if revise_model is None else revise_model
+        self.__escalation_policy = escalation_policy
+        self.__generation_budgets = generation_budgets
+        # the critic of the escalation is useless if it is the same model
+        self.__escalation_model = (
+            None
+            if escalation_policy is None
+            or (escalation_policy.model or model) == self.__critic_model
+            else (escalation_policy.model or model)
+        )
         self.__name = name[:]
         self.__persona = persona[:]
         example_blocks = [
@@ -73,15 +486,34 @@ For example:
             self.__sys_prompt += f"""\
 - {block.block_type!r}: {block.block_type.description}
 """
-
-        #         self.__sys_prompt += """\
-
-        # You also have access to the tool, `insert_context_block`, which allows you to update the context blocks.
-        # Use the `insert_context_block` tool when there is significant information in the conversation which is not included in the context blocks."""
         if extra_sys_prompt is not None:
             self.__sys_prompt += "\n\n" + extra_sys_prompt
         self.__context_blocks = historical_context_blocks
         self.__revision_trials = revision_trials
+        self.__prompt_layout = PromptLayout(prompt_layout)
+        self.__critic_cache = critic_cache
+        self.__retry_policy = retry_policy
+        self.__context_window = context_window
+        self.__context_retriever = context_retriever
+        self.__retrieval_top_k = retrieval_top_k
+        self.__retrieval_query_messages = retrieval_query_messages
+        self.__retrieved_blocks: list[ContextBlock] = []
+        if context_retriever is not None:
+            context_retriever.add(self.__context_blocks)
+        self.__memory_extractor = memory_extractor
+        self.__agent_pool = default_agent_pool() if agent_pool is None else agent_pool
+        self.__response_cache = response_cache
+        self.__temperature_bucket = temperature_bucket
+        self.__response_cache_lock = threading.Lock()
+        self.__response_cache_stats = {
+            "exact_hits": 0,
+            "normalized_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+        }
+        self.__context_blocks_lock = threading.Lock()
+        self.__turn_stats: list[LLMCallStats] = []
+        self.__speculation_report: Optional[SpeculationReport] = None
 
     @property
     def persona(self):
@@ -91,28 +523,448 @@ For example:
     def model(self):
         return self.__model
 
+    @property
+    def critic_model(self) -> str:
+        return self.__critic_model
+
+    @property
+    def revise_model(self) -> str:
+        return self.__revise_model
+
+    @property
+    def escalation_policy(self) -> Optional[EscalationPolicy]:
+        return self.__escalation_policy
+
+    @property
+    def generation_budgets(self) -> dict[str, GenerationBudget]:
+        return dict(self.__generation_budgets)
+
     @property
     def name(self):
         return self.__name
 
+    @property
+    def revision_trials(self):
+        return self.__revision_trials
+
+    @property
+    def prompt_layout(self):
+        return self.__prompt_layout
+
+    @property
+    def critic_cache(self) -> Optional[BaseCache]:
+        return self.__critic_cache
+
+    @property
+    def retry_policy(self) -> Optional[RetryPolicy]:
+        return self.__retry_policy
+
+    @property
+    def context_window(self) -> Optional["ContextWindowManager"]:
+        return self.__context_window
+
+    @property
+    def context_retriever(self) -> Optional["ContextBlockIndex"]:
+        return self.__context_retriever
+
+    @property
+    def memory_extractor(self) -> Optional["MemoryExtractor"]:
+        return self.__memory_extractor
+
+    @property
+    def response_cache(self) -> Optional[BaseCache]:
+        return self.__response_cache
+
+    def response_cache_stats(self) -> dict:
+        with self.__response_cache_lock:
+            return dict(self.__response_cache_stats)
+
+    def _response_cache_keys(
+        self, conversation: Conversation, temperature: float
+    ) -> Optional[tuple[str, str]]:
+        """
+        The exact and the normalized keys of the response to the conversation.
+        """
+        if self.__response_cache is None:
+            return None
+        messages = (
+            conversation
+            if isinstance(conversation, list)
+            else conversation.conversation
+        )
+        prefix = (
+            self.__model,
+            make_cache_key(self.__persona),
+            make_cache_key(self.__sys_prompt),
+            make_cache_key(
+                *(
+                    f"{block.block_type.value}\x1e{block.block_content}"
+                    for block in self.context_blocks
+                )
+            ),
+            f"{self.__revision_trials}\x1e{self.__prompt_layout.value}"
+            f"\x1e{self._structured_output}",
+            f"{self.__critic_model}\x1e{self.__revise_model}"
+            f"\x1e{self.__escalation_model}\x1e{self.__escalation_policy!r}",
+            repr(sorted(self.__generation_budgets.items())),
+            str(round(temperature / self.__temperature_bucket)),
+        )
+        keys = []
+        for normalize in (lambda text: text, _normalize_text):
+            keys.append(
+                make_cache_key(
+                    *prefix,
+                    *(
+                        json.dumps(
+                            [
+                                normalize(msg.by),
+                                normalize(msg.content),
+                                normalize(msg.mood),
+                                normalize(msg.tone),
+                                normalize(msg.sentiment),
+                            ],
+                            ensure_ascii=False,
+                        )
+                        for msg in messages
+                    ),
+                )
+            )
+        return keys[0], keys[1]
+
+    def _lookup_response(
+        self, cache_keys: Optional[tuple[str, str]], use_cache: bool
+    ) -> Optional[AgentResponse]:
+        if cache_keys is None:
+            return None
+        if not use_cache:
+            stat = "bypassed"
+            cached = None
+        else:
+            exact_key, normalized_key = cache_keys
+            if (cached := self.__response_cache.get(exact_key)) is not None:
+                stat = "exact_hits"
+            elif (cached := self.__response_cache.get(normalized_key)) is not None:
+                stat = "normalized_hits"
+            else:
+                stat = "misses"
+        with self.__response_cache_lock:
+            self.__response_cache_stats[stat] += 1
+        if cached is None:
+            return None
+        _logger.debug("response cache %s: %s", stat, cache_keys[0])
+        return AgentResponse.model_validate_json(cached)
+
+    def _store_response(
+        self, cache_keys: Optional[tuple[str, str]], agent_response: AgentResponse
+    ):
+        if cache_keys is not None:
+            value = agent_response.model_dump_json()
+            for key in cache_keys:
+                self.__response_cache.set(key, value)
+
+    @property
+    def context_blocks(self) -> list[ContextBlock]:
+        return list(self.__context_blocks)
+
+    def insert_context_block(self, block: ContextBlock):
+        """
+        Insert a context block, which is used by the following turns.
+        It is the target of the `insert_context_block` tool.
+        """
+        with self.__context_blocks_lock:
+            # copy on write, the prompts of a turn in flight are compiled from the old list
+            self.__context_blocks = self.__context_blocks + [block]
+        if self.__context_retriever is not None:
+            self.__context_retriever.add([block])
+
+    def _remember(self, conversation: Conversation, agent_response: AgentResponse):
+        if self.__memory_extractor is not None:
+            self.__memory_extractor.submit(self, conversation, agent_response)
+
+    def _retrieve_context_blocks(self, conversation: Conversation):
+        if self.__context_retriever is None:
+            return
+        messages = (
+            conversation
+            if isinstance(conversation, list)
+            else conversation.conversation
+        )
+        query = format_conversation(messages[-self.__retrieval_query_messages :])
+        with self._stage("retrieval"):
+            self.__retrieved_blocks = self.__context_retriever.search(
+                query, self.__retrieval_top_k
+            )
+
+    def _retry(self, func, *args, **kwargs):
+        if self.__retry_policy is None:
+            return func(*args, **kwargs)
+        return self.__retry_policy.call(func, *args, **kwargs)
+
+    @property
+    def last_turn_stats(self) -> list[LLMCallStats]:
+        """
+        The statistics of the chat calls (generation, critics and revisions) of the latest turn.
+        """
+        return list(self.__turn_stats)
+
+    def _reset_turn_stats(self):
+        self.__turn_stats = []
+
+    @property
+    def last_speculation_report(self) -> Optional[SpeculationReport]:
+        """
+        The report of the latest turn with `num_candidates > 1`.
+        """
+        return self.__speculation_report
+
+    def _start_speculation(
+        self, temperature: float, num_candidates: int
+    ) -> SpeculationReport:
+        self.__speculation_report = SpeculationReport(
+            num_candidates=num_candidates,
+            temperatures=[
+                round(
+                    min(
+                        temperature + idx * _CANDIDATE_TEMPERATURE_STEP,
+                        _MAX_CANDIDATE_TEMPERATURE,
+                    ),
+                    2,
+                )
+                for idx in range(num_candidates)
+            ],
+        )
+        return self.__speculation_report
+
+    def _collect_call_stats(self, stats: Optional[LLMCallStats]):
+        if stats is not None:
+            self.__turn_stats.append(stats)
+
     def get_response(
         self,
-        conversation: list[ConversationMessage],
+        conversation: Conversation,
         temperature=0.2,
+        stream: bool = False,
+        num_candidates: int = 1,
+        use_cache: bool = True,
+        on_draft: Optional[Callable[[AgentResponse], None]] = None,
+    ) -> Union[AgentResponse, Iterator[Union[AgentResponseChunk, AgentResponse]]]:
+        """
+        Get the response of the agent to the conversation.
+
+        With `stream=True`, an iterator is returned instead.
+        It yields `AgentResponseChunk`s of the first draft as the model generates it,
+        and finally yields the `AgentResponse` after the critic/revision loop,
+        which may differ from the streamed draft.
+
+        With `num_candidates > 1`, the candidates are generated and criticized concurrently
+        at increasing temperatures, and the first candidate accepted by the critic is returned.
+        The revision loop is used only if no candidate is accepted.
+        The candidates in flight are not cancelled once one is accepted, their generations
+        run to completion in the background. See `last_speculation_report` for the timings.
+
+        With `use_cache=False`, the response cache is not looked up, but the new response
+        replaces the cached one. A cached response is not streamed, only the final one is yielded.
+
+        `on_draft` is called with the first draft before the critic/revision loop starts,
+        e.g. to start work which depends on the response, betting that the draft is accepted
+        (see `group`). It is not called for the cached responses nor with `num_candidates > 1`.
+        The errors it raises abort the turn, e.g. once the work is not needed anymore.
+        """
+        start = time.perf_counter()
+        self._reset_turn_stats()
+        cache_keys = self._response_cache_keys(conversation, temperature)
+        if (cached := self._lookup_response(cache_keys, use_cache)) is not None:
+            self._remember(conversation, cached)
+            self._emit("on_stage", "turn", time.perf_counter() - start)
+            return iter((cached,)) if stream else cached
+        if self.__context_window is not None:
+            with self._stage("context_window"):
+                conversation = self._retry(
+                    self.__context_window.window, conversation, self.__name
+                )
+        self._retry(self._retrieve_context_blocks, conversation)
+        if stream:
+            if num_candidates > 1:
+                raise ValueError("streaming does not support multiple candidates")
+            return self.__stream_response(
+                conversation, temperature, start, cache_keys, on_draft
+            )
+        if num_candidates > 1:
+            final_response = self.__speculative_response(
+                conversation, temperature, num_candidates
+            )
+        else:
+            agent_response = self._retry(
+                self.__get_agent_response, conversation, temperature
+            )
+            if on_draft is not None:
+                on_draft(agent_response)
+            final_response = self.__revise_by_critic(
+                conversation=conversation, agent_response=agent_response
+            )
+        self._store_response(cache_keys, final_response)
+        self._remember(conversation, final_response)
+        self._emit("on_stage", "turn", time.perf_counter() - start)
+        return final_response
+
+    def __stream_response(
+        self,
+        conversation: Conversation,
+        temperature: float,
+        start: float,
+        cache_keys: Optional[tuple[str, str]],
+        on_draft: Optional[Callable[[AgentResponse], None]],
     ):
+        parser = IncrementalJSONParser(stream_keys=("text_response",))
+        content = ""
+        generate_start = time.perf_counter()
+        controller = self._generation_controller(AgentResponse)
+        for chunk in self._chat_stream(
+            self._compose_messages(conversation),
+            controller=controller,
+            options={"temperature": temperature},
+            format=self._format(AgentResponse),
+        ):
+            content += chunk.message.content
+            for field, delta, is_complete in parser.feed(chunk.message.content):
+                yield AgentResponseChunk(
+                    field=field, delta=delta, is_complete=is_complete
+                )
+        self._collect_call_stats(self.last_call_stats)
+        agent_response = self._parse_agent_response(
+            content if controller is None else controller.content
+        )
+        self._emit("on_stage", "generate", time.perf_counter() - generate_start)
+        if on_draft is not None:
+            on_draft(agent_response)
         final_response = self.__revise_by_critic(
-            conversation=conversation,
-            agent_response=self.__get_agent_response(conversation, temperature),
+            conversation=conversation, agent_response=agent_response
+        )
+        self._store_response(cache_keys, final_response)
+        self._remember(conversation, final_response)
+        self._emit("on_stage", "turn", time.perf_counter() - start)
+        yield final_response
+
+    def __get_agent_response(self, conversation: Conversation, temperature: float):
+        with self._stage("generate"):
+            chat_response, call_stats = self._chat_call(
+                self._compose_messages(conversation),
+                options={"temperature": temperature},
+                response_cls=AgentResponse,
+                format=self._format(AgentResponse),
+            )
+            self._collect_call_stats(call_stats)
+            return self._parse_agent_response(chat_response.message.content)
+
+    def __speculative_response(
+        self, conversation: Conversation, temperature: float, num_candidates: int
+    ) -> AgentResponse:
+        report = self._start_speculation(temperature, num_candidates)
+        cancelled = threading.Event()
+        accepted = None
+        rejected = []
+        errors = []
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(
+            max_workers=num_candidates,
+            thread_name_prefix=f"{self.__name}-candidate",
+        )
+        futures = {
+            executor.submit(
+                self._retry,
+                self.__generate_candidate,
+                conversation,
+                candidate_temperature,
+                cancelled,
+            ): idx
+            for idx, candidate_temperature in enumerate(report.temperatures)
+        }
+        try:
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    _logger.debug("candidate %d failed: %r", idx, error)
+                    errors.append(error)
+                    continue
+                candidate, critic_response, elapsed, call_stats = result
+                report.completed += 1
+                report.candidates_time += elapsed
+                for stats in call_stats:
+                    self._collect_call_stats(stats)
+                if critic_response.is_aligned:
+                    accepted = (idx, candidate)
+                    break
+                rejected.append((idx, candidate, critic_response))
+        finally:
+            # the candidates in flight can not be interrupted,
+            # but they skip the critic once cancelled
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        report.wall_time = time.perf_counter() - start
+        if accepted is not None:
+            report.accepted_index, final_response = accepted
+        elif rejected:
+            _, candidate, critic_response = min(rejected, key=lambda item: item[0])
+            final_response = self.__revise_by_critic(
+                conversation=conversation,
+                agent_response=candidate,
+                critic_response=critic_response,
+            )
+        else:
+            raise errors[0]
+        _logger.debug(
+            "speculation: accepted candidate %s, %.3fs overlapped",
+            report.accepted_index,
+            report.overlapped_time,
         )
         return final_response
 
-    def __get_agent_response(
-        self, conversation: list[ConversationMessage], temperature: float
+    def __generate_candidate(
+        self,
+        conversation: Conversation,
+        temperature: float,
+        cancelled: threading.Event,
     ):
+        if cancelled.is_set():
+            raise RuntimeError("the candidate is cancelled")
+        start = time.perf_counter()
+        with self._stage("generate"):
+            chat_response, generate_stats = self._chat_call(
+                self._compose_messages(conversation),
+                options={"temperature": temperature},
+                response_cls=AgentResponse,
+                format=self._format(AgentResponse),
+            )
+            candidate = self._parse_agent_response(chat_response.message.content)
+        call_stats = [generate_stats]
+        if cancelled.is_set():
+            raise RuntimeError("the candidate is cancelled")
+        with self._borrow_critic_agent() as critic_agent:
+            # the whole candidate is retried
+            critic_response, critic_stats = self.__criticize(
+                critic_agent, candidate, conversation, retry=False
+            )
+        call_stats.extend(critic_stats)
+        return candidate, critic_response, time.perf_counter() - start, call_stats
+
+    def _parse_agent_response(self, content: str) -> AgentResponse:
+        _logger.debug("chat response: %s", content)
+        return self._parse_output(content, AgentResponse)
+
+    def _compose_messages(self, conversation: Conversation):
         conversation_str = format_conversation(conversation)
         _logger.debug("conversation:\n%s", conversation_str)
+        prefix_cache = self.__prompt_layout is PromptLayout.prefix_cache
+        static_blocks, turn_blocks = self.__turn_context_blocks()
         messages = [
-            {"role": "system", "content": self.__compile_sys_prompt()},
+            {
+                "role": "system",
+                "content": self.__compile_sys_prompt(
+                    static_blocks if prefix_cache else static_blocks + turn_blocks
+                ),
+            },
             {
                 "role": "user",
                 "content": f"The person you will represent in the conversation is {self.__name}.",
@@ -126,58 +978,205 @@ The persona of {self.__name} is as following, delimited by ```:
 ```
 """,
             },
-            {
-                "role": "user",
-                "content": f"""
+        ]
+        conversation_message = {
+            "role": "user",
+            "content": f"""
 The conversation by far is as following:
 ```
 {conversation_str}
 ```
 """,
-            },
-            {
-                "role": "user",
-                "content": f"""\
+        }
+        schema_str = json.dumps(AgentResponse.to_simple_json_schema(), indent=4)
+        if prefix_cache:
+            messages.append(
+                {
+                    "role": "user",
+                    "content": f"""\
+Your response will be written in JSON, which complies with the following schema:
+```json
+{schema_str}
+```
+""",
+                }
+            )
+            if turn_blocks:
+                # the blocks of the turn change across turns, so they follow the stable prefix
+                messages.append(
+                    {
+                        "role": "user",
+                        "content": _format_context_blocks(turn_blocks),
+                    }
+                )
+            messages.extend(
+                [
+                    conversation_message,
+                    {"role": "user", "content": "Write me your response in JSON."},
+                ]
+            )
+        else:
+            messages.extend(
+                [
+                    conversation_message,
+                    {
+                        "role": "user",
+                        "content": f"""\
 Write me your response in JSON, which complies with the following schema:
 ```json
-{json.dumps(AgentResponse.to_simple_json_schema(), indent=4)}
+{schema_str}
 ```
 """,
-            },
-        ]
-        chat_response = self._client.chat(
-            model=self.__model,
-            messages=messages,
-            options={"temperature": temperature},
-            # format=AgentResponse.model_json_schema(),
+                    },
+                ]
+            )
+        return messages
+
+    def _critic_agent_spec(self) -> tuple[Type["OllamaCriticAgent"], dict]:
+        return OllamaCriticAgent, dict(
+            client=self._client,
+            model=self.__critic_model,
+            prompt_layout=self.__prompt_layout,
+            cache=self.__critic_cache,
+            structured_output=self._structured_output,
+            scheduler=self._scheduler,
+            generation_budget=self.__generation_budgets.get(OllamaCriticAgent._role),
+            with_confidence=(
+                self.__escalation_model is not None
+                and self.__escalation_policy.min_confidence is not None
+            ),
+        )
+
+    def _escalation_critic_agent_spec(self) -> tuple[Type["OllamaCriticAgent"], dict]:
+        agent_cls, config = self._critic_agent_spec()
+        return agent_cls, {
+            **config,
+            "model": self.__escalation_model,
+            "with_confidence": False,
+        }
+
+    def _revise_agent_spec(self) -> tuple[Type["OllamaReviseAgent"], dict]:
+        return OllamaReviseAgent, dict(
+            client=self._client,
+            model=self.__revise_model,
+            prompt_layout=self.__prompt_layout,
+            structured_output=self._structured_output,
+            scheduler=self._scheduler,
+            generation_budget=self.__generation_budgets.get(OllamaReviseAgent._role),
         )
-        _logger.debug("chat response: %s", chat_response.message.content)
-        return AgentResponse(
-            **parse_json_response(chat_response.message.content.strip())
+
+    def _borrow_critic_agent(self):
+        return self.__agent_pool.borrow(
+            *self._critic_agent_spec(),
+            parse_stats=self._parse_stats,
+            scheduling_key=self._scheduling_key,
+            metrics_hooks=self._metrics_hooks,
+        )
+
+    def _borrow_escalation_critic_agent(self):
+        return self.__agent_pool.borrow(
+            *self._escalation_critic_agent_spec(),
+            parse_stats=self._parse_stats,
+            scheduling_key=self._scheduling_key,
+            metrics_hooks=self._metrics_hooks,
+        )
+
+    def _escalation_reason(self, critic_response: CriticResponse) -> Optional[str]:
+        if self.__escalation_model is None:
+            return None
+        return self.__escalation_policy.reason(critic_response)
+
+    def _record_escalation(
+        self, reason: str, critic_response: CriticResponse, escalated: CriticResponse
+    ):
+        self.__escalation_policy.record(critic_response, escalated)
+        _logger.debug(
+            "critic verdict (%s) escalated to %s: %s -> %s",
+            reason,
+            self.__escalation_model,
+            critic_response.is_aligned,
+            escalated.is_aligned,
+        )
+
+    def __criticize(
+        self,
+        critic_agent: "OllamaCriticAgent",
+        agent_response: AgentResponse,
+        conversation: Conversation,
+        retry: bool = True,
+    ) -> tuple[CriticResponse, list[Optional[LLMCallStats]]]:
+        """
+        The verdict on the response, escalated per `escalation_policy`,
+        and the stats of the calls.
+        """
+
+        def call(critic):
+            kwargs = dict(
+                by=self.__name, persona=self.__persona, conversation=conversation
+            )
+            if retry:
+                return self._retry(critic, agent_response, **kwargs)
+            return critic(agent_response, **kwargs)
+
+        critic_response = call(critic_agent.critic)
+        call_stats = [critic_agent.last_call_stats]
+        if (reason := self._escalation_reason(critic_response)) is None:
+            return critic_response, call_stats
+        with (
+            self._stage("escalation", reason=reason),
+            self._borrow_escalation_critic_agent() as escalation_agent,
+        ):
+            escalated = call(escalation_agent.critic)
+            call_stats.append(escalation_agent.last_call_stats)
+        self._record_escalation(reason, critic_response, escalated)
+        return escalated, call_stats
+
+    def _borrow_revise_agent(self):
+        return self.__agent_pool.borrow(
+            *self._revise_agent_spec(),
+            parse_stats=self._parse_stats,
+            scheduling_key=self._scheduling_key,
+            metrics_hooks=self._metrics_hooks,
+        )
+
+    def _emit_trial(self, trial: int, start: float):
+        self._emit(
+            "on_stage", "revision_trial", time.perf_counter() - start, trial=str(trial)
         )
-        # return AgentResponse.model_validate_json(chat_response.message.content.strip())
 
     def __revise_by_critic(
         self,
-        conversation: list[ConversationMessage],
+        conversation: Conversation,
         agent_response: AgentResponse,
+        critic_response: Optional[CriticResponse] = None,
     ) -> AgentResponse:
+        """
+        `critic_response` is the critic of `agent_response` if it is already criticized.
+        """
         revised_response = agent_response
-        critic_agent = OllamaCriticAgent(client=self._client, model=self.__model)
-        with OllamaReviseAgent(client=self._client, model=self.__model) as revise_agent:
-            for _ in range(self.__revision_trials):
-                critic_response = critic_agent.critic(
-                    revised_response,
-                    by=self.__name,
-                    persona=self.__persona,
-                    conversation=conversation,
-                )
+        with (
+            self._borrow_critic_agent() as critic_agent,
+            self._borrow_revise_agent() as revise_agent,
+        ):
+            for trial in range(self.__revision_trials):
+                trial_start = time.perf_counter()
+                if critic_response is None:
+                    critic_response, call_stats = self.__criticize(
+                        critic_agent, revised_response, conversation
+                    )
+                    for stats in call_stats:
+                        self._collect_call_stats(stats)
                 if critic_response.is_aligned:
+                    self._emit_trial(trial, trial_start)
                     break
-                revised_response = revise_agent.revise(
+                revised_response = self._retry(
+                    revise_agent.revise,
                     revised_response,
                     critic_response=critic_response,
                 )
+                self._collect_call_stats(revise_agent.last_call_stats)
+                critic_response = None
+                self._emit_trial(trial, trial_start)
             else:
                 _logger.debug(
                     "Does not reach the final revision after %d trials",
@@ -185,76 +1184,214 @@ Write me your response in JSON, which complies with the following schema:
                 )
         return revised_response
 
-    def __compile_sys_prompt(self):
+    def __turn_context_blocks(self) -> tuple[list[ContextBlock], list[ContextBlock]]:
+        """
+        The context blocks of the prompt: the ones of the agent,
+        and the ones of the turn (the retrieved ones and the memory of the context window).
+        """
+        if self.__context_retriever is None:
+            static_blocks, turn_blocks = self.__context_blocks, []
+        else:
+            static_blocks, turn_blocks = [], self.__retrieved_blocks
+        if (
+            self.__context_window is not None
+            and self.__context_window.memory_block is not None
+        ):
+            turn_blocks = turn_blocks + [self.__context_window.memory_block]
+        return static_blocks, turn_blocks
+
+    def __compile_sys_prompt(self, blocks: list[ContextBlock]):
         sys_prompt = f"""\
 {self.__sys_prompt}
 
 """
-        for block in self.__context_blocks:
-            sys_prompt += "The conversation context:\n"
-            sys_prompt += f"""\
-{block}
-"""
+        sys_prompt += _format_context_blocks(blocks)
         return sys_prompt.strip()
 
 
 class OllamaCriticAgent(OllamaAgent):
+    _role = "critic"
 
-    def __init__(self, client=None, model="qwq:latest"):
-        super().__init__(client)
+    def __init__(
+        self,
+        client=None,
+        model="qwq:latest",
+        prompt_layout: PromptLayout = PromptLayout.legacy,
+        cache: Optional[BaseCache] = None,
+        structured_output: bool = False,
+        parse_stats: Optional[ParseStats] = None,
+        scheduler: Optional["RequestScheduler"] = None,
+        scheduling_key: Optional[str] = None,
+        metrics_hooks: Sequence["MetricsHook"] = (),
+        generation_budget: Optional[GenerationBudget] = None,
+        with_confidence: bool = False,
+    ):
+        """
+        `cache` is the verdict cache consulted before asking the model,
+        which is keyed by the content hash of the persona, the conversation and the response.
+
+        With `with_confidence`, the verdicts are `ScoredCriticResponse`s, with the confidence
+        of the model in them.
+        """
+        super().__init__(
+            client,
+            structured_output=structured_output,
+            parse_stats=parse_stats,
+            scheduler=scheduler,
+            scheduling_key=scheduling_key,
+            metrics_hooks=metrics_hooks,
+            generation_budget=generation_budget,
+        )
         self.__model = model[:]
+        self.__prompt_layout = PromptLayout(prompt_layout)
+        self.__cache = cache
+        self.__verdict_cls = ScoredCriticResponse if with_confidence else CriticResponse
+
+    @property
+    def model(self):
+        return self.__model
+
+    @property
+    def cache(self) -> Optional[BaseCache]:
+        return self.__cache
+
+    @property
+    def verdict_cls(self) -> Type[CriticResponse]:
+        return self.__verdict_cls
 
     def critic(
         self,
         agent_response: AgentResponse,
         by: str,
         persona: str,
-        conversation: list[ConversationMessage],
+        conversation: Conversation,
         temperature=0.1,
     ) -> CriticResponse:
+        with self._stage("critic"):
+            cache_key = self._verdict_cache_key(
+                agent_response, by, persona, conversation
+            )
+            if (critic_response := self._lookup_verdict(cache_key)) is not None:
+                return critic_response
+            response = self._chat(
+                self._compose_messages(agent_response, by, persona, conversation),
+                options={"temperature": temperature},
+                response_cls=self.__verdict_cls,
+                format=self._format(self.__verdict_cls),
+            )
+            critic_response = self._parse_critic_response(response.message.content)
+            self._store_verdict(cache_key, critic_response)
+            return critic_response
+
+    def _verdict_cache_key(
+        self,
+        agent_response: AgentResponse,
+        by: str,
+        persona: str,
+        conversation: Conversation,
+    ) -> Optional[str]:
+        if self.__cache is None:
+            return None
+        return make_cache_key(
+            self.__model,
+            by,
+            persona,
+            format_conversation(conversation),
+            agent_response.model_dump_json(),
+            *(() if self.__verdict_cls is CriticResponse else ("with_confidence",)),
+        )
+
+    def _lookup_verdict(self, cache_key: Optional[str]) -> Optional[CriticResponse]:
+        if cache_key is None:
+            return None
+        cached = self.__cache.get(cache_key)
+        if cached is None:
+            return None
+        self.last_call_stats = None  # no call to the model
+        _logger.debug("critic verdict cache hit: %s", cache_key)
+        critic_response = self.__verdict_cls.model_validate_json(cached)
+        self._emit("on_verdict", critic_response.is_aligned, cached=True)
+        return critic_response
+
+    def _store_verdict(self, cache_key: Optional[str], critic_response: CriticResponse):
+        self._emit("on_verdict", critic_response.is_aligned, cached=False)
+        if cache_key is not None:
+            self.__cache.set(cache_key, critic_response.model_dump_json())
+
+    def _compose_messages(
+        self,
+        agent_response: AgentResponse,
+        by: str,
+        persona: str,
+        conversation: Conversation,
+    ):
         sys_prompt = """\
 You will be given a response by a person and his/her persona.
 Your task is to evaluate the response is aligned with his/her persona.
 """
         conversation_str = format_conversation(conversation)
-        messages = [
-            {
-                "role": "system",
-                "content": sys_prompt,
-            },
-            {
-                "role": "user",
-                "content": f"""\
+        conversation_message = {
+            "role": "user",
+            "content": f"""\
 The conversation by far is as following:
 ```
 {conversation_str}
 ```
 """,
-            },
-            {
-                "role": "user",
-                "content": f"""\
+        }
+        response_message = {
+            "role": "user",
+            "content": f"""\
 One possilbe response , which is in JSON format,  by {by} is as follows:
 ```
 {agent_response.model_dump_json(indent=4)}
 ```
 """,
-            },
-            {
-                "role": "user",
-                "content": f"""\
+        }
+        persona_message = {
+            "role": "user",
+            "content": f"""\
 {by}'s persona is as follows:
 ```
 {persona}
 ```
 """,
-            },
-            {
-                "role": "user",
-                "content": f"""\
+        }
+        evaluation_message = {
+            "role": "user",
+            "content": f"""\
 Considering the conversation so far and the response by {by}, evaluate if the response to the conversation is aligned with his/her persona.
 """,
+        }
+        schema_str = json.dumps(self.__verdict_cls.to_simple_json_schema(), indent=4)
+        if self.__prompt_layout is PromptLayout.prefix_cache:
+            return [
+                {"role": "system", "content": sys_prompt},
+                persona_message,
+                {
+                    "role": "user",
+                    "content": f"""\
+Your judgement will be written in JSON, which complies with the following schema:
+```json
+{schema_str}
+```
+""",
+                },
+                conversation_message,
+                response_message,
+                evaluation_message,
+                {"role": "user", "content": "Write your judgement in JSON."},
+                {"role": "assistant", "content": "Ok, this is my judgement:"},
+            ]
+        messages = [
+            {
+                "role": "system",
+                "content": sys_prompt,
             },
+            conversation_message,
+            response_message,
+            persona_message,
+            evaluation_message,
             {"role": "user", "content": "Are you done with your judgement?"},
             {"role": "assistant", "content": "Yes."},
             {
@@ -262,20 +1399,16 @@ Considering the conversation so far and the response by {by}, evaluate if the re
                 "content": f"""\
 Write your judgement in JSON, which complies with the following schema:
 ```json
-{json.dumps(CriticResponse.to_simple_json_schema(), indent=4)}
+{schema_str}
 ```
 """,
             },
             {"role": "assistant", "content": "Ok, this is my judgement:"},
         ]
-        response = self._client.chat(
-            model=self.__model,
-            messages=messages,
-            options={"temperature": temperature},
-        )
-        critic_response = CriticResponse(
-            **parse_json_response(response.message.content.strip())
-        )
+        return messages
+
+    def _parse_critic_response(self, content: str) -> CriticResponse:
+        critic_response = self._parse_output(content, self.__verdict_cls)
         _logger.debug(
             "critic response (%s): %s",
             critic_response.is_aligned,
@@ -285,9 +1418,31 @@ Write your judgement in JSON, which complies with the following schema:
 
 
 class OllamaReviseAgent(OllamaAgent):
-    def __init__(self, client=None, model="qwq:latest"):
-        super().__init__(client)
+    _role = "revise"
+
+    def __init__(
+        self,
+        client=None,
+        model="qwq:latest",
+        prompt_layout: PromptLayout = PromptLayout.legacy,
+        structured_output: bool = False,
+        parse_stats: Optional[ParseStats] = None,
+        scheduler: Optional["RequestScheduler"] = None,
+        scheduling_key: Optional[str] = None,
+        metrics_hooks: Sequence["MetricsHook"] = (),
+        generation_budget: Optional[GenerationBudget] = None,
+    ):
+        super().__init__(
+            client,
+            structured_output=structured_output,
+            parse_stats=parse_stats,
+            scheduler=scheduler,
+            scheduling_key=scheduling_key,
+            metrics_hooks=metrics_hooks,
+            generation_budget=generation_budget,
+        )
         self.__model = model[:]
+        self.__prompt_layout = PromptLayout(prompt_layout)
         self.__sys_prompt = """\
 Your task is to revise the given response according to user's critics and suggestions.
 
@@ -299,11 +1454,33 @@ The revision should be in the same language as the original response.
             ]  # (critic, original, revised)
         ] = []
 
+    @property
+    def model(self):
+        return self.__model
+
     def revise(
         self,
         agent_response: AgentResponse,
         critic_response: CriticResponse,
     ) -> AgentResponse:
+        with self._stage("revise"):
+            response = self._chat(
+                self._compose_messages(agent_response, critic_response),
+                options={"temperature": 0.1},
+                response_cls=AgentResponse,
+                format=self._format(AgentResponse),
+            )
+            return self._record_revision(
+                agent_response, critic_response, response.message.content
+            )
+
+    def _compose_messages(
+        self,
+        agent_response: AgentResponse,
+        critic_response: CriticResponse,
+    ):
+        if self.__prompt_layout is PromptLayout.prefix_cache:
+            return self.__compose_prefix_cache_messages(agent_response, critic_response)
         response_json_str = agent_response.model_dump_json(indent=4)
         messages = [
             {
@@ -392,14 +1569,68 @@ My suggestion on the revision of the response is as following:
                 },
             ]
         )
-        response = self._client.chat(
-            model=self.__model,
-            messages=messages,
-            options={"temperature": 0.1},
-        )
-        revised_agent_response = AgentResponse(
-            **parse_json_response(response.message.content.strip())
-        )
+        return messages
+
+    def __compose_prefix_cache_messages(
+        self,
+        agent_response: AgentResponse,
+        critic_response: CriticResponse,
+    ):
+        """
+        Compose the messages as a multi-turn chat, where each revision trial
+        appends to the messages of the previous trial.
+        """
+        messages = [{"role": "system", "content": self.__sys_prompt}]
+        pairs = self.__prev_critic_response_pairs + [
+            (critic_response, agent_response, None)
+        ]
+        for idx, (critic, ori, revision) in enumerate(pairs):
+            if idx == 0:
+                messages.append(
+                    {
+                        "role": "user",
+                        "content": f"""\
+The response for revision is as following:
+
+{ori.model_dump_json(indent=4)}""",
+                    }
+                )
+            messages.extend(
+                [
+                    {
+                        "role": "user",
+                        "content": f"""\
+After I reviewed the {'response' if idx == 0 else 'revised response'}, I found it not aligned with the persona of the person in the conversation.
+This is my rationale:
+{critic.rationale!r}
+""",
+                    },
+                    {
+                        "role": "user",
+                        "content": f"""\
+My suggestion on the revision of the response is as following:
+{critic.suggest_change!r}
+""",
+                    },
+                    {
+                        "role": "user",
+                        "content": "Write me the revised response according to my suggestion in JSON.",
+                    },
+                ]
+            )
+            if revision is not None:
+                messages.append(
+                    {"role": "assistant", "content": revision.model_dump_json(indent=4)}
+                )
+        return messages
+
+    def _record_revision(
+        self,
+        agent_response: AgentResponse,
+        critic_response: CriticResponse,
+        content: str,
+    ) -> AgentResponse:
+        revised_agent_response = self._parse_output(content, AgentResponse)
         self.__prev_critic_response_pairs.append(
             (critic_response, agent_response, revised_agent_response)
         )
@@ -408,6 +1639,19 @@ My suggestion on the revision of the response is as following:
     def _reset(self):
         self.__prev_critic_response_pairs = []
 
+    def _rebind(
+        self,
+        parse_stats: Optional[ParseStats] = None,
+        scheduling_key: Optional[str] = None,
+        metrics_hooks: Sequence["MetricsHook"] = (),
+    ):
+        super()._rebind(
+            parse_stats=parse_stats,
+            scheduling_key=scheduling_key,
+            metrics_hooks=metrics_hooks,
+        )
+        self._reset()
+
     def __enter__(self):
         self._reset()
         return self
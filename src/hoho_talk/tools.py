@@ -1,6 +1,6 @@
 from typing import Callable, Optional
 
-from .data import BlockType
+from .data import BlockType, ContextBlock
 
 __all__ = ["ToolRegistry"]
 
@@ -34,6 +34,16 @@ class ToolRegistry:
             "target": target,
         }
 
+    @classmethod
+    def call(cls, tool_name: str, agent, arguments: dict):
+        """
+        Execute the tool on behalf of `agent`, which is passed as the first argument of the target.
+        """
+        _, target = cls.get_llm_tool(tool_name)
+        if target is None:
+            raise ValueError(f"Tool {tool_name} has no target.")
+        return target(agent, **arguments)
+
     @classmethod
     def get_llm_tool(cls, tool_name: str) -> tuple[dict, Optional[Callable]]:
         if tool_name not in cls._TOOLS:
@@ -49,7 +59,7 @@ class ToolRegistry:
         }, tool_data["target"]
 
 
-ToolRegistry.register(
+@ToolRegistry.register(
     "insert_context_block",
     description="Insert a context block into the conversation context.",
     parameters={
@@ -60,5 +70,11 @@ ToolRegistry.register(
         },
         "required": ["block_type", "block_content"],
     },
-    target=None,
 )
+def insert_context_block(agent, block_type: str, block_content: str) -> ContextBlock:
+    """
+    Insert a context block into the context blocks of `agent` (an `OllamaTalkAgent`).
+    """
+    block = ContextBlock(block_type=block_type, block_content=block_content)
+    agent.insert_context_block(block)
+    return block
@@ -1,11 +1,14 @@
 import json
 import re
+import threading
 
 from ollama import Message
 
-from .data import ConversationMessage
+from .data import Conversation, ConversationContext
 
 _TAILING_COMMA_PATTERN = re.compile(r",\n?}\n?$")
+_THINK_PATTERN = re.compile(r"<think>[\s\S]*?</think>")
+_THINK_CLOSE = "</think>"
 
 
 def parse_json_response(response_str: str, delimiter: str = "```") -> dict:
@@ -21,17 +24,269 @@ def parse_json_response(response_str: str, delimiter: str = "```") -> dict:
     return json.loads(json_str.split(delimiter)[0])
 
 
-def format_conversation(conversation: list[ConversationMessage]):
-    return "\n".join(
-        f"{m.by} (message id {m.message_id!r}): {m.content}" for m in conversation
-    )
+def strip_think_sections(text: str) -> str:
+    """
+    Remove the `<think>...</think>` sections of the reasoning models.
+    The templates of some of them (e.g. qwq) open the section in the prompt,
+    so the output up to a `</think>` without its opening tag is removed too.
+    """
+    text = _THINK_PATTERN.sub("", text)
+    _, closed, after = text.rpartition(_THINK_CLOSE)
+    return (after if closed else text).strip()
+
+
+def format_conversation(conversation: Conversation):
+    if isinstance(conversation, ConversationContext):
+        return conversation.transcript
+    return "\n".join(m.to_transcript_line() for m in conversation)
 
 
 def dedup_tool_calls(tool_calls: list[Message.ToolCall]) -> list[Message.ToolCall]:
-    visited_tool_names = set()
+    """
+    Remove the repeated tool calls, which call the same tool with the same arguments.
+    """
+    visited_tool_calls = set()
     dedup_tool_calls = []
     for tool_call in tool_calls:
-        if tool_call.function.name not in visited_tool_names:
-            visited_tool_names.add(tool_call.function.name)
+        key = (
+            tool_call.function.name,
+            json.dumps(tool_call.function.arguments, sort_keys=True),
+        )
+        if key not in visited_tool_calls:
+            visited_tool_calls.add(key)
             dedup_tool_calls.append(tool_call)
     return dedup_tool_calls
+
+
+_JSON_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class IncrementalJSONParser:
+    """
+    Parse the top-level JSON object of a (streamed) model response chunk by chunk.
+
+    `feed` returns a list of `(key, delta, is_complete)` events:
+
+    - for the keys in `stream_keys`, the decoded characters of the string value are
+      emitted as soon as they arrive, followed by an empty delta with `is_complete=True`
+      once the string is closed.
+    - for other keys, a single event with the full value (the decoded string or the raw
+      JSON text for non-string values) is emitted once the value is complete.
+
+    Anything before the opening `{` (reasoning, `<think>` sections, code fences, etc.) is skipped.
+    The templates of some reasoning models (e.g. qwq) open the `<think>` section in the prompt,
+    so a `</think>` restarts the parsing, as the object parsed so far was in the reasoning.
+    """
+
+    _THINK_OPEN = "<think>"
+    _THINK_CLOSE = "</think>"
+
+    def __init__(self, stream_keys: tuple[str, ...] = ()):
+        self._stream_keys = frozenset(stream_keys)
+        self._reset()
+
+    def _reset(self):
+        self._state = "seek"
+        self._pending = ""  # undecided characters while seeking the object
+        self._key = None
+        self._buf = []  # decoded string / raw value characters
+        self._emitted = 0  # number of characters in `_buf` already streamed
+        self._escape = None  # None, "" (after backslash) or partial "uXXXX"
+        self._in_string = False  # for raw (non-string) values
+        self._depth = 0  # nesting depth inside raw values
+        self._done = False
+        self._tail = ""  # the last characters, to catch a closing `</think>`
+
+    @property
+    def done(self):
+        return self._done
+
+    def feed(self, chunk: str) -> list[tuple[str, str, bool]]:
+        events = []
+        delta = []
+        for char in chunk:
+            if self._state != "think":
+                self._tail = (self._tail + char)[-len(self._THINK_CLOSE) :]
+                if self._tail == self._THINK_CLOSE:
+                    # the reasoning of a pre-opened section ends here
+                    self._reset()
+                    delta.clear()
+                    continue
+            if not self._done:
+                self._consume(char, delta, events)
+        if delta:
+            events.append((self._key, "".join(delta), False))
+        return events
+
+    def _consume(self, char: str, delta: list[str], events: list):
+        state = self._state
+        if state == "seek":
+            self._pending += char
+            if self._pending.endswith(self._THINK_OPEN):
+                self._state = "think"
+                self._pending = ""
+            elif char == "{":
+                self._state = "key_or_end"
+                self._pending = ""
+            else:
+                self._pending = self._pending[-len(self._THINK_OPEN) :]
+        elif state == "think":
+            self._pending += char
+            if self._pending.endswith(self._THINK_CLOSE):
+                self._state = "seek"
+                self._pending = ""
+                self._tail = ""
+            else:
+                self._pending = self._pending[-len(self._THINK_CLOSE) :]
+        elif state == "key_or_end":
+            if char == '"':
+                self._state = "key"
+                self._buf = []
+            elif char == "}":
+                self._done = True
+        elif state == "key":
+            if self._decode_string_char(char, self._buf):
+                self._key = "".join(self._buf)
+                self._state = "colon"
+        elif state == "colon":
+            if char == ":":
+                self._state = "value"
+        elif state == "value":
+            if char.isspace():
+                return
+            self._buf = []
+            if char == '"':
+                self._state = "string_value"
+                self._emitted = 0
+            else:
+                self._state = "raw_value"
+                self._in_string = False
+                self._depth = 0
+                self._consume(char, delta, events)
+        elif state == "string_value":
+            streamed = self._key in self._stream_keys
+            closed = self._decode_string_char(char, self._buf)
+            if streamed:
+                end = len(self._buf)
+                if not closed and end and "\ud800" <= self._buf[-1] <= "\udbff":
+                    end -= 1  # wait for the low surrogate
+                delta.extend(self._buf[self._emitted : end])
+                self._emitted = end
+            if closed:
+                if delta:
+                    events.append((self._key, "".join(delta), False))
+                    delta.clear()
+                value = "" if streamed else "".join(self._buf)
+                events.append((self._key, value, True))
+                self._state = "comma_or_end"
+        elif state == "raw_value":
+            if self._in_string:
+                self._buf.append(char)
+                if self._escape is not None:
+                    self._escape = None
+                elif char == "\\":
+                    self._escape = ""
+                elif char == '"':
+                    self._in_string = False
+            elif char in ",}" and self._depth == 0:
+                events.append((self._key, "".join(self._buf).strip(), True))
+                self._state = "key_or_end"
+                if char == "}":
+                    self._done = True
+            else:
+                self._buf.append(char)
+                if char == '"':
+                    self._in_string = True
+                elif char in "[{":
+                    self._depth += 1
+                elif char in "]}":
+                    self._depth -= 1
+        elif state == "comma_or_end":
+            if char == ",":
+                self._state = "key_or_end"
+            elif char == "}":
+                self._done = True
+
+    def _decode_string_char(self, char: str, buf: list[str]) -> bool:
+        """
+        Decode one character of a JSON string into `buf`.
+        Return True when the closing quote is consumed.
+        """
+        if self._escape is None:
+            if char == "\\":
+                self._escape = ""
+            elif char == '"':
+                return True
+            else:
+                buf.append(char)
+        elif self._escape == "":
+            if char == "u":
+                self._escape = "u"
+            else:
+                buf.append(_JSON_ESCAPES.get(char, char))
+                self._escape = None
+        else:
+            self._escape += char
+            if len(self._escape) == 5:
+                try:
+                    code = int(self._escape[1:], 16)
+                except ValueError:
+                    buf.append(self._escape)
+                else:
+                    if (
+                        0xDC00 <= code <= 0xDFFF
+                        and buf
+                        and "\ud800" <= buf[-1] <= "\udbff"
+                    ):
+                        # merge the surrogate pair
+                        high = ord(buf.pop())
+                        code = 0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00)
+                    buf.append(chr(code))
+                self._escape = None
+        return False
+
+
+class ParseStats:
+    """
+    The counters of the structured (schema-constrained) outputs,
+    and how often `parse_json_response` would have failed on them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._structured = 0
+        self._legacy_failures = 0
+
+    @property
+    def structured(self) -> int:
+        return self._structured
+
+    @property
+    def legacy_failures(self) -> int:
+        return self._legacy_failures
+
+    @property
+    def legacy_failure_rate(self) -> float:
+        return self._legacy_failures / self._structured if self._structured else 0.0
+
+    def record(self, legacy_ok: bool):
+        with self._lock:
+            self._structured += 1
+            if not legacy_ok:
+                self._legacy_failures += 1
+
+    def __str__(self):
+        return (
+            f"{self._structured} structured outputs, "
+            f"legacy parser would have failed {self._legacy_failures} times "
+            f"({self.legacy_failure_rate:.1%})"
+        )
@@ -0,0 +1,47 @@
+from ollama import ChatResponse, Message
+
+from hoho_talk.context_window import ContextWindowManager
+from hoho_talk.data import ConversationContext
+
+
+class _SummaryClient:
+    """
+    A client answering the summarization with a fixed output.
+    """
+
+    def __init__(self, content: str):
+        self.content = content
+
+    def chat(self, model: str, messages: list[dict], **kwargs) -> ChatResponse:
+        return ChatResponse(
+            model=model,
+            done=True,
+            message=Message(role="assistant", content=self.content),
+        )
+
+
+def _folded_summary(content: str) -> str:
+    manager = ContextWindowManager(
+        client=_SummaryClient(content), token_budget=40, min_recent_messages=2
+    )
+    ctx = ConversationContext()
+    for idx in range(8):
+        ctx.add_message(by="user", content=f"message number {idx} of the user")
+    manager.window(ctx, "agent")
+    assert manager.memory_block is not None
+    return manager.memory_block.block_content
+
+
+def test_summary_without_think_section():
+    assert _folded_summary("The user counts.") == "The user counts."
+
+
+def test_summary_strips_think_section():
+    content = "<think>\nLet me summarize.\n</think>\n\nThe user counts."
+    assert _folded_summary(content) == "The user counts."
+
+
+def test_summary_strips_pre_opened_think_section():
+    # the template of the model opens the section, so the output has no opening tag
+    content = "Let me summarize the messages.\n</think>\n\nThe user counts."
+    assert _folded_summary(content) == "The user counts."
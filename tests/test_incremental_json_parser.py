@@ -0,0 +1,37 @@
+from hoho_talk.utils import IncrementalJSONParser
+
+_RESPONSE = '```json\n{"mood": "calm", "text_response": "Hi there"}\n```'
+
+
+def _feed(text: str, chunk_size: int = 1) -> tuple[list, IncrementalJSONParser]:
+    parser = IncrementalJSONParser(stream_keys=("text_response",))
+    events = []
+    for start in range(0, len(text), chunk_size):
+        events.extend(parser.feed(text[start : start + chunk_size]))
+    return events, parser
+
+
+def _streamed(events: list) -> str:
+    return "".join(delta for key, delta, _ in events if key == "text_response")
+
+
+def test_streams_the_response():
+    events, parser = _feed(_RESPONSE)
+    assert parser.done
+    assert ("mood", "calm", True) in events
+    assert _streamed(events) == "Hi there"
+
+
+def test_skips_think_section():
+    events, parser = _feed("<think>\nLet me {think}.\n</think>\n" + _RESPONSE, 3)
+    assert parser.done
+    assert ("mood", "calm", True) in events
+    assert _streamed(events) == "Hi there"
+
+
+def test_skips_pre_opened_think_section():
+    # the template of the model opens the section, so the output has no opening tag
+    events, parser = _feed("Let me {think}\n</think>\n" + _RESPONSE)
+    assert parser.done
+    assert ("mood", "calm", True) in events
+    assert _streamed(events) == "Hi there"
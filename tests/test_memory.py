@@ -0,0 +1,70 @@
+from ollama import ChatResponse, Message
+
+from hoho_talk.data import AgentResponse, ContextBlock, ConversationContext
+from hoho_talk.memory import MemoryExtractor
+
+
+def _tool_call(**arguments) -> Message.ToolCall:
+    return Message.ToolCall(
+        function=Message.ToolCall.Function(
+            name="insert_context_block", arguments=arguments
+        )
+    )
+
+
+class _ToolCallClient:
+    """
+    A client answering the extraction with fixed tool calls.
+    """
+
+    def __init__(self, tool_calls: list[Message.ToolCall]):
+        self.tool_calls = tool_calls
+
+    def chat(self, model: str, messages: list[dict], **kwargs) -> ChatResponse:
+        return ChatResponse(
+            model=model,
+            done=True,
+            message=Message(role="assistant", content="", tool_calls=self.tool_calls),
+        )
+
+
+class _Agent:
+    name = "Hoho"
+    persona = "A cheerful person."
+
+    def __init__(self):
+        self.context_blocks: list[ContextBlock] = []
+
+    def insert_context_block(self, block: ContextBlock):
+        self.context_blocks.append(block)
+
+
+def test_invalid_tool_call_does_not_stop_the_batch():
+    client = _ToolCallClient(
+        [
+            _tool_call(block_type="memory", block_content="Likes cats."),
+            _tool_call(block_type="no_such_type", block_content="Bad type."),
+            _tool_call(block_type="memory", block_content="Bad args.", extra=1),
+            _tool_call(block_type="memory", block_content="Is a chef."),
+        ]
+    )
+    agent = _Agent()
+    ctx = ConversationContext().add_message(by="me", content="I am a chef.")
+    response = AgentResponse(
+        mood="calm",
+        tone="warm",
+        sentiment="positive",
+        rationale="",
+        text_response="Nice!",
+    )
+    with MemoryExtractor(client=client) as extractor:
+        extractor.submit(agent, ctx, response)
+        extractor.flush()
+        stats = extractor.stats()
+    assert [block.block_content for block in agent.context_blocks] == [
+        "Likes cats.",
+        "Is a chef.",
+    ]
+    assert stats["inserted"] == 2
+    assert stats["invalid_calls"] == 2
+    assert stats["failures"] == 0
@@ -0,0 +1,30 @@
+from hoho_talk.pool import AgentPool
+
+
+class _Agent:
+    def __init__(self, **config):
+        self.config = config
+
+    def _rebind(self, **kwargs):
+        pass
+
+
+def test_agent_pool_keeps_the_most_recent_configs():
+    pool = AgentPool(max_idle=2, max_configs=3)
+    for idx in range(10):
+        with pool.borrow(_Agent, {"client": object(), "idx": idx}):
+            pass
+    stats = pool.stats()
+    assert stats["configs"] == 3
+    assert stats["idle"] == 3
+    assert stats["evicted"] == 7
+
+
+def test_agent_pool_reuses_the_idle_agents():
+    pool = AgentPool(max_configs=1)
+    client = object()
+    with pool.borrow(_Agent, {"client": client}) as first:
+        pass
+    with pool.borrow(_Agent, {"client": client}) as second:
+        assert second is first
+    assert pool.stats()["reused"] == 1
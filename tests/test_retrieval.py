@@ -0,0 +1,59 @@
+import pytest
+
+from hoho_talk.data import BlockType, ContextBlock
+
+np = pytest.importorskip("numpy")
+
+from hoho_talk.retrieval import ContextBlockIndex  # noqa: E402
+
+
+class _EmbedClient:
+    """
+    A client embedding the texts by their character counts.
+    """
+
+    def __init__(self):
+        self.embedded: list[str] = []
+
+    def embed(self, model: str, input: list[str], **kwargs):
+        self.embedded.extend(input)
+        return type(
+            "EmbedResponse",
+            (),
+            {"embeddings": [[text.count(c) + 0.1 for c in "abcde"] for text in input]},
+        )
+
+
+def _blocks(*contents: str) -> list[ContextBlock]:
+    return [
+        ContextBlock(block_type=BlockType.context, block_content=content)
+        for content in contents
+    ]
+
+
+def test_cache_appended_across_runs(tmp_path):
+    client = _EmbedClient()
+    ContextBlockIndex(client=client, cache_dir=tmp_path).add(_blocks("aaa", "bbb"))
+    index = ContextBlockIndex(client=client, cache_dir=tmp_path)
+    index.add(_blocks("aaa", "ccc"))
+    assert client.embedded == ["aaa", "bbb", "ccc"]
+    index = ContextBlockIndex(client=client, cache_dir=tmp_path)
+    index.add(_blocks("ccc", "bbb", "aaa"))
+    assert client.embedded == ["aaa", "bbb", "ccc"]
+    assert [block.block_content for block in index.search("cc", 1)] == ["ccc"]
+
+
+def test_interrupted_append_dropped(tmp_path):
+    client = _EmbedClient()
+    ContextBlockIndex(client=client, cache_dir=tmp_path).add(_blocks("aaa", "bbb"))
+    cache_dir = next(tmp_path.iterdir())
+    with (cache_dir / "vectors.f32").open("ab") as fid:
+        fid.write(b"\0" * 6)
+    with (cache_dir / "keys.jsonl").open("a") as fid:
+        fid.write('"partial')
+    index = ContextBlockIndex(client=client, cache_dir=tmp_path)
+    index.add(_blocks("ccc"))
+    index = ContextBlockIndex(client=client, cache_dir=tmp_path)
+    index.add(_blocks("aaa", "bbb", "ccc"))
+    assert client.embedded == ["aaa", "bbb", "ccc"]
+    assert [block.block_content for block in index.search("aa", 1)] == ["aaa"]
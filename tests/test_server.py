@@ -0,0 +1,35 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+from hoho_talk.server import TalkServer
+
+
+def _failing_factory(**kwargs):
+    raise RuntimeError("no agent")
+
+
+def test_unexpected_error_returns_json_500():
+    server = TalkServer(port=0, agent_factory=_failing_factory)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        request = urllib.request.Request(
+            f"{server.url}/sessions",
+            data=json.dumps({"name": "a", "persona": "b"}).encode("utf-8"),
+            method="POST",
+        )
+        try:
+            urllib.request.urlopen(request, timeout=5)
+        except urllib.error.HTTPError as error:
+            assert error.code == 500
+            assert "no agent" in json.load(error)["error"]
+        else:
+            raise AssertionError("the request should fail")
+        # the server still serves the next requests
+        with urllib.request.urlopen(f"{server.url}/health", timeout=5) as response:
+            assert json.load(response) == {"status": "ok"}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,35 @@
+from hoho_talk.compact import CompactConversation, CompactConversationContext
+from hoho_talk.data import ConversationContext, ConversationMessage
+
+
+def _messages(by: str, count: int) -> list[ConversationMessage]:
+    return [ConversationMessage(by=by, content=f"{by} {idx}") for idx in range(count)]
+
+
+def test_transcript_rendered_again_when_conversation_reassigned():
+    ctx = ConversationContext().extend(_messages("alice", 2))
+    assert "alice 1" in ctx.transcript
+    ctx.conversation = _messages("bob", 3)
+    assert "alice" not in ctx.transcript
+    assert "bob 2" in ctx.transcript
+
+
+def test_transcript_rendered_again_when_last_message_edited():
+    ctx = ConversationContext().extend(_messages("alice", 2))
+    assert ctx.transcript.endswith("alice 1")
+    ctx.conversation[-1] = ConversationMessage(by="bob", content="replaced")
+    assert ctx.transcript.endswith("replaced")
+    ctx.conversation[-1].content = "edited"
+    assert ctx.transcript.endswith("edited")
+    ctx.add_message(by="carol", content="new")
+    assert ctx.transcript == "\n".join(
+        msg.to_transcript_line() for msg in ctx.conversation
+    )
+
+
+def test_compact_transcript_rendered_again_when_conversation_reassigned():
+    ctx = CompactConversationContext().extend(_messages("alice", 2))
+    assert "alice 1" in ctx.transcript
+    ctx.conversation = CompactConversation(_messages("bob", 3))
+    assert "alice" not in ctx.transcript
+    assert "bob 2" in ctx.transcript